@@ -0,0 +1,123 @@
+import numpy as np
+import cv2 as cv
+
+
+class BlobDetector:
+    """
+    Finds the bright marker blobs in a frame.
+
+    Blobs are labelled with `cv.connectedComponentsWithStats` and located with
+    an intensity weighted centroid, which gives sub-pixel image points.
+    `detect` returns a (K, 4) float32 array with one row per blob:
+
+        [x, y, area (pixels), mean intensity]
+
+    Blobs with an area outside [min_area, max_area] or whose fill of their
+    bounding ellipse is below min_circularity are dropped.
+
+    """
+
+    X = 0
+    Y = 1
+    AREA = 2
+    INTENSITY = 3
+
+    def __init__(self, threshold=255*0.2, min_area=1, max_area=None, min_circularity=0.0, annotate=True):
+        self.threshold = threshold
+        self.min_area = min_area
+        self.max_area = max_area
+        self.min_circularity = min_circularity
+        self.annotate = annotate
+
+    def detect(self, img, windows=None):
+        """
+        Finds the blobs in the whole frame, or if `windows` (a (K, 4) array of
+        [x0, y0, x1, y1] pixel rectangles) is given, only inside those windows.
+
+        """
+        if windows is None:
+            blobs = self._detect(img)
+        else:
+            windows = merge_windows(windows)
+            blobs = [np.empty((0, 4), dtype=np.float32)]
+            for x0, y0, x1, y1 in windows:
+                window_blobs = self._detect(img[y0:y1, x0:x1])
+                window_blobs[:, self.X] += x0
+                window_blobs[:, self.Y] += y0
+                blobs.append(window_blobs)
+            blobs = np.concatenate(blobs)
+
+        if self.annotate:
+            self.draw(img, blobs)
+            if windows is not None:
+                for x0, y0, x1, y1 in windows:
+                    cv.rectangle(img, (int(x0), int(y0)), (int(x1) - 1, int(y1) - 1), (255,100,100), 1)
+
+        return blobs
+
+    def _detect(self, img):
+        grey = cv.cvtColor(img, cv.COLOR_RGB2GRAY)
+        binary = cv.threshold(grey, self.threshold, 255, cv.THRESH_BINARY)[1]
+        num_labels, labels, stats, _ = cv.connectedComponentsWithStats(binary, connectivity=8)
+
+        if num_labels <= 1:
+            return np.empty((0, 4), dtype=np.float32)
+
+        # intensity weighted centroids, only looking at the (few) lit pixels
+        ys, xs = np.nonzero(binary)
+        label_ids = labels[ys, xs]
+        weights = grey[ys, xs].astype(np.float64) - self.threshold + 1
+        weight_sums = np.bincount(label_ids, weights=weights, minlength=num_labels)
+        with np.errstate(divide="ignore", invalid="ignore"): # the background label has no lit pixels
+            center_x = np.bincount(label_ids, weights=weights*xs, minlength=num_labels) / weight_sums
+            center_y = np.bincount(label_ids, weights=weights*ys, minlength=num_labels) / weight_sums
+        intensity = np.bincount(label_ids, weights=grey[ys, xs], minlength=num_labels)
+
+        area = stats[:, cv.CC_STAT_AREA].astype(np.float64)
+        circularity = area / (np.pi/4 * stats[:, cv.CC_STAT_WIDTH] * stats[:, cv.CC_STAT_HEIGHT])
+
+        keep = area >= self.min_area
+        if self.max_area is not None:
+            keep &= area <= self.max_area
+        if self.min_circularity > 0:
+            keep &= circularity >= self.min_circularity
+        keep[0] = False # background
+
+        return np.column_stack((center_x, center_y, area, intensity / area))[keep].astype(np.float32)
+
+    @staticmethod
+    def draw(img, blobs):
+        for center_x, center_y in blobs[:, :2]:
+            center = (int(round(center_x)), int(round(center_y)))
+            cv.putText(img, f'({center_x:.1f}, {center_y:.1f})', (center[0], center[1] - 15), cv.FONT_HERSHEY_SIMPLEX, 0.3, (100,255,100), 1)
+            cv.circle(img, center, 1, (100,255,100), -1)
+
+        return img
+
+
+def merge_windows(windows):
+    """
+    Merges overlapping [x0, y0, x1, y1] windows so no blob is found twice.
+    """
+    windows = [list(window) for window in np.asarray(windows, dtype=np.int64)]
+
+    merged = True
+    while merged:
+        merged = False
+        for i in range(0, len(windows)):
+            for j in range(i+1, len(windows)):
+                a, b = windows[i], windows[j]
+                if a[0] < b[2] and b[0] < a[2] and a[1] < b[3] and b[1] < a[3]:
+                    windows[i] = [min(a[0], b[0]), min(a[1], b[1]), max(a[2], b[2]), max(a[3], b[3])]
+                    del windows[j]
+                    merged = True
+                    break
+            if merged:
+                break
+
+    return windows
+
+
+def blobs_to_image_points(blobs):
+    """ The (K, 2) float32 image points of the blobs, with no rows if none were found. """
+    return np.ascontiguousarray(blobs[:, :2], dtype=np.float32)
@@ -0,0 +1,168 @@
+import time
+import numpy as np
+from scipy import optimize, sparse
+from scipy.spatial.transform import Rotation
+
+
+class BundleAdjustment:
+    """
+    Jointly refines the camera poses, focal lengths and object points so the
+    object points reproject onto the observed image points.
+
+    Camera 0 stays where it is and fixes the coordinate frame, and the largest
+    coordinate of camera 1's translation is held (softly) where it starts,
+    which fixes the scale. The parameters are, in order, a rotation vector and
+    translation for each of the other cameras, a focal length per camera
+    relative to its starting one (if `optimize_focal_lengths`), then the
+    object points. Every residual (an x or y pixel error of one observation)
+    depends on one camera and one point only, so the Jacobian is very sparse:
+    its sparsity pattern is handed to `optimize.least_squares`, which then needs
+    only a handful of residual evaluations per Jacobian however many cameras
+    and points there are, and solves with a sparse trust region solver.
+
+    image_points: (N points, C cameras, 2) pixel coordinates, NaN where a
+        camera didn't see the point
+    intrinsic_matrices: (C, 3, 3), the principal points stay fixed
+    camera_poses: list of {"R", "t"} to start from
+    object_points: (N, 3) to start from, e.g. triangulated with the initial poses
+
+    Points seen by fewer than two cameras, or without a starting position, are
+    left out.
+
+    """
+
+    scale_weight = 1e3 # pixels per unit of translation
+
+    def __init__(self, image_points, intrinsic_matrices, camera_poses, object_points, optimize_focal_lengths=True):
+        image_points = np.asarray(image_points, dtype=np.float64)
+        object_points = np.asarray(object_points, dtype=np.float64)
+        intrinsic_matrices = np.asarray(intrinsic_matrices, dtype=np.float64)
+
+        self.num_cameras = len(camera_poses)
+        self.num_input_points = len(image_points)
+        self.optimize_focal_lengths = optimize_focal_lengths
+
+        observed = ~np.any(np.isnan(image_points), axis=2)
+        used = (np.sum(observed, axis=1) >= 2) & ~np.any(np.isnan(object_points), axis=1)
+        self.point_indices = np.nonzero(used)[0]
+        self.num_points = len(self.point_indices)
+
+        # one row per observation
+        self.point_index, self.camera_index = np.nonzero(observed[used])
+        self.observations = image_points[used][self.point_index, self.camera_index]
+
+        self.principal_points = intrinsic_matrices[:, 0:2, 2]
+        self.focal_lengths = intrinsic_matrices[:, 0, 0].copy()
+
+        self.R0 = np.asarray(camera_poses[0]["R"], dtype=np.float64)
+        self.t0 = np.asarray(camera_poses[0]["t"], dtype=np.float64).reshape(3)
+
+        pose_params = [np.concatenate((Rotation.from_matrix(np.asarray(camera_pose["R"], dtype=np.float64)).as_rotvec(),
+                                       np.asarray(camera_pose["t"], dtype=np.float64).reshape(3))) for camera_pose in camera_poses[1:]]
+        self.initial_params = np.concatenate([
+            np.ravel(pose_params),
+            self.focal_lengths if optimize_focal_lengths else [],
+            object_points[used].ravel()
+        ])
+
+        self.focal_offset = 6 * (self.num_cameras - 1)
+        self.points_offset = self.focal_offset + (self.num_cameras if optimize_focal_lengths else 0)
+        if optimize_focal_lengths:
+            self.initial_params[self.focal_offset:self.points_offset] = 1
+
+        # without this, scaling every translation and point together would change nothing
+        self.scale_param = None
+        if self.num_cameras > 1:
+            self.scale_param = 3 + int(np.argmax(np.abs(self.initial_params[3:6])))
+            self.scale_value = self.initial_params[self.scale_param]
+
+    def unpack(self, params):
+        """ (C, 3, 3) rotations, (C, 3) translations, (C,) focal lengths and (P, 3) object points """
+        pose_params = params[:self.focal_offset].reshape((-1, 6))
+        Rs = np.concatenate((self.R0[np.newaxis], Rotation.from_rotvec(pose_params[:, :3]).as_matrix().reshape((-1, 3, 3))))
+        ts = np.concatenate((self.t0[np.newaxis], pose_params[:, 3:]))
+        focal_lengths = self.focal_lengths * params[self.focal_offset:self.points_offset] if self.optimize_focal_lengths else self.focal_lengths
+        object_points = params[self.points_offset:].reshape((-1, 3))
+
+        return Rs, ts, focal_lengths, object_points
+
+    def project(self, params):
+        """ (M, 2) reprojection of every observation """
+        Rs, ts, focal_lengths, object_points = self.unpack(params)
+        camera_points = np.einsum("mij,mj->mi", Rs[self.camera_index], object_points[self.point_index]) + ts[self.camera_index]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            image_points = camera_points[:, :2] / camera_points[:, 2:]
+
+        return focal_lengths[self.camera_index, np.newaxis] * image_points + self.principal_points[self.camera_index]
+
+    def residuals(self, params):
+        """ The x and y pixel errors of every observation, then the scale constraint """
+        residuals = (self.project(params) - self.observations).ravel()
+        if self.scale_param is None:
+            return residuals
+
+        return np.append(residuals, self.scale_weight * (params[self.scale_param] - self.scale_value))
+
+    def jac_sparsity(self):
+        """ Which parameters each residual depends on: its point, its camera's focal length and pose """
+        observations = np.arange(len(self.observations))
+        moving = self.camera_index != 0 # camera 0's pose isn't a parameter
+        blocks = [
+            (observations, self.points_offset + 3 * self.point_index, 3),
+            (observations[moving], 6 * (self.camera_index[moving] - 1), 6)
+        ]
+        if self.optimize_focal_lengths:
+            blocks.append((observations, self.focal_offset + self.camera_index, 1))
+
+        rows = []
+        columns = []
+        for block_observations, first_columns, width in blocks:
+            for k in range(0, width):
+                for xy in range(0, 2):
+                    rows.append(2 * block_observations + xy)
+                    columns.append(first_columns + k)
+        if self.scale_param is not None:
+            rows.append([2 * len(self.observations)])
+            columns.append([self.scale_param])
+        rows = np.concatenate(rows)
+        columns = np.concatenate(columns)
+
+        num_residuals = 2 * len(self.observations) + (self.scale_param is not None)
+        return sparse.coo_matrix((np.ones(len(rows), dtype=np.int8), (rows, columns)), shape=(num_residuals, len(self.initial_params))).tocsr()
+
+    def camera_poses(self, params):
+        """ {"R", "t", "focal_length"} of every camera """
+        Rs, ts, focal_lengths, _ = self.unpack(params)
+        return [{"R": R, "t": t, "focal_length": focal_length} for R, t, focal_length in zip(Rs, ts, focal_lengths)]
+
+    def solve(self, progress=None, progress_interval=0.25, loss="soft_l1", f_scale=2.0, ftol=1e-4, verbose=2):
+        """
+        Runs the optimization and returns the camera poses (with their focal
+        lengths), the focal lengths and the (N, 3) object points (NaN for points
+        that were left out).
+
+        `progress`, if given, is called with the current camera poses at most
+        once every `progress_interval` seconds while the optimization runs.
+        Observations more than about `f_scale` pixels off are down-weighted by
+        the robust `loss`.
+        """
+        last_progress_time = time.time()
+
+        def residual_function(params):
+            nonlocal last_progress_time
+            if progress is not None and time.time() - last_progress_time >= progress_interval:
+                last_progress_time = time.time()
+                progress(self.camera_poses(params))
+
+            return self.residuals(params)
+
+        res = optimize.least_squares(
+            residual_function, self.initial_params, jac_sparsity=self.jac_sparsity(), x_scale="jac",
+            loss=loss, f_scale=f_scale, ftol=ftol, method="trf", tr_solver="lsmr", verbose=verbose
+        )
+
+        _, _, focal_lengths, object_points = self.unpack(res.x)
+        all_object_points = np.full((self.num_input_points, 3), np.nan)
+        all_object_points[self.point_indices] = object_points
+
+        return self.camera_poses(res.x), np.array(focal_lengths), all_object_points
@@ -0,0 +1,104 @@
+import threading
+import numpy as np
+
+
+class CalibrationCapture:
+    """
+    Collects the image points of a single marker waved around for camera pose
+    calibration, on the server, as they are found.
+
+    Observations are stored in a preallocated (capacity, C, 2) float array,
+    NaN where a camera didn't see the marker.
+
+    To keep the dataset small and evenly spread, observations are balanced
+    over the cameras' images rather than over a voxel grid of the capture
+    volume: the points are captured to find the camera poses, so there is no
+    3D position to bin them by yet. Every camera's image is divided into a
+    `grid_size` x `grid_size` grid and an observation is only kept if, for at
+    least one camera that saw it, its grid cell holds fewer than
+    `max_per_cell` observations so far. A marker hovering in one place then
+    adds a few observations rather than hundreds, and each camera ends up with
+    points across its whole image, which is what the pose estimation needs.
+
+    """
+
+    def __init__(self, num_cameras, image_size, capacity=5000, grid_size=10, max_per_cell=10, min_cameras=2):
+        self.num_cameras = num_cameras
+        self.image_size = image_size
+        self.capacity = capacity
+        self.grid_size = grid_size
+        self.max_per_cell = max_per_cell
+        self.min_cameras = min_cameras
+
+        self.lock = threading.Lock()
+        self.points = np.full((capacity, num_cameras, 2), np.nan, dtype=np.float32)
+        self.cell_counts = np.zeros((num_cameras, grid_size * grid_size), dtype=np.int64)
+        self.pair_counts = np.zeros((num_cameras, num_cameras), dtype=np.int64)
+        self.count = 0
+
+        self.offered = 0
+        self.redundant = 0
+        self.dropped = 0
+
+    def add(self, image_points):
+        """
+        Offers one frame's observation, a (C, 2) array with NaN for cameras that
+        didn't see the marker. Returns whether it was kept.
+        """
+        image_points = np.asarray(image_points, dtype=np.float32).reshape((self.num_cameras, 2))
+        seen = ~np.any(np.isnan(image_points), axis=1)
+
+        with self.lock:
+            self.offered += 1
+            if np.sum(seen) < self.min_cameras:
+                return False
+
+            cameras = np.nonzero(seen)[0]
+            cells = np.clip((image_points[seen] * self.grid_size / self.image_size).astype(np.int64), 0, self.grid_size - 1)
+            cells = cells[:, 1] * self.grid_size + cells[:, 0]
+            if np.all(self.cell_counts[cameras, cells] >= self.max_per_cell):
+                self.redundant += 1
+                return False
+            if self.count >= self.capacity:
+                self.dropped += 1
+                return False
+
+            self.points[self.count] = image_points
+            self.count += 1
+            self.cell_counts[cameras, cells] += 1
+            self.pair_counts[np.ix_(cameras, cameras)] += 1
+
+            return True
+
+    def image_points(self):
+        """ (N, C, 2) float64 copy of the kept observations, NaN where a camera didn't see the marker. """
+        with self.lock:
+            return self.points[:self.count].astype(np.float64)
+
+    def stats(self):
+        """
+        How much has been captured: `observations` per camera, `pairs` seen
+        together by each pair of cameras, and `coverage`, the fraction of each
+        camera's grid cells with at least one observation.
+        """
+        with self.lock:
+            return {
+                "count": self.count,
+                "capacity": self.capacity,
+                "offered": self.offered,
+                "redundant": self.redundant,
+                "dropped": self.dropped,
+                "observations": np.diag(self.pair_counts).tolist(),
+                "pairs": self.pair_counts.tolist(),
+                "coverage": (np.count_nonzero(self.cell_counts, axis=1) / self.cell_counts.shape[1]).tolist()
+            }
+
+    def reset(self):
+        with self.lock:
+            self.points[:self.count] = np.nan
+            self.cell_counts[:] = 0
+            self.pair_counts[:] = 0
+            self.count = 0
+            self.offered = 0
+            self.redundant = 0
+            self.dropped = 0
@@ -0,0 +1,289 @@
+import numpy as np
+import cv2 as cv
+import time
+from abc import ABC, abstractmethod
+from FrameRecorder import FrameRecording
+
+
+class CameraBackend(ABC):
+    """
+    Where frames come from. `read` returns a list of (height, width, 3) RGB
+    frames, one per camera, and their capture timestamps, like pseyepy does.
+    Hardware is only opened on first use. Subclasses implement `_num_cameras`
+    and `_read`, and can't be constructed without them.
+
+    """
+
+    def __init__(self, gain=10, exposure=100):
+        self._gain = gain
+        self._exposure = exposure
+        self.is_open = False
+
+    def open(self):
+        self.is_open = True
+
+    def _ensure_open(self):
+        if not self.is_open:
+            self.open()
+
+    @property
+    def num_cameras(self):
+        self._ensure_open()
+        return self._num_cameras()
+
+    @abstractmethod
+    def _num_cameras(self):
+        pass
+
+    def read(self):
+        self._ensure_open()
+        return self._read()
+
+    @abstractmethod
+    def _read(self):
+        pass
+
+    # per camera lists, as pseyepy exposes them
+    @property
+    def exposure(self):
+        return [self._exposure] * self.num_cameras
+
+    @exposure.setter
+    def exposure(self, exposure):
+        self._exposure = exposure[0] if isinstance(exposure, (list, tuple)) else exposure
+
+    @property
+    def gain(self):
+        return [self._gain] * self.num_cameras
+
+    @gain.setter
+    def gain(self, gain):
+        self._gain = gain[0] if isinstance(gain, (list, tuple)) else gain
+
+    def close(self):
+        self.is_open = False
+
+
+class PsEyeCameraBackend(CameraBackend):
+    """ PS3 Eye cameras through pseyepy, which is only imported when they are opened. """
+
+    def __init__(self, fps=90, gain=10, exposure=100):
+        super().__init__(gain, exposure)
+        self.fps = fps
+        self.cameras = None
+
+    def open(self):
+        from pseyepy import Camera
+
+        self.cameras = Camera(fps=self.fps, resolution=Camera.RES_SMALL, gain=self._gain, exposure=self._exposure)
+        super().open()
+
+    def _num_cameras(self):
+        return len(self.cameras.exposure)
+
+    def _read(self):
+        return self.cameras.read()
+
+    @CameraBackend.exposure.getter
+    def exposure(self):
+        self._ensure_open()
+        return self.cameras.exposure
+
+    @exposure.setter
+    def exposure(self, exposure):
+        self._ensure_open()
+        self.cameras.exposure = exposure
+
+    @CameraBackend.gain.getter
+    def gain(self):
+        self._ensure_open()
+        return self.cameras.gain
+
+    @gain.setter
+    def gain(self, gain):
+        self._ensure_open()
+        self.cameras.gain = gain
+
+    def close(self):
+        if self.cameras is not None:
+            self.cameras.end()
+            self.cameras = None
+        super().close()
+
+
+class VideoCameraBackend(CameraBackend):
+    """
+    Plays back one video file per camera, in step, at `fps` (or as fast as
+    they can be decoded if `fps` is None). Loops at the end of the shortest one.
+
+    """
+
+    def __init__(self, paths, fps=90, loop=True, gain=10, exposure=100):
+        super().__init__(gain, exposure)
+        self.paths = list(paths)
+        self.fps = fps
+        self.loop = loop
+        self.captures = []
+        self.next_frame_time = None
+
+    def open(self):
+        self.captures = [cv.VideoCapture(path) for path in self.paths]
+        for path, capture in zip(self.paths, self.captures):
+            if not capture.isOpened():
+                raise IOError(f"Can't open video {path}")
+        super().open()
+
+    def _num_cameras(self):
+        return len(self.paths)
+
+    def _read(self):
+        if self.fps is not None:
+            now = time.time()
+            if self.next_frame_time is not None and self.next_frame_time > now:
+                time.sleep(self.next_frame_time - now)
+            self.next_frame_time = max(now, self.next_frame_time or now) + 1/self.fps
+
+        frames = []
+        for capture in self.captures:
+            ok, frame = capture.read()
+            if not ok and self.loop:
+                for other_capture in self.captures:
+                    other_capture.set(cv.CAP_PROP_POS_FRAMES, 0)
+                return self._read()
+            if not ok:
+                raise EOFError("End of video")
+            frames.append(cv.cvtColor(frame, cv.COLOR_BGR2RGB))
+
+        timestamp = time.time()
+        return frames, np.full(len(frames), timestamp)
+
+    def close(self):
+        for capture in self.captures:
+            capture.release()
+        self.captures = []
+        super().close()
+
+
+class SyntheticCameraBackend(CameraBackend):
+    """
+    Renders a few bright dots moving on circles on a dark background, at the
+    pseyepy RES_SMALL resolution. Needs no hardware and is fully deterministic,
+    which makes it a stand in for real cameras when developing or benchmarking.
+
+    `render` can be replaced with any function of (camera index, time) that
+    returns a frame, e.g. a projected 3D scene.
+
+    """
+
+    def __init__(self, num_cameras=4, resolution=(320, 240), fps=90, num_points=3, render=None, gain=10, exposure=100):
+        super().__init__(gain, exposure)
+        self._count = num_cameras
+        self.resolution = resolution
+        self.fps = fps
+        self.num_points = num_points
+        self.render = render if render is not None else self._render_dots
+        self.start_time = None
+        self.next_frame_time = None
+
+    def open(self):
+        self.start_time = time.time()
+        super().open()
+
+    def _num_cameras(self):
+        return self._count
+
+    def _render_dots(self, camera_index, t):
+        width, height = self.resolution
+        frame = np.zeros((height, width, 3), dtype=np.uint8)
+        phases = np.arange(self.num_points) * 2*np.pi / self.num_points + camera_index
+        x = width/2 + width/4 * np.cos(t + phases)
+        y = height/2 + height/4 * np.sin(t + phases)
+        for center in zip(x, y):
+            cv.circle(frame, (int(center[0]), int(center[1])), 2, (255, 255, 255), -1)
+
+        return frame
+
+    def _read(self):
+        if self.fps is not None:
+            now = time.time()
+            if self.next_frame_time is not None and self.next_frame_time > now:
+                time.sleep(self.next_frame_time - now)
+            self.next_frame_time = max(now, self.next_frame_time or now) + 1/self.fps
+
+        timestamp = time.time()
+        t = timestamp - self.start_time
+        frames = [self.render(i, t) for i in range(0, self._count)]
+
+        return frames, np.full(self._count, timestamp)
+
+
+class ReplayCameraBackend(CameraBackend):
+    """
+    Serves frames from a FrameRecorder capture file, zero-copy: the frames
+    returned are read-only views into the memory-mapped file.
+
+    With `speed` set, frames are paced by their recorded timestamps (1.0 is
+    real time), with `speed` None they are served as fast as they are read.
+    Timestamps are shifted to the time of replay, keeping their spacing.
+
+    """
+
+    def __init__(self, path, speed=1.0, loop=True, gain=10, exposure=100):
+        super().__init__(gain, exposure)
+        self.path = path
+        self.speed = speed
+        self.loop = loop
+        self.recording = None
+        self.index = 0
+        self.replay_start_time = None
+        self.recording_start_time = None
+
+    def open(self):
+        self.recording = FrameRecording(self.path)
+        if len(self.recording) == 0:
+            raise EOFError(f"{self.path} has no frames")
+        super().open()
+
+    def _num_cameras(self):
+        return self.recording.num_cameras
+
+    def _read(self):
+        if self.index >= len(self.recording):
+            if not self.loop:
+                raise EOFError("End of recording")
+            self.index = 0
+            self.replay_start_time = None
+
+        frames, timestamps = self.recording[self.index]
+        self.index += 1
+
+        now = time.time()
+        if self.replay_start_time is None:
+            self.replay_start_time = now
+            self.recording_start_time = timestamps[0]
+
+        offset = self.replay_start_time - self.recording_start_time
+        if self.speed is not None:
+            frame_time = self.replay_start_time + (timestamps[0] - self.recording_start_time) / self.speed
+            if frame_time > now:
+                time.sleep(frame_time - now)
+            offset = frame_time - timestamps[0]
+
+        return frames, timestamps + offset
+
+    def close(self):
+        self.recording = None
+        super().close()
+
+
+def create_camera_backend(name, **options):
+    backends = {
+        "pseye": PsEyeCameraBackend,
+        "video": VideoCameraBackend,
+        "synthetic": SyntheticCameraBackend,
+        "replay": ReplayCameraBackend,
+    }
+    if name not in backends:
+        raise ValueError(f"Unknown camera backend {name}, expected one of {', '.join(backends)}")
+
+    return backends[name](**options)
@@ -0,0 +1,109 @@
+import multiprocessing as mp
+from multiprocessing import shared_memory
+import numpy as np
+from FramePreprocessor import FramePreprocessor
+from BlobDetector import blobs_to_image_points
+
+
+def _camera_worker(camera_model, blob_detector, input_name, input_shape, output_name, output_shape, connection):
+    input_shm = shared_memory.SharedMemory(name=input_name)
+    output_shm = shared_memory.SharedMemory(name=output_name)
+    frame = np.ndarray(input_shape, dtype=np.uint8, buffer=input_shm.buf)
+    output = np.ndarray(output_shape, dtype=np.uint8, buffer=output_shm.buf)
+    frame_preprocessor = FramePreprocessor(camera_model)
+
+    try:
+        while True:
+            message = connection.recv()
+            if message is None:
+                break
+            find_dots, windows = message
+
+            frame_preprocessor.process(frame, out=output)
+
+            image_points = None
+            if find_dots:
+                image_points = blobs_to_image_points(blob_detector.detect(output, windows))
+
+            connection.send(image_points)
+    finally:
+        del frame, output
+        input_shm.close()
+        output_shm.close()
+
+
+class CameraProcessPool:
+    """
+    Runs the preprocessing and dot finding of each camera in its own worker
+    process. Raw frames are handed to the workers and processed frames handed
+    back through shared memory; only the image points go through a pipe.
+
+    The returned frames are views of the shared memory, so they are only valid
+    until the next call to `process`.
+
+    """
+
+    def __init__(self, camera_models, blob_detector):
+        self.camera_models = list(camera_models)
+        self.blob_detector = blob_detector
+        self.input_shape = None
+        self.workers = []
+
+    def _start(self, input_shape):
+        context = mp.get_context("spawn")
+        size = max(input_shape[:2])
+        output_shape = (size, size, *input_shape[2:])
+
+        for camera_model in self.camera_models:
+            input_shm = shared_memory.SharedMemory(create=True, size=int(np.prod(input_shape)))
+            output_shm = shared_memory.SharedMemory(create=True, size=int(np.prod(output_shape)))
+            connection, worker_connection = context.Pipe()
+            process = context.Process(
+                target=_camera_worker,
+                args=(camera_model, self.blob_detector, input_shm.name, input_shape, output_shm.name, output_shape, worker_connection),
+                daemon=True
+            )
+            process.start()
+
+            self.workers.append({
+                "process": process,
+                "connection": connection,
+                "input_shm": input_shm,
+                "output_shm": output_shm,
+                "input": np.ndarray(input_shape, dtype=np.uint8, buffer=input_shm.buf),
+                "output": np.ndarray(output_shape, dtype=np.uint8, buffer=output_shm.buf),
+            })
+
+        self.input_shape = input_shape
+
+    def process(self, frames, find_dots, windows=None):
+        if frames[0].shape != self.input_shape:
+            self.close()
+            self._start(frames[0].shape)
+
+        for i, (worker, frame) in enumerate(zip(self.workers, frames)):
+            worker["input"][...] = frame
+            worker["connection"].send((find_dots, None if windows is None else windows[i]))
+
+        image_points = [worker["connection"].recv() for worker in self.workers]
+        frames = [worker["output"] for worker in self.workers]
+
+        return frames, image_points
+
+    def close(self):
+        for worker in self.workers:
+            try:
+                worker["connection"].send(None)
+            except (BrokenPipeError, OSError):
+                pass
+            worker["process"].join(timeout=1)
+            if worker["process"].is_alive():
+                worker["process"].terminate()
+
+            del worker["input"], worker["output"]
+            for shm in (worker["input_shm"], worker["output_shm"]):
+                shm.close()
+                shm.unlink()
+
+        self.workers = []
+        self.input_shape = None
@@ -0,0 +1,118 @@
+import json
+import os
+import numpy as np
+
+
+def _read_only(array):
+    array = np.array(array, dtype=np.float64)
+    array.setflags(write=False)
+    return array
+
+
+def fundamental_from_projections(P1, P2):
+    """
+    Fundamental matrix F between two cameras such that x2.T @ F @ x1 = 0.
+    Same construction and convention as cv.sfm.fundamentalFromProjections.
+
+    """
+    X = [P1[[1, 2]], P1[[2, 0]], P1[[0, 1]]]
+    Y = [P2[[1, 2]], P2[[2, 0]], P2[[0, 1]]]
+
+    F = np.empty((3, 3))
+    for i in range(0, 3):
+        for j in range(0, 3):
+            F[i, j] = np.linalg.det(np.vstack((X[j], Y[i])))
+
+    return F
+
+
+class CameraModel:
+    """
+    Intrinsics and pose of a single camera, with the projection matrix
+    precomputed. Instances are immutable: use `with_pose` or
+    `with_focal_length` to get an updated copy.
+
+    """
+
+    def __init__(self, intrinsic_matrix, distortion_coef, rotation=0, R=None, t=None):
+        self.intrinsic_matrix = _read_only(intrinsic_matrix)
+        self.distortion_coef = _read_only(distortion_coef)
+        self.rotation = int(rotation)
+        self.R = _read_only(np.eye(3) if R is None else R)
+        self.t = _read_only(np.zeros(3) if t is None else np.reshape(t, 3))
+        self.P = _read_only(self.intrinsic_matrix @ np.c_[self.R, self.t])
+        self._initialized = True
+
+    def __setattr__(self, name, value):
+        if getattr(self, "_initialized", False):
+            raise AttributeError("CameraModel is immutable")
+        super().__setattr__(name, value)
+
+    @staticmethod
+    def from_params(camera_params):
+        return CameraModel(camera_params["intrinsic_matrix"], camera_params["distortion_coef"], camera_params["rotation"])
+
+    def with_pose(self, R, t):
+        return CameraModel(self.intrinsic_matrix, self.distortion_coef, self.rotation, R, t)
+
+    def with_focal_length(self, focal_length):
+        intrinsic_matrix = self.intrinsic_matrix.copy()
+        intrinsic_matrix[0, 0] = focal_length
+        intrinsic_matrix[1, 1] = focal_length
+        return CameraModel(intrinsic_matrix, self.distortion_coef, self.rotation, self.R, self.t)
+
+
+class CameraRig:
+    """
+    A set of posed cameras along with everything the tracking hot path needs
+    from them, computed once:
+
+    Ps: (C, 3, 4) stacked projection matricies
+    fundamental_matrices: (C, C, 3, 3), where fundamental_matrices[i, j] maps an
+        image point in camera i to its epipolar line in camera j
+
+    """
+
+    def __init__(self, camera_models):
+        self.camera_models = tuple(camera_models)
+        self.num_cameras = len(self.camera_models)
+        self.Ps = _read_only([camera_model.P for camera_model in self.camera_models])
+
+        fundamental_matrices = np.zeros((self.num_cameras, self.num_cameras, 3, 3))
+        for i in range(0, self.num_cameras):
+            for j in range(0, self.num_cameras):
+                if i != j:
+                    fundamental_matrices[i, j] = fundamental_from_projections(self.Ps[i], self.Ps[j])
+        self.fundamental_matrices = _read_only(fundamental_matrices)
+
+    def __len__(self):
+        return self.num_cameras
+
+    @staticmethod
+    def from_poses(camera_models, camera_poses):
+        return CameraRig(posed_camera_models(camera_models, camera_poses))
+
+
+def posed_camera_models(camera_models, camera_poses):
+    """
+    The camera models with the poses, {"R", "t"} and optionally a
+    "focal_length" found by bundle adjustment, applied. The refined focal
+    length only changes the projection, frames are still undistorted with the
+    calibrated intrinsics they were captured with.
+    """
+    posed_models = []
+    for camera_model, camera_pose in zip(camera_models, camera_poses):
+        if camera_pose.get("focal_length") is not None:
+            camera_model = camera_model.with_focal_length(camera_pose["focal_length"])
+        posed_models.append(camera_model.with_pose(camera_pose["R"], camera_pose["t"]))
+
+    return posed_models
+
+
+def load_camera_models(num_cameras):
+    """ The intrinsics from camera-params.json, reused in turn if more cameras are asked for. """
+    filename = os.path.join(os.path.dirname(__file__), "camera-params.json")
+    with open(filename) as f:
+        camera_params = json.load(f)
+
+    return [CameraModel.from_params(camera_params[i % len(camera_params)]) for i in range(0, num_cameras)]
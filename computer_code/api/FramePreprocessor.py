@@ -0,0 +1,94 @@
+import numpy as np
+import cv2 as cv
+
+
+class FramePreprocessor:
+    """
+    The per frame image pipeline of a single camera: rotate, pad to a square,
+    undistort, blur, sharpen and convert to BGR.
+
+    The rotate + pad + undistort geometry is folded into a single lookup table
+    which is computed once (on the first frame, when the input size is known)
+    and applied with one `cv.remap`. All intermediate images are written into
+    preallocated buffers, so the returned frame is only valid until the next
+    call to `process`, unless an `out` array is given.
+
+    """
+
+    kernel = np.array([[-2,-1,-1,-1,-2],
+                       [-1,1,3,1,-1],
+                       [-1,3,4,3,-1],
+                       [-1,1,3,1,-1],
+                       [-2,-1,-1,-1,-2]], dtype=np.float32)
+
+    def __init__(self, camera_model):
+        self.camera_model = camera_model
+        self.input_shape = None
+
+    def _square_to_input(self, x, y, input_shape):
+        """
+        Maps coordinates in the (distorted) rotated and padded square image back
+        to the camera frame they came from.
+        """
+        h, w = input_shape[:2]
+        k = self.camera_model.rotation % 4
+        rotated_h, rotated_w = (h, w) if k % 2 == 0 else (w, h)
+        size = max(h, w)
+        ax, ay = (size - rotated_w)//2, (size - rotated_h)//2
+
+        # undo the square padding
+        rotated_x = x - ax
+        rotated_y = y - ay
+
+        # undo np.rot90(frame, k)
+        if k == 0:
+            return rotated_x, rotated_y
+        elif k == 1:
+            return (w - 1) - rotated_y, rotated_x
+        elif k == 2:
+            return (w - 1) - rotated_x, (h - 1) - rotated_y
+        else:
+            return rotated_y, (h - 1) - rotated_x
+
+    def _build(self, input_shape):
+        size = max(input_shape[:2])
+
+        # for every pixel of the undistorted square image, where it comes from in the distorted square image
+        K = np.array(self.camera_model.intrinsic_matrix)
+        map_x, map_y = cv.initUndistortRectifyMap(K, np.array(self.camera_model.distortion_coef), None, K, (size, size), cv.CV_32FC1)
+        source_x, source_y = self._square_to_input(map_x, map_y, input_shape)
+
+        self.map1, self.map2 = cv.convertMaps(source_x.astype(np.float32), source_y.astype(np.float32), cv.CV_16SC2)
+
+        output_shape = (size, size, *input_shape[2:])
+        self.undistorted = np.empty(output_shape, dtype=np.uint8)
+        self.blurred = np.empty(output_shape, dtype=np.uint8)
+        self.output = np.empty(output_shape, dtype=np.uint8)
+
+        self.input_shape = input_shape
+
+    def process(self, frame, out=None):
+        if frame.shape != self.input_shape:
+            self._build(frame.shape)
+
+        # pixels that fall outside the camera image (the square padding) are left black
+        cv.remap(frame, self.map1, self.map2, cv.INTER_LINEAR, dst=self.undistorted, borderMode=cv.BORDER_CONSTANT, borderValue=0)
+        cv.GaussianBlur(self.undistorted, (9,9), 0, dst=self.blurred)
+        cv.filter2D(self.blurred, -1, self.kernel, dst=self.undistorted)
+        out = self.output if out is None else out
+        cv.cvtColor(self.undistorted, cv.COLOR_RGB2BGR, dst=out)
+
+        return out
+
+    def to_input_coordinates(self, image_points, input_shape):
+        """
+        Where (N, 2) points of the processed (undistorted) image are in the raw
+        camera frame, the inverse of what `process` does to the pixels.
+        """
+        image_points = np.asarray(image_points, dtype=np.float64).reshape((-1, 2))
+        K = np.array(self.camera_model.intrinsic_matrix)
+        normalized = np.c_[image_points, np.ones(len(image_points))] @ np.linalg.inv(K).T
+        distorted, _ = cv.projectPoints(normalized, np.zeros(3), np.zeros(3), K, np.array(self.camera_model.distortion_coef))
+        source_x, source_y = self._square_to_input(distorted[:,0,0], distorted[:,0,1], input_shape)
+
+        return np.column_stack((source_x, source_y))
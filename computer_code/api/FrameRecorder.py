@@ -0,0 +1,168 @@
+import json
+import os
+import struct
+import time
+import numpy as np
+
+# Capture file layout:
+#
+#   header      HEADER_SIZE bytes: the fields below, then json metadata
+#   slots       one per frame: num_cameras float64 timestamps, then
+#               num_cameras x height x width x channels uint8 frames
+#
+# The file grows a chunk of slots at a time as frames are appended, and frames
+# are only ever appended. `count` is written after a frame's data, so a reader
+# never sees a partly written frame.
+
+MAGIC = b"MOCAPREC"
+VERSION = 2
+HEADER = struct.Struct("<8sIIIIIQI") # magic, version, cameras, height, width, channels, count, metadata length
+COUNT_OFFSET = struct.calcsize("<8sIIIII")
+HEADER_SIZE = 1 << 16
+MAX_METADATA_SIZE = HEADER_SIZE - HEADER.size
+
+
+def _slot_dtype(num_cameras, frame_shape):
+    return np.dtype([("timestamps", "<f8", (num_cameras,)), ("frames", np.uint8, (num_cameras, *frame_shape))])
+
+
+def _map_slots(path, slot_dtype, mode):
+    """ Maps every whole slot in the file, as (slots, timestamps, frames) views. """
+    num_slots = (os.path.getsize(path) - HEADER_SIZE) // slot_dtype.itemsize
+    if num_slots == 0:
+        return None, np.empty((0,) + slot_dtype["timestamps"].shape), np.empty((0,) + slot_dtype["frames"].shape, dtype=np.uint8)
+    slots = np.memmap(path, dtype=slot_dtype, mode=mode, offset=HEADER_SIZE, shape=(num_slots,))
+
+    return slots, slots["timestamps"], slots["frames"]
+
+
+class FrameRecorder:
+    """
+    Appends raw multi-camera frames and their timestamps to a memory-mapped
+    capture file with one fixed size slot per frame. Appending is a copy into
+    the mapping; the file is only extended (and remapped) every `chunk_frames`
+    frames, so it takes no more disk than what has been recorded, give or take
+    a chunk, on any file system. Recording stops once `max_duration` seconds
+    have been recorded, if given.
+
+    """
+
+    def __init__(self, path, num_cameras, frame_shape, max_duration=None, metadata=None, chunk_frames=180):
+        self.path = path
+        self.num_cameras = num_cameras
+        self.frame_shape = tuple(frame_shape)
+        if len(self.frame_shape) == 2:
+            self.frame_shape += (1,)
+        self.max_duration = max_duration
+        self.chunk_frames = chunk_frames
+        self.slot_dtype = _slot_dtype(num_cameras, self.frame_shape)
+        self.count = 0
+        self.start_time = None
+
+        metadata = json.dumps(metadata or {}).encode("utf-8")
+        if len(metadata) > MAX_METADATA_SIZE:
+            raise ValueError(f"Metadata is {len(metadata)} bytes, at most {MAX_METADATA_SIZE} fit in the header")
+
+        with open(path, "wb") as f:
+            f.truncate(HEADER_SIZE)
+            f.write(HEADER.pack(MAGIC, VERSION, num_cameras, *self.frame_shape, 0, len(metadata)))
+            f.write(metadata)
+
+        self.header = np.memmap(path, dtype=np.uint8, mode="r+", shape=(HEADER_SIZE,))
+        self.slots = None
+        self.timestamps = self.frames = np.empty(0)
+
+    @property
+    def capacity(self):
+        """ Frames that fit in the file as it is now. """
+        return len(self.timestamps)
+
+    def _grow(self):
+        if self.slots is not None:
+            self.slots.flush()
+        with open(self.path, "r+b") as f:
+            f.truncate(HEADER_SIZE + (self.capacity + self.chunk_frames) * self.slot_dtype.itemsize)
+        self.slots, self.timestamps, self.frames = _map_slots(self.path, self.slot_dtype, "r+")
+
+    def append(self, frames, timestamps):
+        """
+        Records one frame from every camera. Returns False, recording nothing,
+        once `max_duration` has been recorded.
+        """
+        if self.max_duration is not None:
+            if self.start_time is None:
+                self.start_time = timestamps[0]
+            elif timestamps[0] - self.start_time >= self.max_duration:
+                return False
+
+        if self.count >= self.capacity:
+            self._grow()
+
+        slot = self.frames[self.count]
+        for i in range(0, self.num_cameras):
+            slot[i] = frames[i].reshape(self.frame_shape)
+        self.timestamps[self.count] = timestamps
+
+        self.count += 1
+        self.header[COUNT_OFFSET:COUNT_OFFSET+8] = np.frombuffer(struct.pack("<Q", self.count), dtype=np.uint8)
+
+        return True
+
+    def close(self):
+        for array in (self.slots, self.header):
+            if array is not None:
+                array.flush()
+        self.slots = self.header = None
+        self.timestamps = self.frames = np.empty(0)
+
+        # give back the unused end of the last chunk
+        with open(self.path, "r+b") as f:
+            f.truncate(HEADER_SIZE + self.count * self.slot_dtype.itemsize)
+
+
+class FrameRecording:
+    """
+    Read-only view of a capture file. Frames are served straight from the
+    mapping: indexing returns views, nothing is copied until it is used.
+
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            header = f.read(HEADER_SIZE)
+
+        magic, version, num_cameras, height, width, channels, count, metadata_size = HEADER.unpack_from(header)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"{path} is not a version {VERSION} capture file")
+
+        self.num_cameras = num_cameras
+        self.frame_shape = (height, width, channels)
+        self.slot_dtype = _slot_dtype(num_cameras, self.frame_shape)
+        self.metadata = json.loads(header[HEADER.size:HEADER.size+metadata_size].decode("utf-8"))
+
+        self.header = np.memmap(path, dtype=np.uint8, mode="r", shape=(HEADER_SIZE,))
+        self.slots, self.timestamps, self.frames = _map_slots(path, self.slot_dtype, "r")
+
+    def __len__(self):
+        # re-read so a file that's still being recorded can be followed
+        return struct.unpack("<Q", self.header[COUNT_OFFSET:COUNT_OFFSET+8].tobytes())[0]
+
+    def __getitem__(self, index):
+        """ The frames (a list of views, one per camera) and timestamps of frame `index`. """
+        if index >= len(self):
+            raise IndexError(index)
+        if index >= len(self.timestamps):
+            # the file has grown since it was mapped
+            self.slots, self.timestamps, self.frames = _map_slots(self.path, self.slot_dtype, "r")
+        frames = self.frames[index]
+        if self.frame_shape[2] == 1:
+            frames = frames[..., 0]
+
+        return list(frames), self.timestamps[index]
+
+
+def recording_path(directory):
+    """ A new, timestamped capture file name in `directory`. """
+    os.makedirs(directory, exist_ok=True)
+    return os.path.join(directory, time.strftime("%Y%m%d-%H%M%S") + ".mocap")
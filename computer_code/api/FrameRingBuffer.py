@@ -0,0 +1,89 @@
+import numpy as np
+
+
+class FrameRingBuffer:
+    """
+    A fixed-size ring buffer of preallocated frames with a single writer
+    and any number of readers.
+
+    The writer never blocks on readers: it copies each frame into the next
+    slot and then publishes the slot by bumping a sequence counter. Readers
+    look at the latest published slot and copy it out, retrying if the writer
+    lapped them while they were copying. No locks are taken on either side.
+
+    """
+
+    def __init__(self, num_slots=4):
+        self.num_slots = num_slots
+        self.slots = None
+        self.slot_sequences = np.full(num_slots, -1, dtype=np.int64)
+        self.slot_metadata = [None] * num_slots
+        self.sequence = -1
+
+    def _allocate(self, shape, dtype):
+        self.slots = np.zeros((self.num_slots, *shape), dtype=dtype)
+        self.slot_sequences[:] = -1
+
+    def publish(self, frames, metadata=None):
+        """
+        Copies `frames` (a single image, or a list of images which are
+        stacked side by side) into the next free slot and publishes it,
+        along with any `metadata` about the frame (kept by reference).
+
+        """
+        if isinstance(frames, (list, tuple)):
+            shape = (frames[0].shape[0], sum(frame.shape[1] for frame in frames), *frames[0].shape[2:])
+            dtype = frames[0].dtype
+        else:
+            shape = frames.shape
+            dtype = frames.dtype
+
+        if self.slots is None or self.slots.shape[1:] != shape or self.slots.dtype != dtype:
+            self._allocate(shape, dtype)
+
+        sequence = self.sequence + 1
+        slot_index = sequence % self.num_slots
+
+        # mark the slot as being written so readers know to skip it
+        self.slot_sequences[slot_index] = -1
+        if isinstance(frames, (list, tuple)):
+            np.concatenate(frames, axis=1, out=self.slots[slot_index])
+        else:
+            self.slots[slot_index] = frames
+        self.slot_metadata[slot_index] = metadata
+        self.slot_sequences[slot_index] = sequence
+
+        self.sequence = sequence
+
+        return sequence
+
+    def latest(self, out=None):
+        """
+        Returns `(sequence, frame)` for the most recently published frame, or
+        `(-1, None)` if nothing has been published yet. The frame is a copy
+        (written into `out` if given) so it stays valid after the writer moves on.
+
+        """
+        while True:
+            sequence = self.sequence
+            if sequence < 0 or self.slots is None:
+                return -1, None
+
+            slot_index = sequence % self.num_slots
+            slot = self.slots[slot_index]
+            if out is None or out.shape != slot.shape:
+                out = np.empty_like(slot)
+            out[...] = slot
+
+            # the writer may have wrapped around onto this slot while we were copying
+            if self.slot_sequences[slot_index] == sequence:
+                return sequence, out
+
+    def metadata(self, sequence):
+        """ The metadata published with frame `sequence`, or None if its slot has been reused since. """
+        slot_index = sequence % self.num_slots
+        metadata = self.slot_metadata[slot_index]
+        if sequence < 0 or self.slot_sequences[slot_index] != sequence:
+            return None
+
+        return metadata
@@ -1,108 +1,233 @@
-import cv2 as cv
 import numpy as np
+from scipy.optimize import linear_sum_assignment
 from LowPassFilter import LowPassFilter
 import time
 
 class KalmanFilter:
-    def __init__(self, num_objects):
-        state_dim = 9
-        measurement_dim = 6
-        dt = 0.1
-        self.kalmans = []
-        self.prev_measurement_time = 0
-        self.prev_positions = []
-
-        self.low_pass_filter_xy = []
-        self.low_pass_filter_z = []
-        self.heading_low_pass_filter = []
+    """
+    Constant acceleration Kalman filter for every drone at once. The states and
+    covariances of all tracks are stored as stacked (N, 9) and (N, 9, 9) arrays
+    so predict and correct are a handful of vectorized operations regardless of
+    the number of drones. Each track keeps its own timestamps, so dt can differ
+    between tracks, and tracks can be added and removed at runtime.
+
+    Every frame, all tracks are predicted to the current time and the located
+    objects are assigned to them in one step: pairs further apart than the
+    Mahalanobis `gate` are ruled out and the rest are assigned with the Hungarian
+    algorithm. The `droneIndex` guessed from the marker layout only breaks ties:
+    an object whose `droneIndex` doesn't match the track's costs a small extra
+    `identity_mismatch_cost`, so a drone keeps its track even if its layout is
+    misread for a frame.
+
+    Measurements are taken to be accurate to `position_noise` metres and
+    `velocity_noise` metres a second (standard deviations). The process noise
+    is that of a randomly changing acceleration, with `jerk_noise` m/s³ of
+    change over a second, so a track's uncertainty, and with it its gate,
+    grows with the time since it was last predicted rather than per frame.
+
+    Tracks that miss a frame coast on their prediction and are retired once
+    they haven't been seen for `max_coast_time` seconds. Objects left over start
+    a new track for their drone if it doesn't have one, which is only reported
+    after `min_hits` detections.
+
+    State: [x, y, z, vx, vy, vz, ax, ay, az]
+    Measurement: [x, y, z, vx, vy, vz]
+
+    """
+
+    state_dim = 9
+    measurement_dim = 6
+
+    def __init__(self, num_objects, gate=11.34, identity_mismatch_cost=0.01, max_coast_time=0.25, min_hits=3,
+                 position_noise=0.01, velocity_noise=1.0, jerk_noise=100.0):
         self.num_objects = num_objects
-
-        for i in range(num_objects):
-            self.prev_positions.append([0,0,0])
-            self.kalmans.append(cv.KalmanFilter(state_dim, measurement_dim))
-            self.kalmans[i].transitionMatrix = np.array([[1, 0, 0, dt, 0, 0, 0.5*dt**2, 0, 0],
-                                                    [0, 1, 0, 0, dt, 0, 0, 0.5*dt**2, 0],
-                                                    [0, 0, 1, 0, 0, dt, 0, 0, 0.5*dt**2],
-                                                    [0, 0, 0, 1, 0, 0, dt, 0, 0],
-                                                    [0, 0, 0, 0, 1, 0, 0, dt, 0],
-                                                    [0, 0, 0, 0, 0, 1, 0, 0, dt],
-                                                    [0, 0, 0, 0, 0, 0, 1, 0, 0],
-                                                    [0, 0, 0, 0, 0, 0, 0, 1, 0],
-                                                    [0, 0, 0, 0, 0, 0, 0, 0, 1]], dtype=np.float32)
-
-            self.kalmans[i].processNoiseCov = np.eye(state_dim, dtype=np.float32) * 1e-2
-            self.kalmans[i].measurementNoiseCov = np.eye(measurement_dim, dtype=np.float32) * 1e0
-            self.kalmans[i].measurementMatrix = np.array([[1, 0, 0, 0, 0, 0, 0, 0, 0],
-                                                    [0, 1, 0, 0, 0, 0, 0, 0, 0],
-                                                    [0, 0, 1, 0, 0, 0, 0, 0, 0],
-                                                    [0, 0, 0, 1, 0, 0, 0, 0, 0],
-                                                    [0, 0, 0, 0, 1, 0, 0, 0, 0],
-                                                    [0, 0, 0, 0, 0, 1, 0, 0, 0]], dtype=np.float32)
-            
-            self.kalmans[i].statePost = np.zeros((9,1), dtype=np.float32)
-
-
-            self.low_pass_filter_xy.append(LowPassFilter(cutoff_frequency=20, sampling_frequency=60.0, dims=2))
-            self.low_pass_filter_z.append(LowPassFilter(cutoff_frequency=20, sampling_frequency=60.0, dims=1))
-            self.heading_low_pass_filter.append(LowPassFilter(cutoff_frequency=20, sampling_frequency=60.0, dims=1))
-    
-
-    def predict_location(self, objects):
-        res = []
-
-        dt = time.time() - self.prev_measurement_time
-        self.prev_measurement_time = time.time()
-
-        for drone_index in range(0, self.num_objects):
-            possible_new_objects = [object for object in objects if object["droneIndex"] == drone_index]
-            possible_new_positions = [x["pos"] for x in possible_new_objects]
-
-            if len(possible_new_objects) == 0:
-                continue
-
-            kalman = self.kalmans[drone_index]
-
-            kalman.transitionMatrix[:3, 3:6] = dt * np.eye(3)
-            kalman.transitionMatrix[3:6, 6:9] = dt * np.eye(3)
-            kalman.transitionMatrix[:3, 6:9] = 0.5 * dt**2 * np.eye(3)
-
-            if all(kalman.statePost == 0): # if not initialized
-                A = kalman.statePost
-                A[0:3] = possible_new_positions[0].reshape((3, 1))
-                kalman.statePost = A
-                kalman.statePre = A
-            
-            predicted_location = kalman.predict()[:3].T[0]
-            distances_to_predicted_location = np.sqrt(np.sum((possible_new_positions - predicted_location)**2, axis=1))
-            closest_match_i = np.argmin(distances_to_predicted_location)
-            new_pos = possible_new_positions[closest_match_i].astype(np.float32)
-            new_vel = ((new_pos - self.prev_positions[drone_index]) / dt).astype(np.float32)
-            self.prev_positions[drone_index] = new_pos
-
-            kalman.correct(np.concatenate((new_pos, new_vel)))
-            predicted_state = kalman.statePre[:6].T[0]  # Predicted 3D location
-
-            heading = possible_new_objects[closest_match_i]["heading"]
-            heading = self.heading_low_pass_filter[drone_index].filter(heading)[0]
-            # heading, self.z = signal.lfilter(self.b, 1, [heading], zi=self.z)
-
-            vel = predicted_state[3:6].copy()
-            vel[0:2] = self.low_pass_filter_xy[drone_index].filter(vel[0:2])
-            vel[2] = self.low_pass_filter_z[drone_index].filter(vel[2])[0]
-            
-            res.append({
-                "pos": predicted_state[:3],
-                "vel": vel,
-                "heading": heading,
-                "droneIndex": drone_index
-            })
-
-        return res
+        self.gate = gate # chi-squared, 3 degrees of freedom, 99%
+        self.identity_mismatch_cost = identity_mismatch_cost
+        self.max_coast_time = max_coast_time
+        self.min_hits = min_hits
+
+        self.jerk_noise = jerk_noise
+        self.measurement_noise_cov = np.diag([position_noise**2] * 3 + [velocity_noise**2] * 3)
+        self.measurement_matrix = np.eye(self.measurement_dim, self.state_dim)
+        # a new track knows where it is, but not how it's moving
+        self.initial_cov = np.diag([position_noise**2] * 3 + [2.0**2] * 3 + [10.0**2] * 3)
+
+        self.drone_indices = np.empty(0, dtype=np.int64)
+        self.states = np.empty((0, self.state_dim))
+        self.covariances = np.empty((0, self.state_dim, self.state_dim))
+        self.hits = np.empty(0, dtype=np.int64)
+        self.headings = np.empty(0)
+        self.prev_predict_times = np.empty(0)
+        self.prev_measurement_times = np.empty(0)
+        self.prev_positions = np.empty((0, 3))
+
+        self.low_pass_filter_xy = LowPassFilter(cutoff_frequency=20, sampling_frequency=60.0, dims=2, count=0)
+        self.low_pass_filter_z = LowPassFilter(cutoff_frequency=20, sampling_frequency=60.0, dims=1, count=0)
+        self.heading_low_pass_filter = LowPassFilter(cutoff_frequency=20, sampling_frequency=60.0, dims=1, count=0)
+        self.filtered_velocities = np.empty((0, 3))
+
+    def add_track(self, drone_index, position=None, heading=0, timestamp=None):
+        timestamp = time.time() if timestamp is None else timestamp
+        state = np.zeros((1, self.state_dim))
+        if position is not None:
+            state[0, 0:3] = position
+
+        self.drone_indices = np.append(self.drone_indices, drone_index)
+        self.states = np.vstack((self.states, state))
+        self.covariances = np.concatenate((self.covariances, self.initial_cov[np.newaxis]))
+        self.hits = np.append(self.hits, 0 if position is None else 1)
+        self.headings = np.append(self.headings, heading)
+        self.prev_predict_times = np.append(self.prev_predict_times, timestamp)
+        self.prev_measurement_times = np.append(self.prev_measurement_times, timestamp)
+        self.prev_positions = np.vstack((self.prev_positions, state[:, 0:3]))
+        self.filtered_velocities = np.vstack((self.filtered_velocities, np.zeros((1, 3))))
+
+        self.low_pass_filter_xy.add()
+        self.low_pass_filter_z.add()
+        self.heading_low_pass_filter.add()
+
+        return len(self.drone_indices) - 1
+
+    def remove_track(self, drone_index):
+        self._remove_tracks(np.nonzero(self.drone_indices == drone_index)[0])
+
+    def _remove_tracks(self, index):
+        self.drone_indices = np.delete(self.drone_indices, index)
+        self.states = np.delete(self.states, index, axis=0)
+        self.covariances = np.delete(self.covariances, index, axis=0)
+        self.hits = np.delete(self.hits, index)
+        self.headings = np.delete(self.headings, index)
+        self.prev_predict_times = np.delete(self.prev_predict_times, index)
+        self.prev_measurement_times = np.delete(self.prev_measurement_times, index)
+        self.prev_positions = np.delete(self.prev_positions, index, axis=0)
+        self.filtered_velocities = np.delete(self.filtered_velocities, index, axis=0)
+
+        self.low_pass_filter_xy.remove(index)
+        self.low_pass_filter_z.remove(index)
+        self.heading_low_pass_filter.remove(index)
+
+    def transition_matrices(self, dt):
+        dt = np.asarray(dt, dtype=np.float64)
+        F = np.tile(np.eye(self.state_dim), (len(dt), 1, 1))
+        for i in range(0, 3):
+            F[:, i, 3+i] = dt
+            F[:, 3+i, 6+i] = dt
+            F[:, i, 6+i] = 0.5 * dt**2
+
+        return F
+
+    def process_noise_covs(self, dt):
+        """ (N, 9, 9) process noise over each track's dt, from a random jerk held over the interval """
+        dt = np.asarray(dt, dtype=np.float64)
+        G = np.stack((dt**3 / 6, dt**2 / 2, dt), axis=1) # effect of the jerk on position, velocity, acceleration
+        Q = self.jerk_noise**2 * G[:,:,np.newaxis] * G[:,np.newaxis,:]
+        # same for every axis, state order is [x, y, z, vx, ...]
+        return np.kron(Q, np.eye(3))
+
+    def predict(self, index, dt):
+        F = self.transition_matrices(dt)
+        self.states[index] = np.einsum("nij,nj->ni", F, self.states[index])
+        self.covariances[index] = F @ self.covariances[index] @ F.transpose((0, 2, 1)) + self.process_noise_covs(dt)
+
+        return self.states[index]
+
+    def correct(self, index, measurements):
+        H = self.measurement_matrix
+        P = self.covariances[index]
+
+        innovation_covs = H @ P @ H.T + self.measurement_noise_cov
+        # K = P H^T S^-1, solved without inverting S (which is symmetric)
+        gains = np.linalg.solve(innovation_covs, H @ P).transpose((0, 2, 1))
+        innovations = measurements - np.einsum("ij,nj->ni", H, self.states[index])
+
+        self.states[index] += np.einsum("nij,nj->ni", gains, innovations)
+        self.covariances[index] = P - gains @ H @ P
+
+        return self.states[index]
+
+    def associate(self, positions, object_drone_indices):
+        """
+        Gated global assignment of objects to tracks. Returns the matched
+        (track index, object index) pairs.
+        """
+        if len(self.drone_indices) == 0 or len(positions) == 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+
+        # squared Mahalanobis distance of every object from every track's predicted position
+        innovation_covs = self.covariances[:, 0:3, 0:3] + self.measurement_noise_cov[0:3, 0:3]
+        innovations = positions[np.newaxis,:,:] - self.states[:,np.newaxis,0:3]
+        solved = np.linalg.solve(innovation_covs[:,np.newaxis], innovations[..., np.newaxis])[..., 0]
+        distances = np.sum(innovations * solved, axis=2)
+
+        costs = distances + self.identity_mismatch_cost * (self.drone_indices[:,np.newaxis] != object_drone_indices[np.newaxis,:])
+        gated = distances > self.gate
+        costs[gated] = 1e9
+
+        track_index, object_index = linear_sum_assignment(costs)
+        valid = ~gated[track_index, object_index]
+
+        return track_index[valid], object_index[valid]
+
+    def predict_location(self, objects, timestamp=None):
+        """
+        Updates the tracks with the objects located in a frame captured at
+        `timestamp` (seconds, `time.time()` clock), which should be when the
+        cameras exposed the frame rather than when it was processed, so dt
+        doesn't pick up processing jitter. Defaults to now.
+        """
+        now = time.time() if timestamp is None else timestamp
+
+        positions = np.array([object["pos"] for object in objects], dtype=np.float64).reshape((-1, 3))
+        headings = np.array([object["heading"] for object in objects], dtype=np.float64)
+        object_drone_indices = np.array([object["droneIndex"] for object in objects], dtype=np.int64)
+
+        # bring every track up to now, never backwards (e.g. when a replay loops)
+        all_tracks = np.arange(len(self.drone_indices))
+        self.predict(all_tracks, np.maximum(now - self.prev_predict_times, 0))
+        self.prev_predict_times[:] = now
+
+        index, object_index = self.associate(positions, object_drone_indices)
+
+        if len(index) != 0:
+            new_positions = positions[object_index]
+            # clamped like predict's dt, two measurements at the same time (or the clock stepping back)
+            # say nothing about velocity, so the prediction is used as the velocity measurement instead
+            dt = np.maximum(now - self.prev_measurement_times[index], 0)[:,np.newaxis]
+            with np.errstate(divide="ignore", invalid="ignore"):
+                new_velocities = np.where(dt > 0, (new_positions - self.prev_positions[index]) / dt, self.states[index, 3:6])
+            self.prev_positions[index] = new_positions
+            self.prev_measurement_times[index] = now
+            self.hits[index] += 1
+
+            states = self.correct(index, np.concatenate((new_positions, new_velocities), axis=1))
+
+            self.headings[index] = self.heading_low_pass_filter.filter(headings[object_index][:,np.newaxis], index)[:,0]
+
+            vel = states[:,3:6].copy()
+            vel[:,0:2] = self.low_pass_filter_xy.filter(vel[:,0:2], index)
+            vel[:,2] = self.low_pass_filter_z.filter(vel[:,2:3], index)[:,0]
+            self.filtered_velocities[index] = vel
+
+        # tracks that have been coasting for too long are lost
+        self._remove_tracks(np.nonzero(now - self.prev_measurement_times > self.max_coast_time)[0])
+
+        # everything left over may be a drone we aren't tracking yet
+        unassigned = np.ones(len(objects), dtype=bool)
+        unassigned[object_index] = False
+        for i in np.nonzero(unassigned)[0]:
+            drone_index = object_drone_indices[i]
+            if drone_index < self.num_objects and drone_index not in self.drone_indices:
+                self.add_track(drone_index, positions[i], headings[i], now)
+
+        coasting = self.prev_measurement_times < now
+        return [{
+            "pos": self.states[i,:3].copy(),
+            "vel": self.filtered_velocities[i].copy(),
+            "heading": self.headings[i],
+            "droneIndex": int(self.drone_indices[i]),
+            "coasting": bool(coasting[i])
+        } for i in range(0, len(self.drone_indices)) if self.hits[i] >= self.min_hits]
 
 
     def reset(self):
-        self.prev_measurement_time = time.time()-20
-
-        for i, kalman in enumerate(self.kalmans):
-            kalman.statePost = np.zeros((9,1), dtype=np.float32)
-            self.prev_positions[i] = np.array([0,0,0])
\ No newline at end of file
+        self._remove_tracks(np.arange(len(self.drone_indices)))
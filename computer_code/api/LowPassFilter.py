@@ -1,23 +1,57 @@
 import numpy as np
-from scipy.signal import butter, lfilter
+from scipy.signal import butter, sosfilt
 
 class LowPassFilter:
+    """
+    A streaming Butterworth low pass filter. The filter state is kept between
+    calls, so each sample costs O(order) no matter how long the filter has been
+    running.
 
-    def __init__(self, cutoff_frequency, sampling_frequency, dims, order=5, buffer_size=300):
+    With `count` set, the filter runs `count` independent banks of `dims`
+    channels (e.g. one per drone) which can all be advanced in a single call.
+
+    """
+
+    def __init__(self, cutoff_frequency, sampling_frequency, dims, order=5, count=None):
         self.sampling_frequency = sampling_frequency
         self.cutoff_frequency = cutoff_frequency
         self.order = order
         self.dims = dims
-        self.buffer_size = buffer_size
-        self.buffered_data = np.empty((0, dims))
-        self.b, self.a = butter(self.order, self.cutoff_frequency / (self.sampling_frequency / 2), btype='low')
+        self.count = count
+        self.sos = butter(self.order, self.cutoff_frequency / (self.sampling_frequency / 2), btype='low', output='sos')
+        self.reset()
+
+    def reset(self, index=None):
+        if index is None:
+            shape = (self.dims,) if self.count is None else (self.count, self.dims)
+            self.zi = np.zeros((self.sos.shape[0], 2, *shape))
+        else:
+            self.zi[:, :, index] = 0
+
+    def add(self, count=1):
+        self.zi = np.concatenate((self.zi, np.zeros((*self.zi.shape[:2], count, self.dims))), axis=2)
+        self.count = self.zi.shape[2]
+
+    def remove(self, index):
+        self.zi = np.delete(self.zi, index, axis=2)
+        self.count = self.zi.shape[2]
+
+    def filter(self, data, index=None):
+        """
+        Filters one new sample and returns the filtered sample, with the same
+        shape as the filter's channels: (dims,), or (count, dims) when `count`
+        is set. If `index` is given, only those banks are advanced and `data`
+        holds one row per index.
+
+        """
+        zi = self.zi if index is None else self.zi[:, :, index]
+        x = np.asarray(data, dtype=np.float64).reshape((1, *zi.shape[2:]))
 
-    def filter(self, data):
-        self.buffered_data = np.vstack((self.buffered_data, data[np.newaxis]))
+        y, zi = sosfilt(self.sos, x, axis=0, zi=zi)
 
-        filtered_data = np.apply_along_axis(lambda x: lfilter(self.b, self.a, x), axis=0, arr=self.buffered_data)
-    
-        if self.buffered_data.shape[0] >= self.buffer_size:
-            self.buffered_data = self.buffered_data[-self.buffer_size//2:]  # Keep the last half of the buffered data for the next filtering iteration
+        if index is None:
+            self.zi = zi
+        else:
+            self.zi[:, :, index] = zi
 
-        return filtered_data[-1]
\ No newline at end of file
+        return y[0]
@@ -0,0 +1,82 @@
+import threading
+import time
+import numpy as np
+
+
+class StageTimer:
+    """
+    Times consecutive stages: each call records the time since the previous
+    call (or since the timer was made) under the given stage name.
+    """
+
+    def __init__(self, metrics):
+        self.metrics = metrics
+        self.start = time.perf_counter()
+
+    def __call__(self, name):
+        now = time.perf_counter()
+        self.metrics.record(name, now - self.start)
+        self.start = now
+
+
+class PipelineMetrics:
+    """
+    Rolling latency samples for each stage of the pipeline. Every stage keeps
+    its last `window` durations (seconds, from `time.perf_counter`) in a
+    preallocated array, so recording a sample is an index and a store; the
+    percentiles are only worked out when `summary` is asked for.
+
+    """
+
+    def __init__(self, window=1000):
+        self.window = window
+        self.lock = threading.Lock()
+        self.samples = {}
+        self.counts = {}
+
+    def record(self, name, duration):
+        with self.lock:
+            samples = self.samples.get(name)
+            if samples is None:
+                samples = self.samples[name] = np.zeros(self.window)
+                self.counts[name] = 0
+            samples[self.counts[name] % self.window] = duration
+            self.counts[name] += 1
+
+    def timer(self):
+        return StageTimer(self)
+
+    def get_samples(self, name):
+        """ The samples currently in the window of a stage, oldest first. """
+        with self.lock:
+            count = self.counts.get(name, 0)
+            if count <= self.window:
+                return self.samples[name][:count].copy() if count != 0 else np.empty(0)
+            return np.roll(self.samples[name], -(count % self.window))
+
+    def summary(self):
+        """
+        Per stage sample count and mean, p50, p95, p99 and max latency in
+        milliseconds over the window, in the order the stages first ran.
+        """
+        with self.lock:
+            stages = {name: (self.counts[name], samples[:min(self.counts[name], self.window)].copy()) for name, samples in self.samples.items()}
+
+        summary = {}
+        for name, (count, samples) in stages.items():
+            p50, p95, p99 = np.percentile(samples, [50, 95, 99]) * 1e3
+            summary[name] = {
+                "count": count,
+                "mean": float(np.mean(samples) * 1e3),
+                "p50": float(p50),
+                "p95": float(p95),
+                "p99": float(p99),
+                "max": float(np.max(samples) * 1e3)
+            }
+
+        return summary
+
+    def reset(self):
+        with self.lock:
+            self.samples = {}
+            self.counts = {}
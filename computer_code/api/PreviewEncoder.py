@@ -0,0 +1,223 @@
+import itertools
+import threading
+import time
+import numpy as np
+import cv2 as cv
+
+LINE_COLOURS = [(255,100,100), (100,100,255), (255,255,100), (255,100,255), (100,255,255), (255,180,100)]
+
+
+class PreviewOptions:
+    """
+    How a viewer wants the camera preview, usually from the camera stream's
+    query string, e.g. /api/camera-stream?scale=0.5&quality=60&fps=15&cameras=0,2&annotations=0
+
+        scale        downscale factor of every camera's frame, (0, 1]
+        quality      JPEG quality, 1 to 100
+        fps          most frames a second sent to this viewer
+        cameras      which cameras to show, side by side, all of them if not given
+        annotations  whether to draw blobs, search windows and epipolar lines
+
+    """
+
+    def __init__(self, scale=1.0, quality=80, fps=30, cameras=None, annotations=True):
+        self.scale = float(scale)
+        self.quality = int(quality)
+        self.fps = float(fps)
+        self.cameras = None if cameras is None else tuple(int(i) for i in cameras)
+        self.annotations = annotations
+
+        if not 0 < self.scale <= 1:
+            raise ValueError(f"scale must be in (0, 1], got {self.scale}")
+        if not 1 <= self.quality <= 100:
+            raise ValueError(f"quality must be between 1 and 100, got {self.quality}")
+        if not self.fps > 0:
+            raise ValueError(f"fps must be positive, got {self.fps}")
+
+    @classmethod
+    def from_query(cls, args):
+        cameras = args.get("cameras")
+        return cls(
+            scale=args.get("scale", 1.0),
+            quality=args.get("quality", 80),
+            fps=args.get("fps", 30),
+            cameras=None if not cameras else cameras.split(","),
+            annotations=args.get("annotations", "1").lower() not in ("0", "false", "off")
+        )
+
+    @property
+    def key(self):
+        # viewers asking for the same picture share it, whatever rate they ask for it at
+        return (self.scale, self.quality, self.cameras, self.annotations)
+
+
+class PreviewEncoder:
+    """
+    Turns the latest published frame into JPEGs for the camera preview, off the
+    capture thread. Each set of options is encoded at most once per frame,
+    however many viewers share it, and `num_viewers` lets the capture loop skip
+    publishing frames (and building annotations) when nobody is watching.
+
+    Frames come from a FrameRingBuffer holding every camera's frame side by
+    side, published with metadata from `Cameras._camera_read` that has the
+    number of cameras and, if any viewer wants annotations, per camera
+    `image_points`, ROI `windows` and `epipolar_lines`.
+
+    """
+
+    def __init__(self, frame_buffer, metrics=None):
+        self.frame_buffer = frame_buffer
+        self.metrics = metrics
+
+        self.lock = threading.Lock()
+        self.viewers = {}
+        self.viewer_ids = itertools.count()
+        self.encoded = {} # options key -> (sequence, jpeg)
+        self.encode_locks = {}
+
+        self.encodes = 0
+        self.shared = 0
+
+    @property
+    def num_viewers(self):
+        return len(self.viewers)
+
+    @property
+    def wants_annotations(self):
+        with self.lock:
+            return any(options.annotations for options in self.viewers.values())
+
+    def add_viewer(self, options):
+        with self.lock:
+            viewer_id = next(self.viewer_ids)
+            self.viewers[viewer_id] = options
+            return viewer_id
+
+    def remove_viewer(self, viewer_id):
+        with self.lock:
+            options = self.viewers.pop(viewer_id)
+            # drop what only this viewer was using
+            if not any(other.key == options.key for other in self.viewers.values()):
+                self.encoded.pop(options.key, None)
+                self.encode_locks.pop(options.key, None)
+
+    def stats(self):
+        with self.lock:
+            return {
+                "viewers": len(self.viewers),
+                "encodes": self.encodes,
+                "shared": self.shared
+            }
+
+    def encode(self, options):
+        """ `(sequence, jpeg)` of the latest frame as `options` asks for it, or `(-1, None)` if there is none. """
+        key = options.key
+        with self.lock:
+            encode_lock = self.encode_locks.get(key)
+            if encode_lock is None:
+                encode_lock = threading.Lock()
+                # kept while a viewer uses these options, see remove_viewer
+                if any(other.key == key for other in self.viewers.values()):
+                    self.encode_locks[key] = encode_lock
+
+        with encode_lock:
+            sequence = self.frame_buffer.sequence
+            encoded = self.encoded.get(key)
+            if encoded is not None and encoded[0] == sequence:
+                with self.lock:
+                    self.shared += 1
+                return encoded
+
+            start = time.perf_counter()
+            sequence, mosaic = self.frame_buffer.latest()
+            if mosaic is None:
+                return -1, None
+            metadata = self.frame_buffer.metadata(sequence) or {}
+
+            image = self._render(mosaic, metadata, options)
+            jpeg = cv.imencode(".jpg", image, [cv.IMWRITE_JPEG_QUALITY, options.quality])[1].tobytes()
+            if self.metrics is not None:
+                self.metrics.record("jpeg encode", time.perf_counter() - start)
+
+            with self.lock:
+                self.encodes += 1
+                if any(other.key == key for other in self.viewers.values()):
+                    self.encoded[key] = (sequence, jpeg)
+
+        return sequence, jpeg
+
+    def _render(self, mosaic, metadata, options):
+        num_cameras = metadata.get("num_cameras", 1)
+        width = mosaic.shape[1] // num_cameras
+        cameras = range(0, num_cameras) if options.cameras is None else [i for i in options.cameras if 0 <= i < num_cameras]
+
+        images = []
+        for i in cameras:
+            image = mosaic[:, i*width:(i+1)*width]
+            if options.scale != 1:
+                image = cv.resize(image, None, fx=options.scale, fy=options.scale, interpolation=cv.INTER_AREA)
+            else:
+                image = np.ascontiguousarray(image)
+            if options.annotations:
+                annotate(image, i, metadata, options.scale)
+            images.append(image)
+
+        if len(images) == 0:
+            return np.zeros((1, 1, 3), dtype=mosaic.dtype)
+
+        return np.hstack(images)
+
+    def stream(self, options):
+        """
+        Multipart MJPEG stream of the preview for one viewer, sending each new
+        frame at most `options.fps` times a second.
+        """
+        viewer_id = self.add_viewer(options)
+        interval = 1 / options.fps
+        last_sequence = -1
+        last_send_time = 0
+
+        try:
+            while True:
+                time_now = time.time()
+                if time_now - last_send_time < interval:
+                    time.sleep(last_send_time + interval - time_now)
+                last_send_time = time.time()
+
+                sequence, jpeg = self.encode(options)
+                if jpeg is None or sequence == last_sequence:
+                    continue
+                last_sequence = sequence
+
+                yield (b'--frame\r\n'
+                    b'Content-Type: image/jpeg\r\n\r\n' + jpeg + b'\r\n')
+        finally:
+            self.remove_viewer(viewer_id)
+
+
+def annotate(image, camera_index, metadata, scale=1.0):
+    """ Draws what the pipeline found in camera `camera_index`'s frame onto its (scaled) preview image. """
+    image_points = metadata.get("image_points")
+    if image_points is not None:
+        points = np.array(image_points[camera_index], dtype=np.float64).reshape((-1, 2))
+        for center_x, center_y in points[~np.isnan(points).any(axis=1)]:
+            center = (int(round(center_x * scale)), int(round(center_y * scale)))
+            cv.putText(image, f'({center_x:.1f}, {center_y:.1f})', (center[0], center[1] - 15), cv.FONT_HERSHEY_SIMPLEX, 0.3, (100,255,100), 1)
+            cv.circle(image, center, 1, (100,255,100), -1)
+
+    windows = metadata.get("windows")
+    if windows is not None:
+        for x0, y0, x1, y1 in np.asarray(windows[camera_index]) * scale:
+            cv.rectangle(image, (int(x0), int(y0)), (int(x1) - 1, int(y1) - 1), (255,100,100), 1)
+
+    epipolar_lines = metadata.get("epipolar_lines")
+    if epipolar_lines is not None and len(epipolar_lines[camera_index]) != 0:
+        width = image.shape[1]
+        # a line ax + by + c = 0 in frame pixels is ax' + by' + c*scale = 0 in scaled ones
+        for j, (a, b, c) in enumerate(np.concatenate(epipolar_lines[camera_index]) * [1, 1, scale]):
+            if b == 0:
+                continue
+            y0, y1 = np.clip([-c/b, -(c + a*width)/b], -1e5, 1e5)
+            cv.line(image, (0, int(y0)), (width, int(y1)), LINE_COLOURS[j % len(LINE_COLOURS)], 1)
+
+    return image
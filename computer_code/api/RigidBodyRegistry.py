@@ -0,0 +1,164 @@
+import numpy as np
+from scipy.spatial import cKDTree
+
+
+def kabsch(body_points, world_points):
+    """
+    Rotation R and translation t minimising |R @ body_point + t - world_point|,
+    along with the rms error of the fit.
+
+    """
+    body_center = body_points.mean(axis=0)
+    world_center = world_points.mean(axis=0)
+    H = (body_points - body_center).T @ (world_points - world_center)
+    U, _, Vt = np.linalg.svd(H)
+    d = np.sign(np.linalg.det(Vt.T @ U.T))
+    R = Vt.T @ np.diag([1, 1, d if d != 0 else 1]) @ U.T
+    t = world_center - R @ body_center
+
+    residuals = (body_points @ R.T + t) - world_points
+    rms = np.sqrt(np.mean(np.sum(residuals**2, axis=1)))
+
+    return R, t, rms
+
+
+class RigidBody:
+    """
+    The marker layout of one drone. `marker_points` is an (N, 3) array of marker
+    positions in the drone's body frame: the origin is the position reported for
+    the drone, x points along its heading and z points up.
+
+    If `max_yaw` is set, fits with a heading outside [-max_yaw, max_yaw] are
+    rejected. This is only needed to tell apart drones whose layouts are
+    rotations of each other.
+
+    """
+
+    def __init__(self, drone_index, marker_points, max_yaw=None):
+        self.drone_index = drone_index
+        self.marker_points = np.array(marker_points, dtype=np.float64)
+        self.max_yaw = max_yaw
+
+        self.distances = np.linalg.norm(self.marker_points[:,np.newaxis] - self.marker_points[np.newaxis], axis=2)
+        self.max_distance = self.distances.max()
+
+        # search from the two markers furthest apart, they are the most distinctive
+        a, b = np.unravel_index(np.argmax(self.distances), self.distances.shape)
+        rest = [i for i in range(0, len(self.marker_points)) if i not in (a, b)]
+        self.search_order = [a, b] + rest
+
+
+class RigidBodyRegistry:
+    """
+    Identifies drones in a cloud of triangulated markers by matching it against
+    the registered marker layouts, and recovers each drone's full pose with a
+    Kabsch fit.
+
+    Distances between markers are looked up in a vectorized distance matrix and
+    candidate marker pairs come from a KD-tree, so the per frame cost doesn't
+    depend on Python loops over every pair of points.
+
+    """
+
+    def __init__(self, rigid_bodies=(), tolerance=0.025, max_tilt=np.pi/3):
+        self.rigid_bodies = list(rigid_bodies)
+        self.tolerance = tolerance
+        self.max_tilt = max_tilt
+
+    def add(self, rigid_body):
+        self.rigid_bodies = [x for x in self.rigid_bodies if x.drone_index != rigid_body.drone_index]
+        self.rigid_bodies.append(rigid_body)
+
+    @staticmethod
+    def default(num_objects=2):
+        """
+        The original layout: two markers 0.15m apart with the drone's position
+        between them, and a third marker 0.095m from both. Drone 0 has the third
+        marker on its left, drone 1 on its right.
+
+        """
+        half_base = 0.15/2
+        apex = np.sqrt(0.095**2 - half_base**2)
+        rigid_bodies = [
+            RigidBody(0, [[half_base, 0, 0], [-half_base, 0, 0], [0, apex, 0]], max_yaw=np.pi/2),
+            RigidBody(1, [[half_base, 0, 0], [-half_base, 0, 0], [0, -apex, 0]], max_yaw=np.pi/2),
+        ]
+
+        return RigidBodyRegistry(rigid_bodies[:num_objects])
+
+    def _match(self, rigid_body, object_points, distance_matrix, candidate_pairs):
+        template = rigid_body.distances
+        order = rigid_body.search_order
+        first, second = order[0], order[1]
+
+        seed_distances = distance_matrix[candidate_pairs[:,0], candidate_pairs[:,1]]
+        seeds = candidate_pairs[np.abs(seed_distances - template[first, second]) < self.tolerance]
+        seeds = np.concatenate((seeds, seeds[:,::-1])) # either way round
+
+        matches = []
+        for seed in seeds:
+            partial_matches = [list(seed)]
+            for k in order[2:]:
+                extended = []
+                for assigned in partial_matches:
+                    deltas = np.abs(distance_matrix[assigned] - template[k, order[:len(assigned)]][:,np.newaxis])
+                    candidates = np.all(deltas < self.tolerance, axis=0)
+                    candidates[assigned] = False
+                    extended += [assigned + [candidate] for candidate in np.nonzero(candidates)[0]]
+                partial_matches = extended
+            matches += partial_matches
+
+        fits = []
+        for match in matches:
+            point_indices = np.empty(len(order), dtype=np.int64)
+            point_indices[order] = match
+            R, t, rms = kabsch(rigid_body.marker_points, object_points[point_indices])
+
+            if self.max_tilt is not None and R[2,2] < np.cos(self.max_tilt):
+                continue
+            yaw = np.arctan2(R[1,0], R[0,0])
+            if rigid_body.max_yaw is not None and np.abs(yaw) > rigid_body.max_yaw:
+                continue
+
+            fits.append((rms, rigid_body, point_indices, R, t, yaw))
+
+        return fits
+
+    def locate(self, object_points, errors):
+        object_points = np.asarray(object_points, dtype=np.float64).reshape((-1, 3))
+        errors = np.asarray(errors, dtype=np.float64)
+
+        if len(object_points) == 0 or len(self.rigid_bodies) == 0:
+            return []
+
+        max_distance = max(rigid_body.max_distance for rigid_body in self.rigid_bodies) + self.tolerance
+        candidate_pairs = cKDTree(object_points).query_pairs(r=max_distance, output_type="ndarray")
+        if len(candidate_pairs) == 0:
+            return []
+        distance_matrix = np.linalg.norm(object_points[:,np.newaxis] - object_points[np.newaxis], axis=2)
+
+        fits = []
+        for rigid_body in self.rigid_bodies:
+            fits += self._match(rigid_body, object_points, distance_matrix, candidate_pairs)
+
+        # best fits first, every marker and every drone used at most once
+        fits.sort(key=lambda fit: fit[0])
+        used_points = np.zeros(len(object_points), dtype=bool)
+        located_drones = set()
+        objects = []
+        for rms, rigid_body, point_indices, R, t, yaw in fits:
+            if rigid_body.drone_index in located_drones or np.any(used_points[point_indices]):
+                continue
+            used_points[point_indices] = True
+            located_drones.add(rigid_body.drone_index)
+
+            objects.append({
+                "pos": t,
+                "heading": -yaw,
+                "rotation": R,
+                "error": np.mean(errors[point_indices]),
+                "fit_error": rms,
+                "droneIndex": rigid_body.drone_index
+            })
+
+        return objects
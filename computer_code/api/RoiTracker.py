@@ -0,0 +1,102 @@
+import numpy as np
+
+
+class RoiTracker:
+    """
+    Predicts where each marker will show up in every camera from where it was
+    triangulated on previous frames, so that blob detection only has to look
+    at small windows around those predictions.
+
+    Marker positions are kept in the triangulation (camera rig) frame and
+    extrapolated with a constant velocity estimated by matching each marker to
+    its nearest neighbour on the previous frame. A full frame scan is asked for
+    every `full_scan_interval` frames, and whenever fewer markers were found
+    than predicted (track loss).
+
+    """
+
+    def __init__(self, full_scan_interval=30, max_speed=3.0, margin=0.03, min_window_size=8, max_window_size=64):
+        self.full_scan_interval = full_scan_interval
+        self.max_speed = max_speed # m/s, bounds how far a marker can move between frames
+        self.margin = margin # m, added around each marker for blob size and prediction error
+        self.min_window_size = min_window_size
+        self.max_window_size = max_window_size
+
+        self.reset()
+
+    def reset(self):
+        self.object_points = np.empty((0, 3))
+        self.velocities = np.empty((0, 3))
+        self.timestamp = None
+        self.frames_since_full_scan = 0
+        self.force_full_scan = True
+        self.num_predicted_points = 0
+
+    def get_windows(self, camera_rig, image_shape, timestamp):
+        """
+        Returns, for every camera, a (K, 4) int array of [x0, y0, x1, y1] windows
+        to search, or None if this frame should be a full scan.
+
+        """
+        if self.force_full_scan or self.timestamp is None or len(self.object_points) == 0 \
+                or self.frames_since_full_scan >= self.full_scan_interval:
+            self.frames_since_full_scan = 0
+            self.num_predicted_points = 0
+            return None
+
+        self.frames_since_full_scan += 1
+
+        dt = timestamp - self.timestamp
+        predicted_object_points = self.object_points + self.velocities * dt
+        self.num_predicted_points = len(predicted_object_points)
+
+        object_points_h = np.c_[predicted_object_points, np.ones(len(predicted_object_points))]
+        projected = np.einsum("cij,nj->cni", camera_rig.Ps, object_points_h)
+        depths = projected[:,:,2]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            image_points = projected[:,:,:2] / depths[:,:,np.newaxis]
+
+            # how big the search radius around each marker looks from each camera
+            focal_lengths = np.array([camera_model.intrinsic_matrix[0,0] for camera_model in camera_rig.camera_models])
+            radius = self.margin + self.max_speed * max(dt, 0)
+            half_sizes = focal_lengths[:,np.newaxis] * radius / depths
+        half_sizes = np.clip(half_sizes, self.min_window_size, self.max_window_size)
+
+        height, width = image_shape[:2]
+        windows = []
+        for i in range(0, camera_rig.num_cameras):
+            in_front = depths[i] > 0
+            x = image_points[i, in_front, 0]
+            y = image_points[i, in_front, 1]
+            half_size = half_sizes[i, in_front]
+
+            camera_windows = np.column_stack((x - half_size, y - half_size, x + half_size + 1, y + half_size + 1))
+            camera_windows = np.clip(camera_windows, 0, [width, height, width, height]).astype(np.int64)
+            # drop windows that ended up completely off screen
+            camera_windows = camera_windows[(camera_windows[:,2] > camera_windows[:,0]) & (camera_windows[:,3] > camera_windows[:,1])]
+            windows.append(camera_windows)
+
+        return windows
+
+    def update(self, object_points, timestamp):
+        """
+        Records the object points (in the camera rig frame) triangulated this frame.
+        """
+        object_points = np.asarray(object_points, dtype=np.float64).reshape((-1, 3))
+        object_points = object_points[~np.any(np.isnan(object_points), axis=1)]
+
+        # lost a marker while only looking in the windows, go back to scanning everything
+        self.force_full_scan = len(object_points) == 0 or len(object_points) < self.num_predicted_points
+
+        velocities = np.zeros_like(object_points)
+        if self.timestamp is not None and len(self.object_points) != 0 and len(object_points) != 0:
+            dt = timestamp - self.timestamp
+            if dt > 0:
+                distances = np.linalg.norm(object_points[:,np.newaxis,:] - self.object_points[np.newaxis,:,:], axis=2)
+                closest = np.argmin(distances, axis=1)
+                matched = distances[np.arange(len(object_points)), closest] < self.max_speed * dt + self.margin
+                velocities[matched] = (object_points[matched] - self.object_points[closest[matched]]) / dt
+
+        self.object_points = object_points
+        self.velocities = velocities
+        self.timestamp = timestamp
@@ -0,0 +1,97 @@
+import os
+import tty
+
+
+class NullSerial:
+    """ Drops everything written to it, for running without a radio. """
+
+    def __init__(self):
+        self.bytes_written = 0
+
+    def write(self, data):
+        self.bytes_written += len(data)
+        return len(data)
+
+    def close(self):
+        pass
+
+
+class LazySerial:
+    """
+    A pyserial port that is only imported and opened on the first write, so
+    nothing needs the device to exist until something is actually sent.
+
+    """
+
+    def __init__(self, port, baudrate=1000000, write_timeout=1):
+        self.port = port
+        self.baudrate = baudrate
+        self.write_timeout = write_timeout
+        self.ser = None
+
+    def open(self):
+        import serial
+
+        self.ser = serial.Serial(self.port, self.baudrate, write_timeout=self.write_timeout)
+
+    def write(self, data):
+        if self.ser is None:
+            self.open()
+        return self.ser.write(data)
+
+    def close(self):
+        if self.ser is not None:
+            self.ser.close()
+            self.ser = None
+
+
+class PtySerial:
+    """
+    Writes into a pseudo terminal. Anything that can open a serial port (e.g.
+    a script using SerialProtocol.SerialDecoder) can attach to `slave_name`.
+    Writes never block: when nobody is reading and the terminal's buffer is
+    full, the data is dropped and counted in `bytes_dropped`.
+
+    """
+
+    def __init__(self):
+        self.master = None
+        self.slave = None
+        self.slave_name = None
+        self.bytes_dropped = 0
+
+    def open(self):
+        self.master, self.slave = os.openpty()
+        tty.setraw(self.master)
+        tty.setraw(self.slave)
+        os.set_blocking(self.master, False)
+        self.slave_name = os.ttyname(self.slave)
+        print(f"serial output on {self.slave_name}")
+
+    def write(self, data):
+        if self.master is None:
+            self.open()
+        try:
+            written = os.write(self.master, data)
+        except BlockingIOError:
+            written = 0
+        self.bytes_dropped += len(data) - written
+        return written
+
+    def close(self):
+        if self.master is not None:
+            os.close(self.master)
+            os.close(self.slave)
+            self.master = None
+            self.slave = None
+
+
+def create_serial_backend(name, port=None, baudrate=1000000):
+    if name == "serial":
+        return LazySerial(port, baudrate)
+    if name == "pty":
+        return PtySerial()
+    if name == "null":
+        return NullSerial()
+
+    raise ValueError(f"Unknown serial backend {name}, expected one of serial, pty, null")
@@ -0,0 +1,191 @@
+import struct
+from binascii import crc_hqx
+
+# Every message is one fixed layout frame, little endian:
+#
+#   sync (2) | type (1) | drone index (1) | sequence (2) | payload length (1) | payload | crc (2)
+#
+# The crc is CRC-16/CCITT-FALSE over everything between the sync bytes and the
+# crc. Payloads are packed as below; the receiver firmware has matching structs.
+
+SYNC = b"\xaa\x55"
+
+MSG_POSE = 1
+MSG_ARM = 2
+MSG_SETPOINT = 3
+MSG_PID = 4
+MSG_TRIM = 5
+
+PAYLOAD_FORMATS = {
+    MSG_POSE: struct.Struct("<7f"), # x, y, z, yaw, vx, vy, vz
+    MSG_ARM: struct.Struct("<B"),
+    MSG_SETPOINT: struct.Struct("<3f"), # x, y, z
+    MSG_PID: struct.Struct("<17f"), # see receiver_esp32.ino for the order
+    MSG_TRIM: struct.Struct("<4h"), # x, y, z, yaw
+}
+
+HEADER = struct.Struct("<BBHB")
+CRC = struct.Struct("<H")
+MAX_FRAME_SIZE = len(SYNC) + HEADER.size + max(x.size for x in PAYLOAD_FORMATS.values()) + CRC.size
+
+
+def crc16(data):
+    return crc_hqx(data, 0xffff)
+
+
+def encode(message_type, drone_index, sequence, *values):
+    payload = PAYLOAD_FORMATS[message_type].pack(*values)
+    body = HEADER.pack(message_type, drone_index, sequence & 0xffff, len(payload)) + payload
+    return SYNC + body + CRC.pack(crc16(body))
+
+
+class SerialEncoder:
+    """
+    Builds binary frames for the sender ESP32, keeping a sequence number per
+    drone so the drones can spot dropped or reordered messages.
+
+    """
+
+    def __init__(self):
+        self.sequences = {}
+
+    def _next_sequence(self, drone_index):
+        sequence = self.sequences.get(drone_index, 0)
+        self.sequences[drone_index] = (sequence + 1) & 0xffff
+        return sequence
+
+    def pose(self, drone_index, pos, heading, vel):
+        return encode(MSG_POSE, drone_index, self._next_sequence(drone_index), *pos, heading, *vel)
+
+    def arm(self, drone_index, armed):
+        return encode(MSG_ARM, drone_index, self._next_sequence(drone_index), bool(armed))
+
+    def setpoint(self, drone_index, setpoint):
+        return encode(MSG_SETPOINT, drone_index, self._next_sequence(drone_index), *setpoint)
+
+    def pid(self, drone_index, pid):
+        return encode(MSG_PID, drone_index, self._next_sequence(drone_index), *pid)
+
+    def trim(self, drone_index, trim):
+        return encode(MSG_TRIM, drone_index, self._next_sequence(drone_index), *[int(x) for x in trim])
+
+
+class SerialDecoder:
+    """
+    Incremental decoder for a stream of frames. Bytes can be fed in arbitrary
+    chunks; bad frames are counted and skipped by searching for the next sync.
+
+    """
+
+    def __init__(self):
+        self.buffer = bytearray()
+        self.crc_errors = 0
+
+    def feed(self, data):
+        """
+        Returns a list of (message type, drone index, sequence, values) tuples
+        for the complete frames received so far.
+        """
+        self.buffer += data
+        messages = []
+
+        while True:
+            start = self.buffer.find(SYNC)
+            if start < 0:
+                # keep a trailing byte in case it's the first half of a sync
+                del self.buffer[:max(len(self.buffer) - 1, 0)]
+                return messages
+            del self.buffer[:start]
+
+            if len(self.buffer) < len(SYNC) + HEADER.size:
+                return messages
+            message_type, drone_index, sequence, length = HEADER.unpack_from(self.buffer, len(SYNC))
+            payload_format = PAYLOAD_FORMATS.get(message_type)
+            if payload_format is None or payload_format.size != length:
+                self.crc_errors += 1
+                del self.buffer[:len(SYNC)]
+                continue
+
+            frame_size = len(SYNC) + HEADER.size + length + CRC.size
+            if len(self.buffer) < frame_size:
+                return messages
+
+            body = bytes(self.buffer[len(SYNC):frame_size - CRC.size])
+            if CRC.unpack_from(self.buffer, frame_size - CRC.size)[0] != crc16(body):
+                self.crc_errors += 1
+                del self.buffer[:len(SYNC)]
+                continue
+
+            values = payload_format.unpack_from(body, HEADER.size)
+            messages.append((message_type, drone_index, sequence, values))
+            del self.buffer[:frame_size]
+
+
+if __name__ == "__main__":
+    # loopback through a pseudo terminal, the same path bytes take to the sender ESP32
+    import json
+    import os
+    import threading
+    import time
+    import tty
+    import numpy as np
+
+    master, slave = os.openpty()
+    tty.setraw(master)
+    tty.setraw(slave)
+
+    encoder = SerialEncoder()
+    decoder = SerialDecoder()
+
+    # the pty buffer is small, so read on another thread as the frames are written
+    received = []
+    def read_loop():
+        while True:
+            data = os.read(master, 4096)
+            received.extend(decoder.feed(data))
+    threading.Thread(target=read_loop, daemon=True).start()
+
+    rng = np.random.default_rng(0)
+    sent = []
+    for i in range(0, 1000):
+        drone_index = i % 4
+        pos, heading, vel = rng.uniform(-2, 2, 3), rng.uniform(-np.pi, np.pi), rng.uniform(-1, 1, 3)
+        sent.append((MSG_POSE, drone_index, np.float32([*pos, heading, *vel])))
+        os.write(slave, encoder.pose(drone_index, pos, heading, vel))
+    sent.append((MSG_ARM, 1, np.float32([1])))
+    os.write(slave, encoder.arm(1, True))
+    sent.append((MSG_PID, 0, np.float32(np.arange(17))))
+    os.write(slave, encoder.pid(0, np.arange(17)))
+    sent.append((MSG_SETPOINT, 2, np.float32([0.5, -0.5, 1])))
+    os.write(slave, encoder.setpoint(2, [0.5, -0.5, 1]))
+    sent.append((MSG_TRIM, 3, np.float32([-10, 20, 0, 5])))
+    os.write(slave, encoder.trim(3, [-10, 20, 0, 5]))
+    # garbage between frames must not lose the next one
+    os.write(slave, b"\xaa\x00garbage\xaa")
+    sent.append((MSG_ARM, 0, np.float32([0])))
+    os.write(slave, encoder.arm(0, False))
+
+    deadline = time.time() + 5
+    while len(received) < len(sent) and time.time() < deadline:
+        time.sleep(0.01)
+    assert len(received) == len(sent), f"{len(received)} of {len(sent)} frames received"
+
+    for (message_type, drone_index, values), (received_type, received_drone_index, _, received_values) in zip(sent, received):
+        assert message_type == received_type and drone_index == received_drone_index
+        assert np.array_equal(values, np.float32(received_values))
+    print(f"{len(received)} frames received intact, {decoder.crc_errors} bad frames skipped")
+
+    pos, heading, vel = rng.uniform(-2, 2, 3), 1.2345, rng.uniform(-1, 1, 3)
+    json_message = f"0{json.dumps({'pos': [round(x, 4) for x in pos.tolist()] + [heading], 'vel': [round(x, 4) for x in vel.tolist()]})}".encode("utf-8")
+    binary_message = encoder.pose(0, pos, heading, vel)
+    print(f"pose: {len(json_message)} bytes as json, {len(binary_message)} bytes binary")
+
+    start = time.perf_counter()
+    for i in range(0, 10000):
+        f"0{json.dumps({'pos': [round(x, 4) for x in pos.tolist()] + [heading], 'vel': [round(x, 4) for x in vel.tolist()]})}".encode("utf-8")
+    json_time = (time.perf_counter() - start) / 10000
+    start = time.perf_counter()
+    for i in range(0, 10000):
+        encoder.pose(0, pos, heading, vel)
+    binary_time = (time.perf_counter() - start) / 10000
+    print(f"encode: {json_time*1e6:.1f}us as json, {binary_time*1e6:.1f}us binary")
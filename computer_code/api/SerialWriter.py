@@ -0,0 +1,304 @@
+import threading
+import time
+import struct
+import numpy as np
+from SerialProtocol import SerialEncoder
+from PipelineMetrics import PipelineMetrics
+
+class SerialWriter:
+    """
+    Owns the serial port and writes to it from its own thread, so nothing else
+    ever blocks on the radio.
+
+    Poses are coalesced: only the newest pose of each drone is kept, and one
+    that is replaced before it was written is counted in `poses_coalesced`.
+    Control messages (arm, pid, setpoint, trim) go out in the order they were
+    posted and are never coalesced, except that a disarm jumps the queue and
+    cancels any arm of the same drone still waiting, so a drone is never left
+    armed by an arm that was overtaken. Disarms are queued even when the queue
+    is full. Control messages are checked when they are posted, and ones that
+    can't be encoded raise a ValueError there rather than reaching the write
+    thread. Everything pending when the thread wakes up goes out in a single
+    write, control messages first. If the write fails, the control messages
+    are put back at the front of the queue and retried after `retry_interval`
+    seconds, while the poses are dropped for newer ones. Control messages
+    other than disarms are given up on (counted in `expired`) once they are
+    `max_retry_age` seconds old, so an arm or setpoint doesn't go out long
+    after it was asked for when the radio comes back.
+
+    """
+
+    def __init__(self, ser, max_queue_size=256, retry_interval=0.05, max_retry_age=0.5):
+        self.ser = ser
+        self.max_queue_size = max_queue_size
+        self.retry_interval = retry_interval
+        self.max_retry_age = max_retry_age
+        self.encoder = SerialEncoder()
+        self.validation_encoder = SerialEncoder() # its sequence numbers are never sent
+
+        self.condition = threading.Condition()
+        self.control_queue = [] # (disarm, encode, drone_index, values, post time), disarms first
+        self.poses = {}
+        self.closed = False
+
+        self.poses_coalesced = 0
+        self.dropped = 0
+        self.arms_cancelled = 0
+        self.retried = 0
+        self.expired = 0
+        self.invalid = 0
+        self.bytes_written = 0
+        self.writes = 0
+        self.write_errors = 0
+        self.last_write_error = None
+        self.metrics = None
+        self.latency = PipelineMetrics() # per drone, capture to serial write
+
+        self.thread = threading.Thread(target=self._write_loop, daemon=True)
+        self.thread.start()
+
+    def set_ser(self, ser):
+        with self.condition:
+            self.ser = ser
+
+    def set_metrics(self, metrics):
+        """ Records how long each write takes, as "serial write", in a PipelineMetrics. """
+        self.metrics = metrics
+
+    def pose(self, drone_index, pos, heading, vel, capture_time=None):
+        """
+        Queues a pose for a drone, replacing any of its poses not yet written.
+        `capture_time` is when the frame the pose came from was captured, on
+        the `time.time()` clock, and is used to measure end-to-end latency.
+        """
+        with self.condition:
+            if drone_index in self.poses:
+                self.poses_coalesced += 1
+            self.poses[drone_index] = (pos, heading, vel, capture_time)
+            self.condition.notify()
+
+    def _post(self, encode, drone_index, *values):
+        try:
+            encode.__func__(self.validation_encoder, drone_index, *values)
+        except (struct.error, TypeError, ValueError) as e:
+            raise ValueError(f"can't send {encode.__name__} to drone {drone_index}: {e}") from e
+
+        with self.condition:
+            if len(self.control_queue) >= self.max_queue_size:
+                self.dropped += 1
+                return
+            self.control_queue.append((False, encode, drone_index, values, time.time()))
+            self.condition.notify()
+
+    def _is_pending_arm(self, message, drone_index):
+        disarm, encode, message_drone_index, values, _ = message
+        return not disarm and encode == self.encoder.arm and message_drone_index == drone_index
+
+    def _num_disarms(self):
+        num_disarms = 0
+        while num_disarms < len(self.control_queue) and self.control_queue[num_disarms][0]:
+            num_disarms += 1
+        return num_disarms
+
+    def _post_disarm(self, drone_index):
+        with self.condition:
+            pending = len(self.control_queue)
+            self.control_queue = [message for message in self.control_queue if not self._is_pending_arm(message, drone_index)]
+            self.arms_cancelled += pending - len(self.control_queue)
+            # behind earlier disarms, ahead of everything else, and never dropped
+            self.control_queue.insert(self._num_disarms(), (True, self.encoder.arm, drone_index, (False,), time.time()))
+            self.condition.notify()
+
+    def _requeue(self, control_messages):
+        """ Puts control messages that failed to write back at the front of the queue. """
+        with self.condition:
+            # anything disarmed since doesn't get re-armed by the retry
+            disarmed = {drone_index for disarm, _, drone_index, _, _ in self.control_queue if disarm}
+            control_messages = [message for message in control_messages if not any(self._is_pending_arm(message, drone_index) for drone_index in disarmed)]
+            # a disarm is always worth sending, anything else goes stale
+            now = time.time()
+            fresh = [message for message in control_messages if message[0] or now - message[4] < self.max_retry_age]
+            self.expired += len(control_messages) - len(fresh)
+            control_messages = fresh
+            num_disarms = self._num_disarms()
+            self.control_queue[num_disarms:num_disarms] = control_messages
+            self.retried += len(control_messages)
+
+    def arm(self, drone_index, armed):
+        if armed:
+            self._post(self.encoder.arm, drone_index, True)
+        else:
+            self._post_disarm(drone_index)
+
+    def pid(self, drone_index, pid):
+        self._post(self.encoder.pid, drone_index, pid)
+
+    def setpoint(self, drone_index, setpoint):
+        self._post(self.encoder.setpoint, drone_index, setpoint)
+
+    def trim(self, drone_index, trim):
+        self._post(self.encoder.trim, drone_index, trim)
+
+    def stats(self):
+        with self.condition:
+            return {
+                "queue_depth": len(self.control_queue),
+                "pending_poses": len(self.poses),
+                "poses_coalesced": self.poses_coalesced,
+                "dropped": self.dropped,
+                "arms_cancelled": self.arms_cancelled,
+                "retried": self.retried,
+                "expired": self.expired,
+                "invalid": self.invalid,
+                "bytes_written": self.bytes_written,
+                "writes": self.writes,
+                "write_errors": self.write_errors,
+                "last_write_error": self.last_write_error
+            }
+
+    def latency_stats(self):
+        """
+        Per drone latency from frame capture to the end of the serial write of
+        its pose, in milliseconds, with the jitter as its standard deviation.
+        """
+        latency = self.latency.summary()
+        for name, stats in latency.items():
+            stats["jitter"] = float(np.std(self.latency.get_samples(name)) * 1e3)
+
+        return latency
+
+    def _write_loop(self):
+        while True:
+            with self.condition:
+                while not self.closed and len(self.control_queue) == 0 and len(self.poses) == 0:
+                    self.condition.wait()
+                if self.closed:
+                    return
+
+                control_messages = self.control_queue
+                self.control_queue = []
+                poses = self.poses
+                self.poses = {}
+                ser = self.ser
+
+            # encoding only ever happens on this thread, so sequence numbers need no lock.
+            # messages are checked when posted, but one that still can't be encoded is
+            # dropped on its own rather than taking the thread (and every later disarm) down
+            data = bytearray()
+            encoded_messages = []
+            for message in control_messages:
+                _, encode, drone_index, values, _ = message
+                try:
+                    data += encode(drone_index, *values)
+                    encoded_messages.append(message)
+                except Exception as e:
+                    print(f"dropped {encode.__name__} for drone {drone_index}: {e}")
+                    with self.condition:
+                        self.invalid += 1
+            for drone_index, pose in list(poses.items()):
+                try:
+                    data += self.encoder.pose(drone_index, *pose[:3])
+                except Exception as e:
+                    print(f"dropped pose for drone {drone_index}: {e}")
+                    del poses[drone_index]
+                    with self.condition:
+                        self.invalid += 1
+            if len(data) == 0:
+                continue
+
+            start = time.perf_counter()
+            try:
+                ser.write(data)
+            except Exception as e:
+                # an unplugged radio fails every retry, only say so when something changes
+                error = f"{type(e).__name__}: {e}"
+                if error != self.last_write_error:
+                    print(f"serial write failed: {error}")
+                with self.condition:
+                    self.write_errors += 1
+                    self.last_write_error = error
+                self._requeue(encoded_messages)
+                time.sleep(self.retry_interval)
+                continue
+
+            if self.metrics is not None:
+                self.metrics.record("serial write", time.perf_counter() - start)
+
+            now = time.time()
+            for drone_index, (_, _, _, capture_time) in poses.items():
+                if capture_time is not None:
+                    self.latency.record(f"drone {drone_index}", now - capture_time)
+
+            with self.condition:
+                self.bytes_written += len(data)
+                self.writes += 1
+                self.last_write_error = None
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify()
+        self.thread.join()
+
+
+if __name__ == "__main__":
+    # drive the writer through a pseudo terminal and decode what comes out the other end
+    import os
+    import tty
+    from SerialProtocol import SerialDecoder, MSG_ARM, MSG_POSE
+
+    master, slave = os.openpty()
+    tty.setraw(master)
+    tty.setraw(slave)
+
+    decoder = SerialDecoder()
+    received = []
+    def read_loop():
+        while True:
+            received.extend(decoder.feed(os.read(master, 4096)))
+    threading.Thread(target=read_loop, daemon=True).start()
+
+    class SlowSerial:
+        """ Roughly 1 Mbaud """
+        def __init__(self, fd):
+            self.fd = fd
+        def write(self, data):
+            time.sleep(len(data) * 10 / 1e6)
+            return os.write(self.fd, data)
+
+    writer = SerialWriter(SlowSerial(slave))
+
+    start = time.perf_counter()
+    post_times = []
+    for i in range(0, 2000):
+        t = time.perf_counter()
+        for drone_index in range(0, 8):
+            writer.pose(drone_index, np.full(3, i, dtype=np.float64), 0.0, np.zeros(3), time.time())
+        if i == 1000:
+            writer.setpoint(0, [0, 0, 1])
+            writer.arm(0, False)
+        post_times.append(time.perf_counter() - t)
+        time.sleep(0.0005)
+
+    deadline = time.time() + 5
+    while writer.stats()["pending_poses"] != 0 and time.time() < deadline:
+        time.sleep(0.01)
+    time.sleep(0.1)
+    writer.close()
+
+    stats = writer.stats()
+    print(stats)
+    latency = writer.latency_stats()["drone 0"]
+    print(f"post to write latency: p50 {latency['p50']:.2f}ms, p99 {latency['p99']:.2f}ms, jitter {latency['jitter']:.2f}ms")
+    print(f"posting 8 poses: p50 {np.percentile(post_times, 50)*1e6:.1f}us, p99 {np.percentile(post_times, 99)*1e6:.1f}us")
+
+    arm = [i for i, message in enumerate(received) if message[0] == MSG_ARM]
+    assert len(arm) == 1
+    assert decoder.crc_errors == 0
+    last_poses = {}
+    for message_type, drone_index, sequence, values in received:
+        if message_type == MSG_POSE:
+            assert values[0] >= last_poses.get(drone_index, -1), "poses went backwards"
+            last_poses[drone_index] = values[0]
+    assert all(x == 1999 for x in last_poses.values()), "newest pose not delivered"
+    print(f"{len(received)} frames received in {stats['writes']} writes, every drone's newest pose delivered")
@@ -0,0 +1,171 @@
+import numpy as np
+import cv2 as cv
+from CameraRig import CameraRig
+from FramePreprocessor import FramePreprocessor
+from RigidBodyRegistry import RigidBody, RigidBodyRegistry
+from helpers import to_world_coordinates
+
+
+def look_at(position, target, up=(0, 0, 1)):
+    """
+    World to camera rotation of a camera at `position` looking at `target`,
+    with the usual x right, y down, z forward camera axes.
+    """
+    forward = np.asarray(target, dtype=np.float64) - position
+    forward /= np.linalg.norm(forward)
+    right = np.cross(forward, up)
+    right /= np.linalg.norm(right)
+    down = np.cross(forward, right)
+
+    return np.array([right, down, forward])
+
+
+def synthetic_rigid_bodies(num_drones):
+    """
+    The default layouts for up to two drones, then more triangles with a longer
+    apex each, so every drone's layout is distinct.
+    """
+    rigid_bodies = RigidBodyRegistry.default(num_drones).rigid_bodies
+    half_base = 0.15/2
+    for i in range(len(rigid_bodies), num_drones):
+        apex = 0.1 + 0.05*i
+        rigid_bodies.append(RigidBody(i, [[half_base, 0, 0], [-half_base, 0, 0], [0, apex, 0]]))
+
+    return rigid_bodies
+
+
+def circle_trajectory(center=(0, 0, 0.5), radius=0.5, period=8.0, phase=0.0, yaw=0.0):
+    """
+    Flies around a horizontal circle at a fixed heading (the default layouts
+    can only be told apart within +-90 degrees of yaw).
+    """
+    center = np.asarray(center, dtype=np.float64)
+
+    def trajectory(t):
+        angle = 2*np.pi * t / period + phase
+        return center + radius * np.array([np.cos(angle), np.sin(angle), 0]), yaw
+
+    return trajectory
+
+
+class SyntheticScene:
+    """
+    A deterministic stand in for cameras looking at drones. Drones fly scripted
+    trajectories (functions of time returning a world position and yaw) with
+    their markers laid out as in their `RigidBody`, and are seen by cameras
+    with the given intrinsics and poses.
+
+    The scene can either render raw camera frames, which go through the whole
+    pipeline like frames from pseyepy, or directly give the image points the
+    blob detector would find, with pixel noise, dropped markers and spurious
+    points.
+
+    The world frame is the one `to_world_coordinates` maps the triangulation
+    frame to, with the given `to_world_coords_matrix`, so the whole chain down
+    to `locate_objects` and the Kalman filter sees consistent coordinates.
+
+    """
+
+    def __init__(self, camera_models, drones, camera_poses=None, to_world_coords_matrix=None, input_shape=(240, 320, 3),
+                 noise=0.0, dropout=0.0, false_positives=0.0, marker_radius=2, seed=0):
+        self.drones = list(drones) # (RigidBody, trajectory) pairs
+        self.input_shape = input_shape
+        self.noise = noise # pixels, standard deviation
+        self.dropout = dropout # probability of a marker being missed by a camera
+        self.false_positives = false_positives # mean number of spurious points per camera per frame
+        self.marker_radius = marker_radius
+        self.rng = np.random.default_rng(seed)
+
+        # has to be a rigid transform (the scale is baked into the camera poses) and
+        # a proper rotation overall, so camera poses stay rotations
+        self.to_world_coords_matrix = np.diag([1., 1., -1., 1.]) if to_world_coords_matrix is None else np.array(to_world_coords_matrix, dtype=np.float64)
+        self.world_origin = to_world_coordinates(np.zeros(3), self.to_world_coords_matrix)[0]
+        self.world_axes = (to_world_coordinates(np.eye(3), self.to_world_coords_matrix) - self.world_origin).T
+
+        if camera_poses is None:
+            camera_poses = self.ring_camera_poses(len(camera_models))
+        self.camera_poses = camera_poses
+        self.camera_rig = CameraRig.from_poses(camera_models, camera_poses)
+        self.frame_preprocessors = [FramePreprocessor(camera_model) for camera_model in camera_models]
+
+    def ring_camera_poses(self, num_cameras, radius=2.0, height=2.0, target=(0, 0, 0.5)):
+        """ Cameras evenly spaced on a circle above the scene, all looking at `target`. """
+        camera_poses = []
+        for i in range(0, num_cameras):
+            angle = 2*np.pi * i / num_cameras
+            position = np.array([radius*np.cos(angle), radius*np.sin(angle), height])
+            R_world = look_at(position, target)
+            t_world = -R_world @ position
+
+            # world = world_axes @ rig + world_origin
+            camera_poses.append({
+                "R": R_world @ self.world_axes,
+                "t": R_world @ self.world_origin + t_world
+            })
+
+        return camera_poses
+
+    def world_to_rig(self, points):
+        return (np.asarray(points, dtype=np.float64) - self.world_origin) @ np.linalg.inv(self.world_axes).T
+
+    def drone_states(self, t):
+        """ The true position and yaw of every drone at time t. """
+        return [(rigid_body.drone_index, *trajectory(t)) for rigid_body, trajectory in self.drones]
+
+    def marker_points(self, t):
+        """ (N, 3) world positions of every marker at time t. """
+        marker_points = [np.empty((0, 3))]
+        for rigid_body, trajectory in self.drones:
+            position, yaw = trajectory(t)
+            R = np.array([[np.cos(yaw), -np.sin(yaw), 0], [np.sin(yaw), np.cos(yaw), 0], [0, 0, 1]])
+            marker_points.append(rigid_body.marker_points @ R.T + position)
+
+        return np.concatenate(marker_points)
+
+    def _project(self, t):
+        object_points = self.world_to_rig(self.marker_points(t))
+        projected = np.einsum("cij,nj->cni", self.camera_rig.Ps, np.c_[object_points, np.ones(len(object_points))])
+        depths = projected[:,:,2]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            image_points = projected[:,:,:2] / depths[:,:,np.newaxis]
+
+        size = max(self.input_shape[:2])
+        visible = (depths > 0) & np.all((image_points >= 0) & (image_points < size), axis=2)
+
+        return image_points, visible
+
+    def image_points(self, t):
+        """
+        What each camera's blob detection would report at time t: a list with
+        an (K, 2) array of undistorted image points per camera, in no
+        particular order.
+        """
+        image_points, visible = self._project(t)
+        size = max(self.input_shape[:2])
+
+        camera_image_points = []
+        for i in range(0, self.camera_rig.num_cameras):
+            kept = visible[i] & (self.rng.random(len(visible[i])) >= self.dropout)
+            points = image_points[i, kept] + self.rng.normal(0, self.noise, (np.sum(kept), 2))
+            spurious = self.rng.uniform(0, size, (self.rng.poisson(self.false_positives), 2))
+            points = np.concatenate((points, spurious))
+            camera_image_points.append(points[self.rng.permutation(len(points))])
+
+        return camera_image_points
+
+    def render(self, camera_index, t):
+        """ The raw frame camera `camera_index` would capture at time t. """
+        image_points, visible = self._project(t)
+        frame = np.zeros(self.input_shape, dtype=np.uint8)
+
+        points = image_points[camera_index, visible[camera_index]]
+        if len(points) == 0:
+            return frame
+        points = self.frame_preprocessors[camera_index].to_input_coordinates(points, self.input_shape)
+        points = points + self.rng.normal(0, self.noise, points.shape)
+
+        shift = 4 # sub-pixel centers
+        for x, y in np.round(points * (1 << shift)).astype(np.int64):
+            cv.circle(frame, (int(x), int(y)), self.marker_radius << shift, (255, 255, 255), -1, cv.LINE_AA, shift)
+
+        return frame
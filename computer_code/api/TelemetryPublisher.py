@@ -0,0 +1,157 @@
+import threading
+import time
+import numpy as np
+
+# Point clouds go out as little-endian float32 typed arrays (Socket.IO binary
+# attachments) rather than JSON lists, one row per point or object:
+#
+#   object_points     x, y, z
+#   errors            error
+#   objects           x, y, z, heading, error, fit_error, droneIndex
+#   filtered_objects  x, y, z, vx, vy, vz, heading, droneIndex, coasting
+
+
+def encode_array(array, width):
+    return np.asarray(array, dtype="<f4").reshape((-1, width)).tobytes()
+
+
+def encode_object_points(data):
+    objects = [[*object["pos"], object["heading"], object["error"], object["fit_error"], object["droneIndex"]] for object in data["objects"]]
+    filtered_objects = [[*object["pos"], *object["vel"], object["heading"], object["droneIndex"], object["coasting"]] for object in data["filtered_objects"]]
+
+    return {
+        "object_points": encode_array(data["object_points"], 3),
+        "errors": encode_array(data["errors"], 1),
+        "objects": encode_array(objects, 7),
+        "filtered_objects": encode_array(filtered_objects, 9)
+    }
+
+
+ENCODERS = {
+    "object-points": encode_object_points
+}
+
+
+def to_json(value):
+    """
+    `value` with numpy arrays and scalars turned into lists and numbers, and
+    NaN (how the pipeline marks missing values) into None, which JSON has no
+    NaN for. Used on everything that goes out as JSON rather than typed arrays.
+    """
+    if isinstance(value, dict):
+        return {key: to_json(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [to_json(item) for item in value]
+    if isinstance(value, np.ndarray):
+        return to_json(value.tolist())
+    if isinstance(value, np.generic):
+        value = value.item()
+    if isinstance(value, float) and np.isnan(value):
+        return None
+    return value
+
+
+class TelemetryPublisher:
+    """
+    Sends the pipeline's output to the frontend from its own thread, at most
+    `rate` times a second per event whatever the tracking rate is.
+
+    The tracking thread only hands over its latest results with `publish`,
+    which replaces anything of the same event that hasn't gone out yet, so the
+    frontend always gets the newest snapshot and a slow client never backs up
+    the pipeline. Encoding and emitting happen on the publisher thread, and
+    data can be passed as a function to build it there too. With a
+    PipelineMetrics set, every encode and emit is timed as "telemetry emit".
+
+    """
+
+    def __init__(self, socketio, rate=30):
+        self.socketio = socketio
+        self.rate = rate
+
+        self.condition = threading.Condition()
+        self.pending = {}
+        self.closed = False
+
+        self.published = 0
+        self.replaced = 0
+        self.sent = 0
+        self.errors = 0
+        self.metrics = None
+
+        self.thread = threading.Thread(target=self._publish_loop, daemon=True)
+        self.thread.start()
+
+    def set_socketio(self, socketio):
+        with self.condition:
+            self.socketio = socketio
+
+    def set_metrics(self, metrics):
+        self.metrics = metrics
+
+    def set_rate(self, rate):
+        with self.condition:
+            self.rate = rate
+
+    def publish(self, event, data):
+        """
+        Queues the latest `data` for `event`. The data mustn't be modified
+        afterwards. If `data` is callable, it's called on the publisher thread
+        for the data to send.
+        """
+        with self.condition:
+            if event in self.pending:
+                self.replaced += 1
+            self.pending[event] = data
+            self.published += 1
+            self.condition.notify()
+
+    def stats(self):
+        with self.condition:
+            return {
+                "pending": len(self.pending),
+                "published": self.published,
+                "replaced": self.replaced,
+                "sent": self.sent,
+                "errors": self.errors
+            }
+
+    def _publish_loop(self):
+        while True:
+            with self.condition:
+                while not self.closed and len(self.pending) == 0:
+                    self.condition.wait()
+                if self.closed:
+                    return
+
+                pending = self.pending
+                self.pending = {}
+                socketio = self.socketio
+                interval = 1 / self.rate
+
+            start = time.time()
+            for event, data in pending.items():
+                emit_start = time.perf_counter()
+                try:
+                    if callable(data):
+                        data = data()
+                    socketio.emit(event, ENCODERS[event](data) if event in ENCODERS else to_json(data))
+                except Exception as e:
+                    print(f"telemetry {event} failed: {e}")
+                    with self.condition:
+                        self.errors += 1
+                    continue
+
+                if self.metrics is not None:
+                    self.metrics.record("telemetry emit", time.perf_counter() - emit_start)
+                with self.condition:
+                    self.sent += 1
+
+            # whatever arrives meanwhile is coalesced into the next send
+            time.sleep(max(0, start + interval - time.time()))
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify()
+        self.thread.join()
@@ -0,0 +1,155 @@
+"""
+Runs the tracking pipeline on a synthetic scene and reports per stage latency
+percentiles for each combination of camera and drone count, e.g.
+
+    python benchmark.py --cameras 2 4 8 --drones 1 2 4 --frames 300
+
+In `frames` mode every frame is rendered and goes through preprocessing and
+blob detection, in `points` mode the scene gives the image points directly and
+only the 3D stages run. Rendering itself isn't timed.
+
+With `--replay FILE`, a capture file recorded by the server is instead played
+as fast as possible through the whole of `Cameras._camera_read`, e.g.
+
+    python benchmark.py --replay recordings/20240101-120000.mocap
+
+"""
+import argparse
+import time
+import numpy as np
+from CameraRig import load_camera_models
+from BlobDetector import BlobDetector
+from RigidBodyRegistry import RigidBodyRegistry
+from KalmanFilter import KalmanFilter
+from SyntheticScene import SyntheticScene, synthetic_rigid_bodies, circle_trajectory
+from CameraBackend import ReplayCameraBackend
+from SerialBackend import NullSerial
+from SerialWriter import SerialWriter
+from TelemetryPublisher import TelemetryPublisher
+from helpers import Cameras, find_point_correspondance_and_object_points, to_world_coordinates, locate_objects
+
+
+def run_benchmark(num_cameras, num_drones, num_frames, mode="frames", fps=90, noise=0.2, dropout=0.0, false_positives=0.0, seed=0):
+    rigid_bodies = synthetic_rigid_bodies(num_drones)
+    drones = [(rigid_body, circle_trajectory(radius=0.8, phase=2*np.pi*i/num_drones)) for i, rigid_body in enumerate(rigid_bodies)]
+    scene = SyntheticScene(load_camera_models(num_cameras), drones, noise=noise, dropout=dropout, false_positives=false_positives, seed=seed)
+
+    blob_detector = BlobDetector(annotate=False)
+    rigid_body_registry = RigidBodyRegistry(rigid_bodies)
+    kalman_filter = KalmanFilter(num_drones)
+
+    stages = ["preprocess", "blob detection"] if mode == "frames" else []
+    stages += ["correspondence + triangulation", "world transform", "locate objects", "kalman filter"]
+    timings = {stage: np.zeros(num_frames) for stage in stages}
+    num_located = 0
+
+    for frame_index in range(0, num_frames):
+        t = frame_index / fps
+
+        if mode == "frames":
+            raw_frames = [scene.render(i, t) for i in range(0, num_cameras)]
+
+            start = time.perf_counter()
+            frames = [scene.frame_preprocessors[i].process(raw_frames[i]) for i in range(0, num_cameras)]
+            timings["preprocess"][frame_index] = time.perf_counter() - start
+
+            start = time.perf_counter()
+            image_points = [blob_detector.detect(frame)[:,:2] for frame in frames]
+            timings["blob detection"][frame_index] = time.perf_counter() - start
+        else:
+            image_points = scene.image_points(t)
+
+        start = time.perf_counter()
+        errors, object_points, _ = find_point_correspondance_and_object_points(image_points, scene.camera_rig)
+        timings["correspondence + triangulation"][frame_index] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        object_points = to_world_coordinates(object_points, scene.to_world_coords_matrix)
+        timings["world transform"][frame_index] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        objects = locate_objects(object_points, errors, rigid_body_registry)
+        timings["locate objects"][frame_index] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        kalman_filter.predict_location(objects, t)
+        timings["kalman filter"][frame_index] = time.perf_counter() - start
+
+        num_located += len(objects)
+
+    timings["total"] = np.sum([timings[stage] for stage in stages], axis=0)
+
+    return timings, num_located / (num_frames * num_drones)
+
+
+class NullSocketIO:
+    def emit(self, *args, **kwargs):
+        pass
+
+
+def run_replay_benchmark(path, num_frames=None):
+    """
+    Times `Cameras._camera_read` on every frame of a capture file, triangulating
+    and locating objects if the recording has camera poses, along with the
+    stages within it recorded in `Cameras.metrics`.
+    """
+    camera_backend = ReplayCameraBackend(path, speed=None, loop=False)
+    cameras = Cameras.instance()
+    cameras.set_camera_backend(camera_backend)
+    cameras.set_socketio(NullSocketIO())
+    cameras.set_telemetry(TelemetryPublisher(NullSocketIO()))
+    cameras.set_serial_writer(SerialWriter(NullSerial()))
+
+    metadata = camera_backend.recording.metadata
+    cameras.set_num_objects(metadata.get("num_objects") or 2)
+    cameras.drone_armed = [True] * cameras.num_objects
+    cameras.start_capturing_points()
+    if metadata.get("camera_poses") is not None and metadata.get("to_world_coords_matrix") is not None:
+        cameras.to_world_coords_matrix = metadata["to_world_coords_matrix"]
+        cameras.start_trangulating_points(metadata["camera_poses"])
+        cameras.start_locating_objects()
+
+    num_frames = len(camera_backend.recording) if num_frames is None else min(num_frames, len(camera_backend.recording))
+    cameras.metrics.reset()
+    times = np.zeros(num_frames)
+    for i in range(0, num_frames):
+        start = time.perf_counter()
+        cameras._camera_read()
+        times[i] = time.perf_counter() - start
+
+    # the stages as timed by the server itself, then the whole read
+    timings = {name: cameras.metrics.get_samples(name) for name in cameras.metrics.summary()}
+    timings["_camera_read"] = times
+
+    return timings
+
+
+def print_report(title, timings):
+    print(f"\n{title}")
+    print(f"  {'stage':<32}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+    for stage, times in timings.items():
+        p50, p95, p99 = np.percentile(times, [50, 95, 99]) * 1e3
+        print(f"  {stage:<32}{p50:>10.3f}{p95:>10.3f}{p99:>10.3f}{times.max()*1e3:>10.3f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--cameras", type=int, nargs="+", default=[4])
+    parser.add_argument("--drones", type=int, nargs="+", default=[2])
+    parser.add_argument("--frames", type=int, default=300)
+    parser.add_argument("--mode", choices=["frames", "points"], default="frames")
+    parser.add_argument("--noise", type=float, default=0.2, help="pixels")
+    parser.add_argument("--dropout", type=float, default=0.0, help="probability of a camera missing a marker, points mode only")
+    parser.add_argument("--false-positives", type=float, default=0.0, help="spurious points per camera per frame, points mode only")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--replay", help="capture file to replay through the full pipeline instead")
+    args = parser.parse_args()
+
+    if args.replay is not None:
+        print_report(f"replay of {args.replay}", run_replay_benchmark(args.replay))
+    else:
+        for num_cameras in args.cameras:
+            for num_drones in args.drones:
+                timings, located = run_benchmark(num_cameras, num_drones, args.frames, args.mode, noise=args.noise,
+                                                 dropout=args.dropout, false_positives=args.false_positives, seed=args.seed)
+                print_report(f"{num_cameras} cameras, {num_drones} drones, {located*100:.1f}% of drone poses located", timings)
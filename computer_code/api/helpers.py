@@ -1,15 +1,24 @@
 import numpy as np
-from scipy import linalg, optimize, signal
+from scipy import optimize
 import cv2 as cv
-from scipy.spatial.transform import Rotation
-import copy
 import json
 import os
 import time
-import numpy as np
-import cv2 as cv
+import threading
+import traceback
 from KalmanFilter import KalmanFilter
-from pseyepy import Camera
+from FrameRingBuffer import FrameRingBuffer
+from FrameRecorder import FrameRecorder
+from PipelineMetrics import PipelineMetrics
+from PreviewEncoder import PreviewEncoder
+from BundleAdjustment import BundleAdjustment
+from CalibrationCapture import CalibrationCapture
+from CameraRig import CameraModel, CameraRig, posed_camera_models
+from FramePreprocessor import FramePreprocessor
+from CameraProcessPool import CameraProcessPool
+from BlobDetector import BlobDetector, blobs_to_image_points
+from RoiTracker import RoiTracker
+from RigidBodyRegistry import RigidBodyRegistry
 from Singleton import Singleton
 
 
@@ -20,15 +29,25 @@ class Cameras:
         filename = os.path.join(dirname, "camera-params.json")
         f = open(filename)
         self.camera_params = json.load(f)
-
-        self.cameras = Camera(fps=90, resolution=Camera.RES_SMALL, gain=10, exposure=100)
-        self.num_cameras = len(self.cameras.exposure)
-        print(self.num_cameras)
+        self.camera_models = [CameraModel.from_params(camera_params) for camera_params in self.camera_params]
+        self.camera_params_lock = threading.Lock()
+        self.pending_camera_models = {} # camera index -> CameraModel, applied by the capture thread
+        self.frame_preprocessors = [FramePreprocessor(camera_model) for camera_model in self.camera_models]
+        self.blob_detector = BlobDetector(annotate=False) # annotations are drawn on the preview
+        self.use_process_pool = False
+        self.camera_process_pool = None
+        self.use_roi_tracking = False
+        self.roi_tracker = RoiTracker()
+
+        # set with set_camera_backend, nothing is opened until then
+        self.cameras = None
+        self.num_cameras = 0
 
         self.is_capturing_points = False
 
         self.is_triangulating_points = False
         self.camera_poses = None
+        self.camera_rig = None
 
         self.is_locating_objects = False
 
@@ -37,13 +56,31 @@ class Cameras:
         self.drone_armed = []
 
         self.num_objects = None
+        self.rigid_body_registry = None
 
         self.kalman_filter = None
 
         self.socketio = None
-        self.ser = None
+        self.serial_writer = None
+        self.telemetry = None
+
+        self.calibration_capture = None
 
-        self.serialLock = None
+        self.frame_recorder = None
+        self.pending_recording = None
+        self.recording_lock = threading.Lock()
+
+        self.frame_buffer = FrameRingBuffer()
+        self.capture_thread = None
+        self.fps = 0
+        self.capture_errors = 0
+        self.last_capture_error = None
+        self.capture_error_backoff = 0.1 # seconds, so a camera that's gone doesn't spin the loop
+
+        self.metrics = PipelineMetrics()
+        self.metrics_interval = 1.0 # seconds between "metrics" socket events
+
+        self.preview = PreviewEncoder(self.frame_buffer, self.metrics)
 
         global cameras_init
         cameras_init = True
@@ -51,116 +88,238 @@ class Cameras:
     def set_socketio(self, socketio):
         self.socketio = socketio
     
-    def set_ser(self, ser):
-        self.ser = ser
+    def set_camera_backend(self, camera_backend):
+        self.cameras = camera_backend
+        self.num_cameras = camera_backend.num_cameras
+        print(self.num_cameras)
 
-    def set_serialLock(self, serialLock):
-        self.serialLock = serialLock
+    def set_telemetry(self, telemetry):
+        self.telemetry = telemetry
+        self.telemetry.set_metrics(self.metrics)
+
+    def set_serial_writer(self, serial_writer):
+        self.serial_writer = serial_writer
+        self.serial_writer.set_metrics(self.metrics)
 
     def set_num_objects(self, num_objects):
         self.num_objects = num_objects
         self.drone_armed = [False for i in range(0, self.num_objects)]
+        self.rigid_body_registry = RigidBodyRegistry.default(num_objects)
     
+    def set_use_process_pool(self, use_process_pool):
+        self.use_process_pool = use_process_pool
+        if not use_process_pool and self.camera_process_pool is not None:
+            self.camera_process_pool.close()
+            self.camera_process_pool = None
+
+    def set_use_roi_tracking(self, use_roi_tracking):
+        self.use_roi_tracking = use_roi_tracking
+        self.roi_tracker.reset()
+
     def edit_settings(self, exposure, gain):
         self.cameras.exposure = [exposure] * self.num_cameras
         self.cameras.gain = [gain] * self.num_cameras
 
     def _camera_read(self):
-        frames, _ = self.cameras.read()
-
-        for i in range(0, self.num_cameras):
-            frames[i] = np.rot90(frames[i], k=self.camera_params[i]["rotation"])
-            frames[i] = make_square(frames[i])
-            frames[i] = cv.undistort(frames[i], self.get_camera_params(i)["intrinsic_matrix"], self.get_camera_params(i)["distortion_coef"])
-            frames[i] = cv.GaussianBlur(frames[i],(9,9),0)
-            kernel = np.array([[-2,-1,-1,-1,-2],
-                               [-1,1,3,1,-1],
-                               [-1,3,4,3,-1],
-                               [-1,1,3,1,-1],
-                               [-2,-1,-1,-1,-2]])
-            frames[i] = cv.filter2D(frames[i], -1, kernel)
-            frames[i] = cv.cvtColor(frames[i], cv.COLOR_RGB2BGR)
+        if len(self.pending_camera_models) != 0:
+            self._apply_camera_params()
+
+        timer = self.metrics.timer()
+        frames, timestamps = self.cameras.read()
+        # the capture time stays with this frame down to the serial write of the poses found in it
+        timestamp = float(np.mean(timestamps)) if timestamps is not None and len(timestamps) != 0 else time.time()
+        timer("capture")
+
+        if self.frame_recorder is not None or self.pending_recording is not None:
+            self._record(frames, timestamps)
+            timer("record")
+
+        # only search around where the markers are expected to be, when we know where that is
+        windows = None
+        if self.use_roi_tracking and self.is_triangulating_points:
+            size = max(frames[0].shape[:2])
+            windows = self.roi_tracker.get_windows(self.camera_rig, (size, size), timestamp)
+            timer("roi prediction")
+
+        # what the preview draws over the frames, only gathered if someone will see it
+        annotations = {"num_cameras": self.num_cameras}
+        epipolar_lines = None
+        if self.preview.num_viewers != 0 and self.preview.wants_annotations:
+            annotations["windows"] = windows
+            epipolar_lines = annotations["epipolar_lines"] = [[] for _ in range(0, self.num_cameras)]
+
+        image_points = None
+        if self.use_process_pool:
+            if self.camera_process_pool is None:
+                self.camera_process_pool = CameraProcessPool(self.camera_models, self.blob_detector)
+            frames, image_points = self.camera_process_pool.process(frames, self.is_capturing_points, windows)
+            timer("camera processes")
+        else:
+            for i in range(0, self.num_cameras):
+                frames[i] = self.frame_preprocessors[i].process(frames[i])
+            timer("preprocess")
 
         if (self.is_capturing_points):
-            image_points = []
-            for i in range(0, self.num_cameras):
-                frames[i], single_camera_image_points = self._find_dot(frames[i])
-                image_points.append(single_camera_image_points)
+            if image_points is None:
+                image_points = []
+                for i in range(0, self.num_cameras):
+                    frames[i], single_camera_image_points = self._find_dot(frames[i], None if windows is None else windows[i])
+                    image_points.append(single_camera_image_points)
+                timer("blob detection")
+
+            if epipolar_lines is not None:
+                annotations["image_points"] = image_points
+
+            found_points = any(len(points) != 0 for points in image_points)
+            if self.use_roi_tracking and self.is_triangulating_points and not found_points:
+                self.roi_tracker.update([], timestamp)
             
-            if (any(np.all(point[0] != [None,None]) for point in image_points)):
+            if found_points:
                 if self.is_capturing_points and not self.is_triangulating_points:
-                    self.socketio.emit("image-points", [x[0] for x in image_points])
+                    if self.calibration_capture is None:
+                        self.calibration_capture = CalibrationCapture(self.num_cameras, max(frames[0].shape[:2]))
+                    # a camera seeing more than one blob can't tell which is the marker
+                    observation = np.full((self.num_cameras, 2), np.nan, dtype=np.float32)
+                    for i, points in enumerate(image_points):
+                        if len(points) == 1:
+                            observation[i] = points[0]
+                    self.calibration_capture.add(observation)
+                    timer("calibration capture")
+                    self.telemetry.publish("calibration-capture", self.calibration_capture.stats())
+                    timer("telemetry handoff")
                 elif self.is_triangulating_points:
-                    errors, object_points, frames = find_point_correspondance_and_object_points(image_points, self.camera_poses, frames)
+                    # records the "correspondence" and "triangulation" stages itself
+                    errors, object_points, _ = find_point_correspondance_and_object_points(image_points, self.camera_rig, epipolar_lines=epipolar_lines, timer=timer)
+                    if self.use_roi_tracking:
+                        self.roi_tracker.update(object_points, timestamp)
 
-                    # convert to world coordinates
-                    for i, object_point in enumerate(object_points):
-                        new_object_point = np.array([[-1,0,0],[0,-1,0],[0,0,1]]) @ object_point
-                        new_object_point = np.concatenate((new_object_point, [1]))
-                        new_object_point = np.array(self.to_world_coords_matrix) @ new_object_point
-                        new_object_point = new_object_point[:3] / new_object_point[3]
-                        new_object_point[1], new_object_point[2] = new_object_point[2], new_object_point[1]
-                        object_points[i] = new_object_point
+                    object_points = to_world_coordinates(object_points, self.to_world_coords_matrix)
+                    timer("world transform")
 
                     objects = []
                     filtered_objects = []
                     if self.is_locating_objects:
-                        objects = locate_objects(object_points, errors)
-                        filtered_objects = self.kalman_filter.predict_location(objects)
-                        
-                        if len(filtered_objects) != 0:
-                            for filtered_object in filtered_objects:
-                                if self.drone_armed[filtered_object['droneIndex']]:
-                                    filtered_object["heading"] = round(filtered_object["heading"], 4)
-
-                                    serial_data = { 
-                                        "pos": [round(x, 4) for x in filtered_object["pos"].tolist()] + [filtered_object["heading"]],
-                                        "vel": [round(x, 4) for x in filtered_object["vel"].tolist()]
-                                    }
-                                    with self.serialLock:
-                                        self.ser.write(f"{filtered_object['droneIndex']}{json.dumps(serial_data)}".encode('utf-8'))
-                                        time.sleep(0.001)
-                            
-                        for filtered_object in filtered_objects:
-                            filtered_object["vel"] = filtered_object["vel"].tolist()
-                            filtered_object["pos"] = filtered_object["pos"].tolist()
-                    
-                    self.socketio.emit("object-points", {
-                        "object_points": object_points.tolist(), 
-                        "errors": errors.tolist(), 
-                        "objects": [{k:(v.tolist() if isinstance(v, np.ndarray) else v) for (k,v) in object.items()} for object in objects], 
+                        objects = locate_objects(object_points, errors, self.rigid_body_registry)
+                        timer("object location")
+                        filtered_objects = self._track_objects(objects, timestamp, timer)
+
+                    # encoded and sent on the telemetry thread, none of these are modified after this
+                    self.telemetry.publish("object-points", {
+                        "object_points": object_points,
+                        "errors": errors,
+                        "objects": objects,
                         "filtered_objects": filtered_objects
                     })
+                    timer("telemetry handoff")
+            elif self.is_triangulating_points and self.is_locating_objects:
+                # nothing seen, the tracks still coast and retire on time
+                filtered_objects = self._track_objects([], timestamp, timer)
+                self.telemetry.publish("object-points", {
+                    "object_points": np.empty((0, 3)),
+                    "errors": np.empty(0),
+                    "objects": [],
+                    "filtered_objects": filtered_objects
+                })
+                timer("telemetry handoff")
         
-        return frames
+        return frames, annotations
+
+    def _track_objects(self, objects, timestamp, timer):
+        """
+        Advances the drone tracks to the frame captured at `timestamp` with the
+        objects located in it, if any, and posts the poses of armed drones.
+        """
+        filtered_objects = self.kalman_filter.predict_location(objects, timestamp)
+        timer("kalman filter")
+
+        for filtered_object in filtered_objects:
+            if self.drone_armed[filtered_object["droneIndex"]]:
+                self.serial_writer.pose(filtered_object["droneIndex"], filtered_object["pos"], filtered_object["heading"], filtered_object["vel"], timestamp)
+        timer("serial post")
+
+        return filtered_objects
+
+    def start_capture_thread(self):
+        if self.capture_thread is not None and self.capture_thread.is_alive():
+            return
+
+        self.capture_thread = threading.Thread(target=self._capture_loop, daemon=True)
+        self.capture_thread.start()
+
+    def _capture_loop(self):
+        # runs at whatever rate the cameras deliver frames, independent of how many
+        # (if any) clients are watching the stream
+        fps_window = 10
+        i = 0
+        window_start_time = time.time()
+        last_metrics_time = window_start_time
+
+        while True:
+            start = time.perf_counter()
+            try:
+                frames, annotations = self._camera_read()
+                #frames = [add_white_border(frame, 5) for frame in frames]
+                if self.preview.num_viewers != 0:
+                    self.frame_buffer.publish(frames, annotations)
+            except Exception as e:
+                # one bad frame mustn't stop tracking for good
+                error = f"{type(e).__name__}: {e}"
+                if error != self.last_capture_error:
+                    print(f"capture failed: {error}")
+                    traceback.print_exc()
+                self.capture_errors += 1
+                self.last_capture_error = error
+                time.sleep(self.capture_error_backoff)
+                continue
+            self.metrics.record("frame", time.perf_counter() - start)
+
+            if self.telemetry is not None and time.time() - last_metrics_time > self.metrics_interval:
+                last_metrics_time = time.time()
+                # the percentiles are worked out on the telemetry thread, not here
+                self.telemetry.publish("metrics", self.get_metrics)
+
+            i = (i+1)%fps_window
+            if i == 0:
+                time_now = time.time()
+                self.fps = round(fps_window / (time_now - window_start_time))
+                window_start_time = time_now
+                if self.telemetry is not None:
+                    self.telemetry.publish("fps", {"fps": self.fps})
+
+    def get_metrics(self):
+        metrics = {
+            "fps": self.fps,
+            "stages": self.metrics.summary(),
+            "capture_errors": self.capture_errors,
+            "last_capture_error": self.last_capture_error
+        }
+        if self.serial_writer is not None:
+            metrics["serial"] = self.serial_writer.stats()
+            metrics["latency"] = self.serial_writer.latency_stats()
+        if self.telemetry is not None:
+            metrics["telemetry"] = self.telemetry.stats()
+        metrics["preview"] = self.preview.stats()
 
-    def get_frames(self):
-        frames = self._camera_read()
-        #frames = [add_white_border(frame, 5) for frame in frames]
+        return metrics
 
-        return np.hstack(frames)
+    def get_frames(self, out=None):
+        return self.frame_buffer.latest(out)
 
-    def _find_dot(self, img):
-        # img = cv.GaussianBlur(img,(5,5),0)
-        grey = cv.cvtColor(img, cv.COLOR_RGB2GRAY)
-        grey = cv.threshold(grey, 255*0.2, 255, cv.THRESH_BINARY)[1]
-        contours,_ = cv.findContours(grey, cv.RETR_TREE, cv.CHAIN_APPROX_SIMPLE)
-        img = cv.drawContours(img, contours, -1, (0,255,0), 1)
+    def _find_dot(self, img, windows=None):
+        blobs = self.blob_detector.detect(img, windows)
 
-        image_points = []
-        for contour in contours:
-            moments = cv.moments(contour)
-            if moments["m00"] != 0:
-                center_x = int(moments["m10"] / moments["m00"])
-                center_y = int(moments["m01"] / moments["m00"])
-                cv.putText(img, f'({center_x}, {center_y})', (center_x,center_y - 15), cv.FONT_HERSHEY_SIMPLEX, 0.3, (100,255,100), 1)
-                cv.circle(img, (center_x,center_y), 1, (100,255,100), -1)
-                image_points.append([center_x, center_y])
+        return img, blobs_to_image_points(blobs)
 
-        if len(image_points) == 0:
-            image_points = [[None, None]]
+    def get_calibration_points(self):
+        """ (N, C, 2) image points captured for calibration, NaN where a camera didn't see the marker. """
+        if self.calibration_capture is None:
+            return np.empty((0, self.num_cameras, 2))
 
-        return img, image_points
+        return self.calibration_capture.image_points()
+
+    def clear_calibration_points(self):
+        if self.calibration_capture is not None:
+            self.calibration_capture.reset()
 
     def start_capturing_points(self):
         self.is_capturing_points = True
@@ -172,12 +331,15 @@ class Cameras:
         self.is_capturing_points = True
         self.is_triangulating_points = True
         self.camera_poses = camera_poses
+        self.camera_rig = CameraRig.from_poses(self.camera_models, camera_poses)
+        self.roi_tracker.reset()
         self.kalman_filter = KalmanFilter(self.num_objects)
 
     def stop_trangulating_points(self):
         self.is_capturing_points = False
         self.is_triangulating_points = False
         self.camera_poses = None
+        self.camera_rig = None
 
     def start_locating_objects(self):
         self.is_locating_objects = True
@@ -185,314 +347,380 @@ class Cameras:
     def stop_locating_objects(self):
         self.is_locating_objects = False
     
-    def get_camera_params(self, camera_num):
-        return {
-            "intrinsic_matrix": np.array(self.camera_params[camera_num]["intrinsic_matrix"]),
-            "distortion_coef": np.array(self.camera_params[camera_num]["distortion_coef"]),
-            "rotation": self.camera_params[camera_num]["rotation"]
+    def start_recording(self, path, max_duration=None):
+        """
+        Records the raw frames to a capture file (see FrameRecorder), along with
+        what's needed to process them again, for at most `max_duration` seconds
+        if given. The file is created by the capture thread on the next frame,
+        once the frame size is known.
+        """
+        metadata = {
+            "camera_params": self.camera_params,
+            "camera_poses": None if self.camera_poses is None else [{k: np.asarray(v).tolist() for (k, v) in camera_pose.items()} for camera_pose in self.camera_poses],
+            "to_world_coords_matrix": None if self.to_world_coords_matrix is None else np.asarray(self.to_world_coords_matrix).tolist(),
+            "num_objects": self.num_objects
         }
+        with self.recording_lock:
+            self._close_recording()
+            self.pending_recording = (path, max_duration, metadata)
+
+    def stop_recording(self):
+        with self.recording_lock:
+            self._close_recording()
+
+    def _close_recording(self):
+        self.pending_recording = None
+        if self.frame_recorder is not None:
+            print(f"Recorded {self.frame_recorder.count} frames to {self.frame_recorder.path}")
+            self.frame_recorder.close()
+            self.frame_recorder = None
+
+    def _record(self, frames, timestamps):
+        with self.recording_lock:
+            if self.pending_recording is not None:
+                path, max_duration, metadata = self.pending_recording
+                self.pending_recording = None
+                self.frame_recorder = FrameRecorder(path, self.num_cameras, frames[0].shape, max_duration, metadata)
+            if self.frame_recorder is not None and not self.frame_recorder.append(frames, timestamps):
+                self._close_recording()
+
+    def get_camera_params(self, camera_num):
+        with self.camera_params_lock:
+            return {
+                "intrinsic_matrix": np.array(self.camera_params[camera_num]["intrinsic_matrix"]),
+                "distortion_coef": np.array(self.camera_params[camera_num]["distortion_coef"]),
+                "rotation": self.camera_params[camera_num]["rotation"]
+            }
     
     def set_camera_params(self, camera_num, intrinsic_matrix=None, distortion_coef=None):
-        if intrinsic_matrix is not None:
-            self.camera_params[camera_num]["intrinsic_matrix"] = intrinsic_matrix
-        
-        if distortion_coef is not None:
-            self.camera_params[camera_num]["distortion_coef"] = distortion_coef
+        """
+        Changes a camera's calibration. The capture thread, which is using the
+        camera's model, preprocessing and worker process, swaps them for new
+        ones before its next frame (or it's done here if it isn't running).
+        """
+        with self.camera_params_lock:
+            if intrinsic_matrix is not None:
+                self.camera_params[camera_num]["intrinsic_matrix"] = intrinsic_matrix
+            
+            if distortion_coef is not None:
+                self.camera_params[camera_num]["distortion_coef"] = distortion_coef
 
+            self.pending_camera_models[camera_num] = CameraModel.from_params(self.camera_params[camera_num])
 
-def calculate_reprojection_errors(image_points, object_points, camera_poses):
-    errors = np.array([])
-    for image_points_i, object_point in zip(image_points, object_points):
-        error = calculate_reprojection_error(image_points_i, object_point, camera_poses)
-        if error is None:
-            continue
-        errors = np.concatenate([errors, [error]])
+        if self.capture_thread is None or not self.capture_thread.is_alive():
+            self._apply_camera_params()
 
-    return errors
+    def _apply_camera_params(self):
+        with self.camera_params_lock:
+            pending_camera_models = self.pending_camera_models
+            self.pending_camera_models = {}
 
+        # the cached models are immutable, so rebuild the ones that changed
+        for camera_num, camera_model in pending_camera_models.items():
+            self.camera_models[camera_num] = camera_model
+            self.frame_preprocessors[camera_num] = FramePreprocessor(camera_model)
+        if self.camera_process_pool is not None:
+            self.camera_process_pool.close()
+            self.camera_process_pool = None
+        if self.camera_rig is not None:
+            self.camera_rig = CameraRig.from_poses(self.camera_models, self.camera_poses)
 
-def calculate_reprojection_error(image_points, object_point, camera_poses):
-    cameras = Cameras.instance()
 
-    image_points = np.array(image_points)
-    none_indicies = np.where(np.all(image_points == None, axis=1))[0]
-    image_points = np.delete(image_points, none_indicies, axis=0)
-    camera_poses = np.delete(camera_poses, none_indicies, axis=0)
+def calculate_reprojection_errors_batch(image_points, mask, object_points, Ps):
+    """
+    Projects every object point into every camera with a single matrix multiply.
 
-    if len(image_points) <= 1:
-        return None
+    image_points: (N points, C cameras, 2) array of observed pixel coordinates
+    mask: (N, C) boolean array, True where a camera observed the point. If None it
+          is taken from the image points that are not NaN
+    object_points: (N, 3) array of object points
+    Ps: (C, 3, 4) projection matricies
 
-    image_points_t = image_points.transpose((0,1))
+    Returns a (N, C) array of the mean squared pixel error of each observation,
+    NaN where masked, and the (N, C) mask that was applied.
+    """
+    image_points = np.asarray(image_points, dtype=np.float64)
+    object_points = np.asarray(object_points, dtype=np.float64)
+    Ps = np.asarray(Ps, dtype=np.float64)
 
-    errors = np.array([])
-    for i, camera_pose in enumerate(camera_poses):
-        if np.all(image_points[i] == None, axis=0):
-            continue
-        projected_img_points, _ = cv.projectPoints(
-            np.expand_dims(object_point, axis=0).astype(np.float32), 
-            np.array(camera_pose["R"], dtype=np.float64), 
-            np.array(camera_pose["t"], dtype=np.float64), 
-            cameras.get_camera_params(i)["intrinsic_matrix"], 
-            np.array([])
-        )
-        projected_img_point = projected_img_points[:,0,:][0]
-        errors = np.concatenate([errors, (image_points_t[i]-projected_img_point).flatten() ** 2])
-    
-    return errors.mean()
+    observed = ~np.any(np.isnan(image_points), axis=2) & ~np.any(np.isnan(object_points), axis=1)[:,np.newaxis]
+    mask = observed if mask is None else (np.asarray(mask, dtype=bool) & observed)
 
+    object_points_h = np.c_[object_points, np.ones(len(object_points))]
+    projected_image_points = np.einsum("cij,nj->nci", Ps, object_points_h)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        projected_image_points = projected_image_points[:,:,:2] / projected_image_points[:,:,2:]
+        errors = np.mean((image_points - projected_image_points)**2, axis=2)
+    errors[~mask] = np.nan
 
-def bundle_adjustment(image_points, camera_poses, socketio):
-    cameras = Cameras.instance()
+    return errors, mask
 
-    def params_to_camera_poses(params):
-        focal_distances = []
-        num_cameras = int((params.size-1)/7)+1
-        camera_poses = [{
-            "R": np.eye(3),
-            "t": np.array([0,0,0], dtype=np.float32)
-        }]
-        focal_distances.append(params[0])
-        for i in range(0, num_cameras-1):
-            focal_distances.append(params[i*7+1])
-            camera_poses.append({
-                "R": Rotation.as_matrix(Rotation.from_rotvec(params[i*7 + 2 : i*7 + 3 + 2])),
-                "t": params[i*7 + 3 + 2 : i*7 + 6 + 2]
-            })
-
-        return camera_poses, focal_distances
-
-    def residual_function(params):
-        camera_poses, focal_distances = params_to_camera_poses(params)
-        for i in range(0, len(camera_poses)):
-            intrinsic = cameras.get_camera_params(i)["intrinsic_matrix"]
-            intrinsic[0, 0] = focal_distances[i]
-            intrinsic[1, 1] = focal_distances[i]
-            # cameras.set_camera_params(i, intrinsic)
-        object_points = triangulate_points(image_points, camera_poses)
-        errors = calculate_reprojection_errors(image_points, object_points, camera_poses)
-        errors = errors.astype(np.float32)
-        socketio.emit("camera-pose", {"camera_poses": camera_pose_to_serializable(camera_poses)})
-        
-        return errors
-
-    focal_distance = cameras.get_camera_params(0)["intrinsic_matrix"][0,0]
-    init_params = np.array([focal_distance])
-    for i, camera_pose in enumerate(camera_poses[1:]):
-        rot_vec = Rotation.as_rotvec(Rotation.from_matrix(camera_pose["R"])).flatten()
-        focal_distance = cameras.get_camera_params(i)["intrinsic_matrix"][0,0]
-        init_params = np.concatenate([init_params, [focal_distance]])
-        init_params = np.concatenate([init_params, rot_vec])
-        init_params = np.concatenate([init_params, camera_pose["t"].flatten()])
-
-    res = optimize.least_squares(
-        residual_function, init_params, verbose=2, loss="cauchy", ftol=1E-2
-    )
-    return params_to_camera_poses(res.x)[0]
-    
 
-def triangulate_point(image_points, camera_poses):
-    image_points = np.array(image_points)
-    cameras = Cameras.instance()
-    none_indicies = np.where(np.all(image_points == None, axis=1))[0]
-    image_points = np.delete(image_points, none_indicies, axis=0)
-    camera_poses = np.delete(camera_poses, none_indicies, axis=0)
+def calculate_reprojection_errors(image_points, object_points, camera_poses):
+    Ps = get_projection_matrices(camera_poses)
+    image_points = np.array(image_points, dtype=np.float64).reshape((-1, len(Ps), 2))
+    errors, mask = calculate_reprojection_errors_batch(image_points, None, object_points, Ps)
 
-    if len(image_points) <= 1:
-        return [None, None, None]
+    # points seen by a single camera have no meaningful reprojection error
+    valid = np.sum(mask, axis=1) >= 2
 
-    Ps = [] # projection matricies
+    return np.nanmean(errors[valid], axis=1)
 
-    for i, camera_pose in enumerate(camera_poses):
-        RT = np.c_[camera_pose["R"], camera_pose["t"]]
-        P = cameras.camera_params[i]["intrinsic_matrix"] @ RT
-        Ps.append(P)
 
-    # https://temugeb.github.io/computer_vision/2021/02/06/direct-linear-transorms.html
-    def DLT(Ps, image_points):
-        A = []
+def calculate_reprojection_error(image_points, object_point, camera_poses):
+    errors = calculate_reprojection_errors([image_points], [object_point], camera_poses)
 
-        for P, image_point in zip(Ps, image_points):
-            A.append(image_point[1]*P[2,:] - P[1,:])
-            A.append(P[0,:] - image_point[0]*P[2,:])
-            
-        A = np.array(A).reshape((len(Ps)*2,4))
-        B = A.transpose() @ A
-        U, s, Vh = linalg.svd(B, full_matrices = False)
-        object_point = Vh[3,0:3]/Vh[3,3]
+    if len(errors) == 0:
+        return None
+    
+    return errors[0]
 
-        return object_point
 
-    object_point = DLT(Ps, image_points)
+def bundle_adjustment(image_points, camera_poses, socketio):
+    """
+    Refines the camera poses and every camera's focal length from the points
+    captured for calibration. The refined focal lengths are returned in the
+    poses, as "focal_length", and only used where the poses are (triangulation,
+    the camera rig), so they are saved and restored with the poses and never
+    change how frames are undistorted. The poses are sent as "camera-pose"
+    events a few times a second while it runs.
+    """
+    cameras = Cameras.instance()
+
+    image_points = np.array(image_points, dtype=np.float64).reshape((-1, len(camera_poses), 2))
+    object_points = triangulate_points(image_points, camera_poses)
+    intrinsic_matrices = [camera_model.intrinsic_matrix for camera_model in posed_camera_models(cameras.camera_models, camera_poses)]
 
-    return object_point
+    def progress(camera_poses):
+        socketio.emit("camera-pose", {"camera_poses": camera_pose_to_serializable(camera_poses)})
 
+    camera_poses, _, _ = BundleAdjustment(image_points, intrinsic_matrices, camera_poses, object_points).solve(progress)
 
-def triangulate_points(image_points, camera_poses):
-    object_points = []
-    for image_points_i in image_points:
-        object_point = triangulate_point(image_points_i, camera_poses)
-        object_points.append(object_point)
+    return camera_poses
     
-    return np.array(object_points)
 
+def get_projection_matrices(camera_poses):
+    if isinstance(camera_poses, CameraRig):
+        return camera_poses.Ps
 
-def find_point_correspondance_and_object_points(image_points, camera_poses, frames):
     cameras = Cameras.instance()
 
-    for image_points_i in image_points:
-        try:
-            image_points_i.remove([None, None])
-        except:
-            pass
-
-    # [object_points, possible image_point groups, image_point from camera]
-    correspondances = [[[i]] for i in image_points[0]]
-
-    Ps = [] # projection matricies
-    for i, camera_pose in enumerate(camera_poses):
-        RT = np.c_[camera_pose["R"], camera_pose["t"]]
-        P = cameras.camera_params[i]["intrinsic_matrix"] @ RT
-        Ps.append(P)
-
-    root_image_points = [{"camera": 0, "point": point} for point in image_points[0]]
-
-    for i in range(1, len(camera_poses)):
-        epipolar_lines = []
-        for root_image_point in root_image_points:
-            F = cv.sfm.fundamentalFromProjections(Ps[root_image_point["camera"]], Ps[i])
-            line = cv.computeCorrespondEpilines(np.array([root_image_point["point"]], dtype=np.float32), 1, F)
-            epipolar_lines.append(line[0,0].tolist())
-            frames[i] = drawlines(frames[i], line[0])
-
-        not_closest_match_image_points = np.array(image_points[i])
-        points = np.array(image_points[i])
-
-        for j, [a, b, c] in enumerate(epipolar_lines):
-            distances_to_line = np.array([])
-            if len(points) != 0:
-                distances_to_line = np.abs(a*points[:,0] + b*points[:,1] + c) / np.sqrt(a**2 + b**2)
-
-            possible_matches = points[distances_to_line < 5].copy()
-
-            # Commenting out this code produces more points, but more garbage points too
-            # delete closest match from future consideration
-            # if len(points) != 0:
-            #     points = np.delete(points, np.argmin(distances_to_line), axis=0)
-
-            # sort possible matches from smallest to largest
-            distances_to_line = distances_to_line[distances_to_line < 5]
-            possible_matches_sorter = distances_to_line.argsort()
-            possible_matches = possible_matches[possible_matches_sorter]
-    
-            if len(possible_matches) == 0:
-                for possible_group in correspondances[j]:
-                    possible_group.append([None, None])
-            else:
-                not_closest_match_image_points = [row for row in not_closest_match_image_points.tolist() if row != possible_matches.tolist()[0]]
-                not_closest_match_image_points = np.array(not_closest_match_image_points)
-                
-                new_correspondances_j = []
-                for possible_match in possible_matches:
-                    temp = copy.deepcopy(correspondances[j])
-                    for possible_group in temp:
-                        possible_group.append(possible_match.tolist())
-                    new_correspondances_j += temp
-                correspondances[j] = new_correspondances_j
-
-        for not_closest_match_image_point in not_closest_match_image_points:
-            root_image_points.append({"camera": i, "point": not_closest_match_image_point})
-            temp = [[[None, None]] * i]
-            temp[0].append(not_closest_match_image_point.tolist())
-            correspondances.append(temp)
-
-    object_points = []
-    errors = []
-    for image_points in correspondances:
-        object_points_i = triangulate_points(image_points, camera_poses)
-
-        if np.all(object_points_i == None):
-            continue
-
-        errors_i = calculate_reprojection_errors(image_points, object_points_i, camera_poses)
+    return np.array([camera_model.P for camera_model in posed_camera_models(cameras.camera_models, camera_poses)])
 
-        object_points.append(object_points_i[np.argmin(errors_i)])
-        errors.append(np.min(errors_i))
 
-    return np.array(errors), np.array(object_points), frames
+def triangulate_points_batch(image_points, mask, Ps):
+    """
+    Triangulates every point in one go using the DLT.
 
+    image_points: (N points, C cameras, 2) array of pixel coordinates
+    mask: (N, C) boolean array, True where a camera observed the point. If None it
+          is taken from the image points that are not NaN
+    Ps: (C, 3, 4) projection matricies
 
-def locate_objects(object_points, errors):
-    dist1 = 0.095
-    dist2 = 0.15
+    Returns a (N, 3) array of object points, NaN where fewer than two cameras saw
+    the point, and the (N,) mask of successfully triangulated points.
+    """
+    image_points = np.asarray(image_points, dtype=np.float64)
+    Ps = np.asarray(Ps, dtype=np.float64)
 
-    distance_matrix = np.zeros((object_points.shape[0], object_points.shape[0]))
-    already_matched_points = []
-    objects = []
+    observed = ~np.any(np.isnan(image_points), axis=2)
+    mask = observed if mask is None else (np.asarray(mask, dtype=bool) & observed)
 
-    for i in range(0, object_points.shape[0]):
-        for j in range(0, object_points.shape[0]):
-            distance_matrix[i,j] = np.sqrt(np.sum((object_points[i] - object_points[j])**2))
+    num_points, num_cameras = mask.shape
+    x = np.where(mask, image_points[:,:,0], 0)[:,:,np.newaxis]
+    y = np.where(mask, image_points[:,:,1], 0)[:,:,np.newaxis]
 
-    for i in range(0, object_points.shape[0]):
-        if i in already_matched_points:
-            continue
-        
-        distance_deltas = np.abs(distance_matrix[i] - dist1)
-        num_matches = distance_deltas < 0.025
-        matches_index = np.where(distance_deltas < 0.025)[0]
-        if np.sum(num_matches) >= 2:
-            for possible_pair in cartesian_product(matches_index, matches_index):
-                pair_distance = np.sqrt(np.sum((object_points[possible_pair[0]] - object_points[possible_pair[1]])**2))
-                
-                # if the pair isnt the correct distance apart
-                if np.abs(pair_distance - dist2) > 0.025:
-                    continue
+    # https://temugeb.github.io/computer_vision/2021/02/06/direct-linear-transorms.html
+    # two rows per camera, zeroed out for cameras that did not see the point
+    A = np.empty((num_points, num_cameras, 2, 4))
+    A[:,:,0,:] = y*Ps[np.newaxis,:,2,:] - Ps[np.newaxis,:,1,:]
+    A[:,:,1,:] = Ps[np.newaxis,:,0,:] - x*Ps[np.newaxis,:,2,:]
+    A *= mask[:,:,np.newaxis,np.newaxis]
+    A = A.reshape((num_points, num_cameras*2, 4))
 
-                best_match_1_i = possible_pair[0]
-                best_match_2_i = possible_pair[1]
+    B = np.einsum("nji,njk->nik", A, A)
+    U, s, Vh = np.linalg.svd(B)
 
-                already_matched_points.append(i)
-                already_matched_points.append(best_match_1_i)
-                already_matched_points.append(best_match_2_i)
+    valid = np.sum(mask, axis=1) >= 2
+    with np.errstate(divide="ignore", invalid="ignore"):
+        object_points = Vh[:,3,0:3] / Vh[:,3,3:4]
+    object_points[~valid] = np.nan
 
-                location = (object_points[best_match_1_i]+object_points[best_match_2_i])/2
-                error = np.mean([errors[i], errors[best_match_1_i], errors[best_match_2_i]])
+    return object_points, valid
 
-                heading_vec = object_points[best_match_1_i] - object_points[best_match_2_i]
-                heading_vec /= linalg.norm(heading_vec)
-                heading = np.arctan2(heading_vec[1], heading_vec[0])
 
-                heading = heading - np.pi if heading > np.pi/2 else heading
-                heading = heading + np.pi if heading < -np.pi/2 else heading
+def triangulate_point(image_points, camera_poses):
+    object_points, _ = triangulate_points_batch(np.array([image_points], dtype=np.float64), None, get_projection_matrices(camera_poses))
 
-                # determine drone index based on which side third light is on
-                drone_index = 0 if (object_points[i] - location)[1] > 0 else 1
+    return object_points[0]
 
-                objects.append({
-                    "pos": location,
-                    "heading": -heading,
-                    "error": error,
-                    "droneIndex": drone_index
-                })
 
-                break
+def triangulate_points(image_points, camera_poses):
+    Ps = get_projection_matrices(camera_poses)
+    image_points = np.array(image_points, dtype=np.float64).reshape((-1, len(Ps), 2))
+    object_points, _ = triangulate_points_batch(image_points, None, Ps)
     
-    return objects
-
-
-def numpy_fillna(data):
-    data = np.array(data, dtype=object)
-    # Get lengths of each row of data
-    lens = np.array([len(i) for i in data])
-
-    # Mask of valid places in each row
-    mask = np.arange(lens.max()) < lens[:,None]
+    return object_points
+
+
+def find_point_correspondance_and_object_points(image_points, camera_rig, frames=None, epipolar_threshold=5, max_hypotheses=4, missing_camera_cost=1.0, timer=None, epipolar_lines=None):
+    """
+    Works out which image points in each camera belong to the same marker and
+    triangulates them.
+
+    Groups are seeded from the first camera's points. For each following camera,
+    the distances of its points to the epipolar lines of every hypothesis are
+    computed in one go (using the rig's cached fundamental matricies), every point
+    is assigned to at most one group with the Hungarian algorithm, and unassigned
+    points seed new groups. Each hypothesis is extended with its closest gated
+    candidates, but a group never keeps more than `max_hypotheses` hypotheses, so
+    the work grows polynomially rather than exponentially with the number of
+    cameras and markers. Finally every hypothesis is triangulated in one batch and
+    each group keeps the one with the lowest reprojection error (in pixels²),
+    plus `missing_camera_cost` for each camera it doesn't use.
+
+    If `timer` (a PipelineMetrics StageTimer) is given, the matching is
+    recorded as the "correspondence" stage and the triangulation and scoring
+    at the end as the "triangulation" stage. The epipolar lines searched along are drawn on
+    `frames` if given, and appended to `epipolar_lines` (one list per camera)
+    if given, for drawing later.
+    """
+    num_cameras = camera_rig.num_cameras
+    Fs = camera_rig.fundamental_matrices
+
+    image_points = [np.array(image_points_i, dtype=np.float64).reshape((-1, 2)) for image_points_i in image_points]
+    image_points = [image_points_i[~np.any(np.isnan(image_points_i), axis=1)] for image_points_i in image_points]
+
+    # hypotheses: index into each camera's image points, -1 where the camera has no point in the group
+    hypotheses = np.full((len(image_points[0]), num_cameras), -1, dtype=np.int64)
+    hypotheses[:,0] = np.arange(len(image_points[0]))
+    hypothesis_groups = np.arange(len(image_points[0]))
+    hypothesis_costs = np.zeros(len(image_points[0]))
+    num_groups = len(image_points[0])
+
+    root_cameras = np.zeros(num_groups, dtype=np.int64)
+    root_points = image_points[0].copy()
+
+    for i in range(1, num_cameras):
+        points = image_points[i]
+        if len(points) == 0:
+            continue
+        points_h = np.c_[points, np.ones(len(points))]
+
+        if frames is not None or epipolar_lines is not None:
+            for j in range(0, i):
+                roots = root_points[root_cameras == j]
+                if len(roots) != 0:
+                    lines = np.c_[roots, np.ones(len(roots))] @ Fs[j, i].T
+                    if frames is not None:
+                        frames[i] = drawlines(frames[i], lines)
+                    if epipolar_lines is not None:
+                        epipolar_lines[i].append(lines)
+
+        # mean distance from every point to the epipolar lines of every hypothesis's points
+        distances = np.full((len(hypotheses), len(points)), np.inf)
+        if len(hypotheses) != 0:
+            distance_sums = np.zeros((len(hypotheses), len(points)))
+            counts = np.zeros(len(hypotheses))
+            for j in range(0, i):
+                seen = hypotheses[:,j] >= 0
+                if not np.any(seen):
+                    continue
+                lines = np.c_[image_points[j][hypotheses[seen,j]], np.ones(np.sum(seen))] @ Fs[j, i].T
+                distance_sums[seen] += np.abs(lines @ points_h.T) / np.linalg.norm(lines[:,:2], axis=1)[:,np.newaxis]
+                counts[seen] += 1
+            distances = distance_sums / counts[:,np.newaxis]
+        gated = distances < epipolar_threshold
+
+        # assign every point to at most one group
+        group_distances = np.full((num_groups, len(points)), np.inf)
+        np.minimum.at(group_distances, hypothesis_groups, distances)
+        rows, cols = optimize.linear_sum_assignment(np.where(group_distances < epipolar_threshold, group_distances, 1e9))
+        claimed = np.zeros(len(points), dtype=bool)
+        claimed[cols[group_distances[rows, cols] < epipolar_threshold]] = True
+
+        # extend each hypothesis with its closest candidates, or leave it as is if there are none
+        candidates = np.argsort(distances, axis=1)[:,:max_hypotheses]
+        candidates_gated = np.take_along_axis(gated, candidates, axis=1)
+        hypothesis_i, candidate_i = np.nonzero(candidates_gated)
+        extended = hypotheses[hypothesis_i].copy()
+        extended[:,i] = candidates[hypothesis_i, candidate_i]
+        unextended = ~np.any(candidates_gated, axis=1)
+
+        hypotheses = np.concatenate((hypotheses[unextended], extended))
+        hypothesis_groups = np.concatenate((hypothesis_groups[unextended], hypothesis_groups[hypothesis_i]))
+        hypothesis_costs = np.concatenate((hypothesis_costs[unextended], hypothesis_costs[hypothesis_i] + distances[hypothesis_i, extended[:,i]]))
+
+        # keep the cheapest few hypotheses of each group
+        order = np.lexsort((hypothesis_costs, hypothesis_groups))
+        sorted_groups = hypothesis_groups[order]
+        group_starts = np.searchsorted(sorted_groups, sorted_groups, side="left")
+        order = order[np.arange(len(order)) - group_starts < max_hypotheses]
+        hypotheses, hypothesis_groups, hypothesis_costs = hypotheses[order], hypothesis_groups[order], hypothesis_costs[order]
+
+        # points that no group claimed could be markers the previous cameras did not see
+        unclaimed = np.nonzero(~claimed)[0]
+        new_hypotheses = np.full((len(unclaimed), num_cameras), -1, dtype=np.int64)
+        new_hypotheses[:,i] = unclaimed
+        hypotheses = np.concatenate((hypotheses, new_hypotheses))
+        hypothesis_groups = np.concatenate((hypothesis_groups, num_groups + np.arange(len(unclaimed))))
+        hypothesis_costs = np.concatenate((hypothesis_costs, np.zeros(len(unclaimed))))
+        root_cameras = np.concatenate((root_cameras, np.full(len(unclaimed), i)))
+        root_points = np.concatenate((root_points, points[unclaimed]))
+        num_groups += len(unclaimed)
+
+    if timer is not None:
+        timer("correspondence")
+    if len(hypotheses) == 0:
+        return np.array([]), np.empty((0, 3)), frames
+
+    # triangulate and score every hypothesis at once
+    hypothesis_image_points = np.full((len(hypotheses), num_cameras, 2), np.nan)
+    for i in range(0, num_cameras):
+        seen = hypotheses[:,i] >= 0
+        hypothesis_image_points[seen,i] = image_points[i][hypotheses[seen,i]]
+
+    object_points, valid = triangulate_points_batch(hypothesis_image_points, None, camera_rig.Ps)
+    if not np.any(valid):
+        if timer is not None:
+            timer("triangulation")
+        return np.array([]), np.empty((0, 3)), frames
+
+    errors, _ = calculate_reprojection_errors_batch(hypothesis_image_points[valid], None, object_points[valid], camera_rig.Ps)
+    errors = np.nanmean(errors, axis=1)
+    object_points = object_points[valid]
+    hypothesis_groups = hypothesis_groups[valid]
+
+    # the best hypothesis of each group. Leaving a camera out always lowers the
+    # reprojection error, so every camera a hypothesis doesn't use costs extra
+    num_missing = np.sum(hypotheses[valid] < 0, axis=1)
+    scores = errors + missing_camera_cost * num_missing
+    order = np.lexsort((scores, hypothesis_groups))
+    best = order[np.r_[True, hypothesis_groups[order][1:] != hypothesis_groups[order][:-1]]]
+    if timer is not None:
+        timer("triangulation")
+
+    return errors[best], object_points[best], frames
+
+
+def to_world_coordinates(object_points, to_world_coords_matrix):
+    """
+    Converts (N, 3) object points from the triangulation (camera rig) frame to
+    the world frame set with the origin/floor tools.
+    """
+    object_points = np.asarray(object_points, dtype=np.float64).reshape((-1, 3)) * [-1, -1, 1]
+    object_points = np.c_[object_points, np.ones(len(object_points))] @ np.array(to_world_coords_matrix, dtype=np.float64).T
+    object_points = object_points[:,:3] / object_points[:,3:]
+
+    return object_points[:,[0,2,1]]
+
+
+def locate_objects(object_points, errors, rigid_body_registry=None):
+    if rigid_body_registry is None:
+        rigid_body_registry = RigidBodyRegistry.default()
+
+    return rigid_body_registry.locate(object_points, errors)
 
-    # Setup output array and put elements from data into masked positions
-    out = np.full((mask.shape[0], mask.shape[1], 2), [None, None])
-    out[mask] = np.concatenate(data)
-    return out
-        
 
 def drawlines(img1,lines):
     r,c,_ = img1.shape
@@ -504,34 +732,12 @@ def drawlines(img1,lines):
     return img1
 
 
-def make_square(img):
-    x, y, _ = img.shape
-    size = max(x, y)
-    new_img = np.zeros((size, size, 3), dtype=np.uint8)
-    ax,ay = (size - img.shape[1])//2,(size - img.shape[0])//2
-    new_img[ay:img.shape[0]+ay,ax:ax+img.shape[1]] = img
-
-    # Pad the new_img array with edge pixel values
-    # Apply feathering effect
-    feather_pixels = 8
-    for i in range(feather_pixels):
-        alpha = (i + 1) / feather_pixels
-        new_img[ay - i - 1, :] = img[0, :] * (1 - alpha)  # Top edge
-        new_img[ay + img.shape[0] + i, :] = img[-1, :] * (1 - alpha)  # Bottom edge
-
-
-    return new_img
-
-
 def camera_pose_to_serializable(camera_poses):
     for i in range(0, len(camera_poses)):
-        camera_poses[i] = {k: v.tolist() for (k, v) in camera_poses[i].items()}
+        camera_poses[i] = {k: np.asarray(v).tolist() for (k, v) in camera_poses[i].items()}
 
     return camera_poses
 
-def cartesian_product(x, y):
-    return np.array([[x0, y0] for x0 in x for y0 in y])
-
 def add_white_border(image, border_size):
     height, width = image.shape[:2]
     bordered_image = cv.copyMakeBorder(image, border_size, border_size, border_size, border_size, cv.BORDER_CONSTANT, value=[255, 255, 255])
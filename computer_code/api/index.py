@@ -1,5 +1,10 @@
 from helpers import camera_pose_to_serializable, calculate_reprojection_errors, bundle_adjustment, Cameras, triangulate_points
-from KalmanFilter import KalmanFilter
+from SerialWriter import SerialWriter
+from CameraBackend import create_camera_backend
+from SerialBackend import create_serial_backend
+from FrameRecorder import recording_path
+from TelemetryPublisher import TelemetryPublisher, to_json
+from PreviewEncoder import PreviewOptions
 
 from flask import Flask, Response, request
 import cv2 as cv
@@ -9,56 +14,86 @@ from scipy import linalg
 
 from flask_socketio import SocketIO
 import copy
-import time
-import serial
-import threading
+import os
+import argparse
 from ruckig import InputParameter, OutputParameter, Result, Ruckig
 from flask_cors import CORS
-import json
 
-serialLock = threading.Lock()
+# where frames come from: pseye, video, synthetic or replay
+camera_backend = os.environ.get("MOCAP_CAMERA_BACKEND", "pseye")
+camera_videos = os.environ.get("MOCAP_CAMERA_VIDEOS", "").split(",")
+camera_replay = os.environ.get("MOCAP_CAMERA_REPLAY")
+replay_speed = float(os.environ.get("MOCAP_REPLAY_SPEED", "1")) or None # 0 replays as fast as possible
+
+recordings_dir = os.path.join(os.path.dirname(__file__), "recordings")
+
+# where drone messages go: serial, pty or null
+serial_backend = os.environ.get("MOCAP_SERIAL_BACKEND", "serial")
+serial_port = os.environ.get("MOCAP_SERIAL_PORT", "/dev/cu.usbserial-02X2K2GE")
 
-ser = serial.Serial("/dev/cu.usbserial-02X2K2GE", 1000000, write_timeout=1, )
+# the port is only opened on the first write
+serial_writer = SerialWriter(create_serial_backend(serial_backend, serial_port))
 
 app = Flask(__name__)
 CORS(app, supports_credentials=True)
 socketio = SocketIO(app, cors_allowed_origins='*')
 
+# how often tracking results are sent to the frontend, independent of the camera frame rate
+telemetry_rate = float(os.environ.get("MOCAP_TELEMETRY_RATE", "30"))
+telemetry = TelemetryPublisher(socketio, telemetry_rate)
+
 cameras_init = False
 
 num_objects = 2
 
-@app.route("/api/camera-stream")
-def camera_stream():
+# process each camera's frames in its own worker process
+use_process_pool = False
+
+# only search for markers around their predicted positions, with a periodic full frame scan
+use_roi_tracking = False
+
+def init_cameras():
     cameras = Cameras.instance()
+    if cameras.cameras is None:
+        if camera_backend == "video":
+            cameras.set_camera_backend(create_camera_backend(camera_backend, paths=camera_videos))
+        elif camera_backend == "replay":
+            cameras.set_camera_backend(create_camera_backend(camera_backend, path=camera_replay, speed=replay_speed))
+        elif camera_backend == "synthetic":
+            cameras.set_camera_backend(create_camera_backend(camera_backend, num_cameras=len(cameras.camera_params)))
+        else:
+            cameras.set_camera_backend(create_camera_backend(camera_backend))
     cameras.set_socketio(socketio)
-    cameras.set_ser(ser)
-    cameras.set_serialLock(serialLock)
-    cameras.set_num_objects(num_objects)
-    
-    def gen(cameras):
-        frequency = 150
-        loop_interval = 1.0 / frequency
-        last_run_time = 0
-        i = 0
+    cameras.set_telemetry(telemetry)
+    cameras.set_serial_writer(serial_writer)
+    if cameras.num_objects is None:
+        cameras.set_num_objects(num_objects)
+    cameras.set_use_process_pool(use_process_pool)
+    if cameras.use_roi_tracking != use_roi_tracking:
+        cameras.set_use_roi_tracking(use_roi_tracking)
+    cameras.start_capture_thread()
 
-        while True:
-            time_now = time.time()
+    return cameras
 
-            i = (i+1)%10
-            if i == 0:
-                socketio.emit("fps", {"fps": round(1/(time_now - last_run_time))})
+@socketio.on("connect")
+def connect():
+    init_cameras()
 
-            if time_now - last_run_time < loop_interval:
-                time.sleep(last_run_time - time_now + loop_interval)
-            last_run_time = time.time()
-            frames = cameras.get_frames()
-            jpeg_frame = cv.imencode('.jpg', frames)[1].tostring()
+@app.route("/api/camera-stream")
+def camera_stream():
+    # options as query parameters, see PreviewOptions
+    cameras = init_cameras()
+    try:
+        options = PreviewOptions.from_query(request.args)
+    except ValueError as e:
+        return Response(str(e), status=400)
 
-            yield (b'--frame\r\n'
-                b'Content-Type: image/jpeg\r\n\r\n' + jpeg_frame + b'\r\n')
+    return Response(cameras.preview.stream(options), mimetype='multipart/x-mixed-replace; boundary=frame')
 
-    return Response(gen(cameras), mimetype='multipart/x-mixed-replace; boundary=frame')
+@app.route("/api/metrics")
+def metrics():
+    cameras = Cameras.instance()
+    return Response(json.dumps(to_json(cameras.get_metrics())), mimetype="application/json")
 
 @app.route("/api/trajectory-planning", methods=["POST"])
 def trajectory_planning_api():
@@ -119,47 +154,37 @@ def arm_drone(data):
     
     Cameras.instance().drone_armed = data["droneArmed"]
     for droneIndex in range(0, num_objects):
-        serial_data = {
-            "armed": data["droneArmed"][droneIndex],
-        }
-        with serialLock:
-            ser.write(f"{str(droneIndex)}{json.dumps(serial_data)}".encode('utf-8'))
-        
-        time.sleep(0.01)
+        serial_writer.arm(droneIndex, data["droneArmed"][droneIndex])
 
 @socketio.on("set-drone-pid")
 def arm_drone(data):
-    serial_data = {
-        "pid": [float(x) for x in data["dronePID"]],
-    }
-    with serialLock:
-        ser.write(f"{str(data['droneIndex'])}{json.dumps(serial_data)}".encode('utf-8'))
-        time.sleep(0.01)
+    try:
+        serial_writer.pid(data['droneIndex'], [float(x) for x in data["dronePID"]])
+    except (ValueError, TypeError) as e:
+        print(f"rejected drone pid: {e}")
 
 @socketio.on("set-drone-setpoint")
 def arm_drone(data):
-    serial_data = {
-        "setpoint": [float(x) for x in data["droneSetpoint"]],
-    }
-    with serialLock:
-        ser.write(f"{str(data['droneIndex'])}{json.dumps(serial_data)}".encode('utf-8'))
-        time.sleep(0.01)
+    try:
+        serial_writer.setpoint(data['droneIndex'], [float(x) for x in data["droneSetpoint"]])
+    except (ValueError, TypeError) as e:
+        print(f"rejected drone setpoint: {e}")
 
 @socketio.on("set-drone-trim")
 def arm_drone(data):
-    serial_data = {
-        "trim": [int(x) for x in data["droneTrim"]],
-    }
-    with serialLock:
-        ser.write(f"{str(data['droneIndex'])}{json.dumps(serial_data)}".encode('utf-8'))
-        time.sleep(0.01)
+    try:
+        serial_writer.trim(data['droneIndex'], [int(x) for x in data["droneTrim"]])
+    except (ValueError, TypeError) as e:
+        print(f"rejected drone trim: {e}")
 
 
 @socketio.on("acquire-floor")
 def acquire_floor(data):
     cameras = Cameras.instance()
     object_points = data["objectPoints"]
-    object_points = np.array([item for sublist in object_points for item in sublist])
+    # missing coordinates arrive as null
+    object_points = np.array([item for sublist in object_points for item in sublist], dtype=np.float64).reshape((-1, 3))
+    object_points = object_points[~np.any(np.isnan(object_points), axis=1)]
 
     tmp_A = []
     tmp_b = []
@@ -197,8 +222,8 @@ def acquire_floor(data):
 @socketio.on("set-origin")
 def set_origin(data):
     cameras = Cameras.instance()
-    object_point = np.array(data["objectPoint"])
-    to_world_coords_matrix = np.array(data["toWorldCoordsMatrix"])
+    object_point = np.array(data["objectPoint"], dtype=np.float64)
+    to_world_coords_matrix = np.array(data["toWorldCoordsMatrix"], dtype=np.float64)
     transform_matrix = np.eye(4)
 
     object_point[1], object_point[2] = object_point[2], object_point[1] # i dont fucking know why
@@ -221,15 +246,23 @@ def capture_points(data):
     cameras = Cameras.instance()
 
     if (start_or_stop == "start"):
+        cameras.clear_calibration_points()
         cameras.start_capturing_points()
         return
     elif (start_or_stop == "stop"):
         cameras.stop_capturing_points()
 
 @socketio.on("calculate-camera-pose")
-def calculate_camera_pose(data):
+def calculate_camera_pose(data=None):
     cameras = Cameras.instance()
-    image_points = np.array(data["cameraPoints"])
+    # the points captured on the server, unless the client sends its own
+    if data is not None and data.get("cameraPoints") is not None:
+        image_points = np.array(data["cameraPoints"], dtype=np.float64)
+    else:
+        image_points = cameras.get_calibration_points()
+    if len(image_points) == 0:
+        print("No points captured for camera pose calibration")
+        return
     image_points_t = image_points.transpose((1, 0, 2))
 
     camera_poses = [{
@@ -239,7 +272,7 @@ def calculate_camera_pose(data):
     for camera_i in range(0, cameras.num_cameras-1):
         camera1_image_points = image_points_t[camera_i]
         camera2_image_points = image_points_t[camera_i+1]
-        not_none_indicies = np.where(np.all(camera1_image_points != None, axis=1) & np.all(camera2_image_points != None, axis=1))[0]
+        not_none_indicies = np.where(~np.any(np.isnan(camera1_image_points), axis=1) & ~np.any(np.isnan(camera2_image_points), axis=1))[0]
         camera1_image_points = np.take(camera1_image_points, not_none_indicies, axis=0).astype(np.float32)
         camera2_image_points = np.take(camera2_image_points, not_none_indicies, axis=0).astype(np.float32)
 
@@ -298,7 +331,9 @@ def determine_scale(data):
         if len(object_points_i) != 2:
             continue
 
-        object_points_i = np.array(object_points_i)
+        object_points_i = np.array(object_points_i, dtype=np.float64)
+        if np.any(np.isnan(object_points_i)):
+            continue
 
         observed_distances.append(np.sqrt(np.sum((object_points_i[0] - object_points_i[1])**2)))
 
@@ -309,6 +344,20 @@ def determine_scale(data):
     socketio.emit("camera-pose", {"error": None, "camera_poses": camera_poses})
 
 
+@socketio.on("start-recording")
+def start_recording(data=None):
+    path = recording_path(recordings_dir)
+    # optionally {"duration": seconds}, otherwise until stop-recording
+    max_duration = None if not data else data.get("duration")
+    Cameras.instance().start_recording(path, max_duration)
+    socketio.emit("recording", {"path": path, "recording": True})
+
+@socketio.on("stop-recording")
+def stop_recording(data=None):
+    Cameras.instance().stop_recording()
+    socketio.emit("recording", {"recording": False})
+
+
 @socketio.on("triangulate-points")
 def live_mocap(data):
     cameras = Cameras.instance()
@@ -324,4 +373,22 @@ def live_mocap(data):
 
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--camera-backend", choices=["pseye", "video", "synthetic", "replay"], default=camera_backend)
+    parser.add_argument("--camera-videos", nargs="+", default=camera_videos, help="one video per camera, for the video backend")
+    parser.add_argument("--camera-replay", default=camera_replay, help="capture file, for the replay backend")
+    parser.add_argument("--replay-speed", type=float, default=replay_speed or 0, help="1 is real time, 0 as fast as possible")
+    parser.add_argument("--serial-backend", choices=["serial", "pty", "null"], default=serial_backend)
+    parser.add_argument("--serial-port", default=serial_port)
+    parser.add_argument("--telemetry-rate", type=float, default=telemetry_rate, help="Hz")
+    args = parser.parse_args()
+
+    camera_backend = args.camera_backend
+    camera_videos = args.camera_videos
+    camera_replay = args.camera_replay
+    replay_speed = args.replay_speed or None
+    if (args.serial_backend, args.serial_port) != (serial_backend, serial_port):
+        serial_writer.set_ser(create_serial_backend(args.serial_backend, args.serial_port))
+    telemetry.set_rate(args.telemetry_rate)
+
     socketio.run(app, port=3001, debug=True)
\ No newline at end of file
@@ -0,0 +1,43 @@
+import os
+import sys
+import numpy as np
+import pytest
+
+# the server's modules import each other by name from computer_code/api
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from CameraRig import load_camera_models
+from SyntheticScene import SyntheticScene, synthetic_rigid_bodies, circle_trajectory
+
+
+def project_points(Ps, object_points):
+    """ (N, C, 2) image points of (N, 3) object points in every camera. """
+    object_points = np.asarray(object_points, dtype=np.float64).reshape((-1, 3))
+    projected = np.einsum("cij,nj->nci", Ps, np.c_[object_points, np.ones(len(object_points))])
+    return projected[:, :, :2] / projected[:, :, 2:]
+
+
+@pytest.fixture
+def project():
+    return project_points
+
+
+@pytest.fixture
+def make_scene():
+    """
+    Builds a SyntheticScene of `num_cameras` cameras on a ring, with
+    `num_drones` drones flying evenly spaced around a circle of `radius`.
+    Everything else is passed on to SyntheticScene.
+    """
+    def make_scene(num_cameras=4, num_drones=0, radius=0.5, **kwargs):
+        rigid_bodies = synthetic_rigid_bodies(num_drones)
+        drones = [(rigid_body, circle_trajectory(radius=radius, phase=2*np.pi*i/num_drones)) for i, rigid_body in enumerate(rigid_bodies)]
+        return SyntheticScene(load_camera_models(num_cameras), drones, **kwargs)
+
+    return make_scene
+
+
+@pytest.fixture
+def scene(make_scene, request):
+    """ An empty four camera scene, or with `indirect` parametrization, `make_scene(**param)`. """
+    return make_scene(**getattr(request, "param", {}))
@@ -0,0 +1,58 @@
+import numpy as np
+import cv2 as cv
+from BlobDetector import BlobDetector, merge_windows, blobs_to_image_points
+
+
+def draw_dots(centers, shape=(120, 160, 3), radius=3):
+    img = np.zeros(shape, dtype=np.uint8)
+    shift = 4
+    for x, y in centers:
+        cv.circle(img, (int(round(x * (1 << shift))), int(round(y * (1 << shift)))), radius << shift, (255, 255, 255), -1, cv.LINE_AA, shift)
+    return img
+
+
+def test_sub_pixel_centroids():
+    centers = np.array([[20.25, 30.5], [80.75, 60.125], [140.5, 100.0]])
+    blobs = BlobDetector(annotate=False).detect(draw_dots(centers))
+
+    assert blobs.shape == (3, 4) and blobs.dtype == np.float32
+    found = blobs[np.argsort(blobs[:, BlobDetector.X])]
+    np.testing.assert_allclose(found[:, :2], centers, atol=0.1)
+    assert np.all(found[:, BlobDetector.AREA] > 20)
+    assert np.all(found[:, BlobDetector.INTENSITY] > 255*0.2)
+
+
+def test_area_and_circularity_filters():
+    img = draw_dots([[30, 30]], radius=4)
+    cv.line(img, (60, 60), (120, 110), (255, 255, 255), 2) # a reflection streak, not a marker
+    img[100, 150] = 255 # a single hot pixel
+
+    assert len(BlobDetector(annotate=False).detect(img)) == 3
+    blobs = BlobDetector(min_area=4, min_circularity=0.6, annotate=False).detect(img)
+    np.testing.assert_allclose(blobs[:, :2], [[30, 30]], atol=0.1)
+    assert len(BlobDetector(max_area=10, annotate=False).detect(img)) == 1
+
+
+def test_windows_only_search_inside_and_offset_points():
+    img = draw_dots([[20, 20], [100, 80]])
+    windows = np.array([[90, 70, 110, 90], [95, 75, 115, 95]])
+
+    blobs = BlobDetector(annotate=False).detect(img, windows)
+
+    np.testing.assert_allclose(blobs[:, :2], [[100, 80]], atol=0.1)
+    assert len(BlobDetector(annotate=False).detect(img, np.array([[0, 100, 10, 110]]))) == 0
+
+
+def test_merge_windows():
+    merged = merge_windows([[0, 0, 10, 10], [5, 5, 20, 20], [30, 30, 40, 40], [18, 0, 25, 6]])
+
+    assert sorted(merged) == [[0, 0, 25, 20], [30, 30, 40, 40]]
+    assert merge_windows([[0, 0, 10, 10], [10, 0, 20, 10]]) == [[0, 0, 10, 10], [10, 0, 20, 10]]
+
+
+def test_blobs_to_image_points_with_no_blobs():
+    blobs = BlobDetector(annotate=False).detect(np.zeros((40, 40, 3), dtype=np.uint8))
+    image_points = blobs_to_image_points(blobs)
+
+    assert image_points.shape == (0, 2) and image_points.dtype == np.float32
+    assert image_points.flags.c_contiguous
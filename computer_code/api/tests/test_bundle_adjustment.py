@@ -0,0 +1,119 @@
+import numpy as np
+import pytest
+from scipy.spatial.transform import Rotation
+from BundleAdjustment import BundleAdjustment
+from CameraRig import CameraRig
+from SyntheticScene import SyntheticScene
+from helpers import Cameras, bundle_adjustment, calculate_reprojection_errors_batch, triangulate_points, triangulate_points_batch
+
+
+class NullSocketIO:
+    def emit(self, *args, **kwargs):
+        pass
+
+
+def observe(camera_rig, num_points=200, noise=0.2, seed=0):
+    """ Image points of random points in front of a ring of cameras, some of them unseen. """
+    rng = np.random.default_rng(seed)
+    scene = SyntheticScene(list(camera_rig.camera_models), [])
+    object_points = scene.world_to_rig(rng.uniform([-1, -1, 0.1], [1, 1, 1.2], (num_points, 3)))
+
+    projected = np.einsum("cij,nj->nci", camera_rig.Ps, np.c_[object_points, np.ones(num_points)])
+    image_points = projected[:, :, :2] / projected[:, :, 2:] + rng.normal(0, noise, (num_points, camera_rig.num_cameras, 2))
+    image_points[rng.random((num_points, camera_rig.num_cameras)) < 0.2] = np.nan
+    image_points[np.any((image_points < 0) | (image_points > 320), axis=2)] = np.nan
+
+    return image_points
+
+
+def perturb(camera_poses, seed=1):
+    rng = np.random.default_rng(seed)
+    perturbed = [{"R": np.asarray(camera_poses[0]["R"]), "t": np.ravel(camera_poses[0]["t"])}]
+    for camera_pose in camera_poses[1:]:
+        perturbed.append({
+            "R": Rotation.from_rotvec(rng.normal(0, 0.02, 3)).as_matrix() @ np.asarray(camera_pose["R"]),
+            "t": np.ravel(camera_pose["t"]) + rng.normal(0, 0.03, 3)
+        })
+    return perturbed
+
+
+def rms_error(image_points, object_points, Ps):
+    errors, _ = calculate_reprojection_errors_batch(image_points, None, object_points, Ps)
+    return np.sqrt(np.nanmean(errors))
+
+
+@pytest.fixture
+def camera_models():
+    return list(Cameras.instance().camera_models)
+
+
+@pytest.fixture
+def true_camera_poses(camera_models):
+    return SyntheticScene(camera_models, []).camera_poses
+
+
+def test_recovers_poses_and_focal_lengths(camera_models, true_camera_poses):
+    # the cameras' real focal lengths are 3% shorter than calibrated
+    true_focal_lengths = [camera_model.intrinsic_matrix[0, 0] * 0.97 for camera_model in camera_models]
+    true_models = [camera_model.with_focal_length(f) for camera_model, f in zip(camera_models, true_focal_lengths)]
+    image_points = observe(CameraRig.from_poses(true_models, true_camera_poses))
+
+    camera_poses = perturb(true_camera_poses)
+    intrinsic_matrices = [camera_model.intrinsic_matrix for camera_model in camera_models]
+    initial_rig = CameraRig.from_poses(camera_models, camera_poses)
+    object_points, _ = triangulate_points_batch(image_points, None, initial_rig.Ps)
+
+    refined_poses, focal_lengths, refined_points = BundleAdjustment(image_points, intrinsic_matrices, camera_poses, object_points).solve(verbose=0)
+
+    refined_rig = CameraRig.from_poses(camera_models, refined_poses)
+    assert rms_error(image_points, refined_points, refined_rig.Ps) < 0.5 < rms_error(image_points, object_points, initial_rig.Ps)
+    np.testing.assert_allclose(focal_lengths, true_focal_lengths, rtol=0.01)
+    np.testing.assert_allclose([camera_pose["focal_length"] for camera_pose in refined_poses], focal_lengths)
+    # camera 0 fixes the frame
+    np.testing.assert_array_equal(refined_poses[0]["R"], camera_poses[0]["R"])
+
+
+def test_jacobian_sparsity_matches_the_residuals(camera_models, true_camera_poses):
+    image_points = observe(CameraRig.from_poses(camera_models, true_camera_poses), num_points=20)
+    object_points, _ = triangulate_points_batch(image_points, None, CameraRig.from_poses(camera_models, true_camera_poses).Ps)
+    problem = BundleAdjustment(image_points, [camera_model.intrinsic_matrix for camera_model in camera_models], true_camera_poses, object_points)
+
+    sparsity = problem.jac_sparsity()
+    assert sparsity.shape == (len(problem.residuals(problem.initial_params)), len(problem.initial_params))
+
+    # a residual only moves with the parameters the sparsity pattern says it depends on
+    rng = np.random.default_rng(0)
+    for column in rng.choice(sparsity.shape[1], 20, replace=False):
+        params = problem.initial_params.copy()
+        params[column] += 1e-4
+        changed = np.nonzero(problem.residuals(params) != problem.residuals(problem.initial_params))[0]
+        assert set(changed) <= set(sparsity[:, column].nonzero()[0])
+
+
+def test_points_seen_by_one_camera_are_left_out(camera_models, true_camera_poses):
+    image_points = observe(CameraRig.from_poses(camera_models, true_camera_poses), num_points=10)
+    image_points[0, 1:] = np.nan
+    object_points, _ = triangulate_points_batch(image_points, None, CameraRig.from_poses(camera_models, true_camera_poses).Ps)
+    object_points[0] = 0
+
+    _, _, refined_points = BundleAdjustment(image_points, [camera_model.intrinsic_matrix for camera_model in camera_models], true_camera_poses, object_points).solve(verbose=0)
+
+    assert np.all(np.isnan(refined_points[0]))
+
+
+def test_bundle_adjustment_returns_focal_lengths_with_the_poses_and_leaves_the_cameras_alone(camera_models, true_camera_poses):
+    cameras = Cameras.instance()
+    true_models = [camera_model.with_focal_length(camera_model.intrinsic_matrix[0, 0] * 1.02) for camera_model in camera_models]
+    image_points = observe(CameraRig.from_poses(true_models, true_camera_poses))
+    calibrated = [cameras.get_camera_params(i)["intrinsic_matrix"] for i in range(0, len(camera_models))]
+
+    camera_poses = bundle_adjustment(image_points, perturb(true_camera_poses), NullSocketIO())
+
+    for i, camera_pose in enumerate(camera_poses):
+        assert camera_pose["focal_length"] == pytest.approx(true_models[i].intrinsic_matrix[0, 0], rel=0.01)
+        np.testing.assert_array_equal(cameras.get_camera_params(i)["intrinsic_matrix"], calibrated[i])
+        assert cameras.camera_models[i] is camera_models[i]
+
+    # triangulating with the returned poses uses their focal lengths
+    object_points = triangulate_points(image_points, camera_poses)
+    assert rms_error(image_points, object_points, CameraRig.from_poses(camera_models, camera_poses).Ps) < 0.5
@@ -0,0 +1,56 @@
+import numpy as np
+from CalibrationCapture import CalibrationCapture
+
+
+def test_keeps_observations_seen_by_enough_cameras():
+    capture = CalibrationCapture(3, 320)
+
+    assert capture.add([[10, 10], [20, 20], [np.nan, np.nan]])
+    assert not capture.add([[10, 10], [np.nan, np.nan], [np.nan, np.nan]])
+
+    image_points = capture.image_points()
+    assert image_points.shape == (1, 3, 2) and image_points.dtype == np.float64
+    np.testing.assert_array_equal(image_points[0, :2], [[10, 10], [20, 20]])
+    assert np.all(np.isnan(image_points[0, 2]))
+
+
+def test_a_marker_held_still_fills_its_cell_only_once():
+    capture = CalibrationCapture(2, 320, grid_size=10, max_per_cell=5)
+    for _ in range(0, 100):
+        capture.add([[100, 100], [200, 200]])
+
+    stats = capture.stats()
+    assert stats["count"] == 5
+    assert stats["redundant"] == 95
+    assert stats["offered"] == 100
+
+
+def test_a_new_cell_in_any_camera_is_enough():
+    capture = CalibrationCapture(2, 320, grid_size=10, max_per_cell=1)
+    capture.add([[100, 100], [200, 200]])
+
+    assert not capture.add([[101, 101], [201, 201]])
+    assert capture.add([[101, 101], [5, 5]])
+
+
+def test_stats_report_coverage_and_pairs():
+    capture = CalibrationCapture(3, 100, grid_size=2)
+    capture.add([[10, 10], [10, 10], [np.nan, np.nan]])
+    capture.add([[90, 90], [np.nan, np.nan], [90, 10]])
+
+    stats = capture.stats()
+    assert stats["observations"] == [2, 1, 1]
+    assert stats["pairs"] == [[2, 1, 1], [1, 1, 0], [1, 0, 1]]
+    assert stats["coverage"] == [0.5, 0.25, 0.25]
+
+
+def test_stops_at_capacity_and_resets():
+    capture = CalibrationCapture(2, 320, capacity=3, max_per_cell=100)
+    for i in range(0, 5):
+        capture.add([[i, i], [i, i]])
+    assert capture.stats()["count"] == 3 and capture.stats()["dropped"] == 2
+
+    capture.reset()
+    assert capture.stats()["count"] == 0
+    assert len(capture.image_points()) == 0
+    assert capture.add([[1, 1], [1, 1]])
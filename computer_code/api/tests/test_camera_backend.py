@@ -0,0 +1,38 @@
+import numpy as np
+import pytest
+from CameraBackend import CameraBackend, SyntheticCameraBackend, create_camera_backend
+
+
+def test_backend_without_read_cannot_be_constructed():
+    class NoRead(CameraBackend):
+        def _num_cameras(self):
+            return 1
+
+    with pytest.raises(TypeError):
+        NoRead()
+
+
+def test_synthetic_backend_opens_on_first_use():
+    backend = SyntheticCameraBackend(num_cameras=3, fps=None)
+    assert not backend.is_open
+
+    frames, timestamps = backend.read()
+
+    assert backend.is_open
+    assert len(frames) == 3 and len(timestamps) == 3
+    assert frames[0].shape == (240, 320, 3) and frames[0].dtype == np.uint8
+    assert np.count_nonzero(frames[0]) != 0
+
+
+def test_settings_are_per_camera_lists():
+    backend = SyntheticCameraBackend(num_cameras=2, fps=None)
+    backend.exposure = [50, 50]
+    backend.gain = 20
+
+    assert backend.exposure == [50, 50]
+    assert backend.gain == [20, 20]
+
+
+def test_unknown_backend_is_rejected():
+    with pytest.raises(ValueError):
+        create_camera_backend("nope")
@@ -0,0 +1,43 @@
+import numpy as np
+import pytest
+from FramePreprocessor import FramePreprocessor
+from BlobDetector import BlobDetector, blobs_to_image_points
+from CameraProcessPool import CameraProcessPool
+
+
+pytestmark = pytest.mark.parametrize("scene", [{"num_cameras": 2, "num_drones": 2}], indirect=True)
+
+
+@pytest.fixture
+def pool(scene):
+    pool = CameraProcessPool(scene.camera_rig.camera_models, BlobDetector(annotate=False))
+    yield pool
+    pool.close()
+
+
+def test_matches_in_process_pipeline(scene, pool):
+    blob_detector = BlobDetector(annotate=False)
+    for t in (0.0, 0.5):
+        frames = [scene.render(i, t) for i in range(0, 2)]
+
+        processed_frames, image_points = pool.process(frames, find_dots=True)
+
+        for i, frame in enumerate(frames):
+            expected_frame = FramePreprocessor(scene.camera_rig.camera_models[i]).process(frame).copy()
+            np.testing.assert_array_equal(processed_frames[i], expected_frame)
+            expected_points = blobs_to_image_points(blob_detector.detect(expected_frame))
+            assert image_points[i].dtype == np.float32
+            np.testing.assert_array_equal(image_points[i], expected_points)
+            assert len(expected_points) > 0
+
+
+def test_no_dots_and_restart_on_new_frame_size(scene, pool):
+    frames = [scene.render(i, 0.0) for i in range(0, 2)]
+    _, image_points = pool.process(frames, find_dots=False)
+    assert image_points == [None, None]
+
+    small_frames = [frame[:120, :160].copy() for frame in frames]
+    processed_frames, _ = pool.process(small_frames, find_dots=False)
+    assert pool.input_shape == (120, 160, 3)
+    assert processed_frames[0].shape == (160, 160, 3)
+    assert len(pool.workers) == 2
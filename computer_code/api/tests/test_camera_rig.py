@@ -0,0 +1,60 @@
+import numpy as np
+import pytest
+from CameraRig import CameraModel, CameraRig, posed_camera_models
+
+
+def test_camera_model_is_immutable(scene):
+    camera_model = scene.camera_rig.camera_models[0]
+
+    with pytest.raises(AttributeError):
+        camera_model.R = np.eye(3)
+    with pytest.raises(ValueError):
+        camera_model.P[0, 0] = 0
+
+
+def test_with_pose_and_focal_length_return_copies(scene):
+    camera_model = scene.camera_rig.camera_models[0]
+    R = np.array([[0, -1, 0], [1, 0, 0], [0, 0, 1]], dtype=np.float64)
+
+    posed = camera_model.with_pose(R, [1, 2, 3])
+    refocused = posed.with_focal_length(500)
+
+    np.testing.assert_array_equal(posed.R, R)
+    np.testing.assert_array_equal(posed.P, camera_model.intrinsic_matrix @ np.c_[R, [1, 2, 3]])
+    assert refocused.intrinsic_matrix[0, 0] == refocused.intrinsic_matrix[1, 1] == 500
+    np.testing.assert_array_equal(refocused.R, R)
+    assert camera_model.intrinsic_matrix[0, 0] != 500
+    assert posed.intrinsic_matrix[0, 0] != 500
+
+
+def test_fundamental_matrices_satisfy_epipolar_constraint(scene):
+    rng = np.random.default_rng(0)
+    rig = scene.camera_rig
+    object_points = np.c_[scene.world_to_rig(rng.uniform([-1, -1, 0.1], [1, 1, 1.2], (20, 3))), np.ones(20)]
+    projected = np.einsum("cij,nj->nci", rig.Ps, object_points)
+
+    for i in range(0, len(rig)):
+        np.testing.assert_array_equal(rig.fundamental_matrices[i, i], np.zeros((3, 3)))
+        for j in range(0, len(rig)):
+            if i != j:
+                x1 = projected[:, i] / projected[:, i, 2:]
+                x2 = projected[:, j] / projected[:, j, 2:]
+                F = rig.fundamental_matrices[i, j] / np.linalg.norm(rig.fundamental_matrices[i, j])
+                residuals = np.einsum("ni,ij,nj->n", x2, F, x1)
+                line_norms = np.linalg.norm(x1 @ F.T[:, :2], axis=1)
+                np.testing.assert_allclose(residuals / line_norms, 0, atol=1e-6)
+
+
+def test_posed_camera_models_applies_focal_length(scene):
+    camera_models = [CameraModel.from_params({"intrinsic_matrix": m.intrinsic_matrix, "distortion_coef": m.distortion_coef, "rotation": m.rotation}) for m in scene.camera_rig.camera_models]
+    camera_poses = [{"R": m.R, "t": m.t} for m in scene.camera_rig.camera_models]
+    camera_poses[1] = dict(camera_poses[1], focal_length=321.0)
+
+    posed_models = posed_camera_models(camera_models, camera_poses)
+    rig = CameraRig.from_poses(camera_models, camera_poses)
+
+    np.testing.assert_array_equal(posed_models[0].P, scene.camera_rig.Ps[0])
+    assert posed_models[1].intrinsic_matrix[0, 0] == 321.0
+    np.testing.assert_array_equal(posed_models[1].t, scene.camera_rig.camera_models[1].t)
+    np.testing.assert_array_equal(rig.Ps, [m.P for m in posed_models])
+    assert camera_models[1].intrinsic_matrix[0, 0] != 321.0
@@ -0,0 +1,69 @@
+import threading
+import time
+from CameraBackend import SyntheticCameraBackend
+from KalmanFilter import KalmanFilter
+from helpers import Cameras
+
+
+class FlakyBackend(SyntheticCameraBackend):
+    """ Fails on the reads in `failures`, and stalls for good after `num_reads`. """
+
+    def __init__(self, failures, num_reads):
+        super().__init__(num_cameras=2, fps=None)
+        self.failures = failures
+        self.num_reads = num_reads
+        self.reads = 0
+        self.stalled = threading.Event()
+
+    def _read(self):
+        self.reads += 1
+        if self.reads > self.num_reads:
+            self.stalled.set()
+            threading.Event().wait()
+        if self.reads in self.failures:
+            raise RuntimeError("camera unplugged")
+        return super()._read()
+
+
+def test_capture_loop_survives_failed_reads():
+    cameras = Cameras._decorated() # a fresh instance, not the app's singleton
+    cameras.capture_error_backoff = 0
+    backend = FlakyBackend(failures={2, 3}, num_reads=6)
+    cameras.set_camera_backend(backend)
+
+    cameras.start_capture_thread()
+
+    assert backend.stalled.wait(10)
+    assert cameras.capture_errors == 2
+    assert cameras.last_capture_error == "RuntimeError: camera unplugged"
+    assert cameras.metrics.summary()["frame"]["count"] == 4
+    assert cameras.get_metrics()["capture_errors"] == 2
+    assert cameras.capture_thread.is_alive()
+
+
+class RecordingTelemetry:
+    def __init__(self):
+        self.published = []
+
+    def publish(self, event, data):
+        self.published.append((event, data))
+
+
+def test_tracks_coast_and_retire_on_frames_without_blobs():
+    cameras = Cameras._decorated()
+    cameras.set_camera_backend(SyntheticCameraBackend(num_cameras=2, fps=None, num_points=0))
+    cameras.telemetry = RecordingTelemetry()
+    cameras.drone_armed = [False]
+    cameras.is_capturing_points = cameras.is_triangulating_points = cameras.is_locating_objects = True
+    cameras.kalman_filter = KalmanFilter(1, min_hits=1, max_coast_time=0.05)
+    cameras.kalman_filter.predict_location([{"pos": [0, 0, 1], "heading": 0, "droneIndex": 0}], time.time())
+
+    cameras._camera_read()
+    event, data = cameras.telemetry.published[-1]
+    assert event == "object-points"
+    assert [filtered_object["coasting"] for filtered_object in data["filtered_objects"]] == [True]
+
+    time.sleep(0.1)
+    cameras._camera_read()
+    assert cameras.telemetry.published[-1][1]["filtered_objects"] == []
+    assert len(cameras.kalman_filter.drone_indices) == 0
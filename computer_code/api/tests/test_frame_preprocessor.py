@@ -0,0 +1,50 @@
+import numpy as np
+import cv2 as cv
+import pytest
+from CameraRig import CameraModel, load_camera_models
+from FramePreprocessor import FramePreprocessor
+
+INPUT_SHAPE = (240, 320, 3)
+
+
+def rotated_preprocessor(rotation):
+    camera_model = load_camera_models(1)[0]
+    return FramePreprocessor(CameraModel(camera_model.intrinsic_matrix, camera_model.distortion_coef, rotation))
+
+
+@pytest.mark.parametrize("rotation", [0, 1, 2, 3])
+def test_bright_spot_lands_where_to_input_coordinates_says(rotation):
+    frame_preprocessor = rotated_preprocessor(rotation)
+    points = np.array([[160.0, 160.0], [100.0, 130.0], [220.0, 190.0]])
+    input_points = frame_preprocessor.to_input_coordinates(points, INPUT_SHAPE)
+
+    for point, (x, y) in zip(points, input_points):
+        frame = np.zeros(INPUT_SHAPE, dtype=np.uint8)
+        cv.circle(frame, (int(round(x)), int(round(y))), 2, (255, 255, 255), -1)
+
+        output = frame_preprocessor.process(frame)
+
+        assert output.shape == (320, 320, 3)
+        brightness = output.sum(axis=2).astype(np.float64)
+        ys, xs = np.nonzero(brightness > 0.5 * brightness.max())
+        center = np.average(np.c_[xs, ys], axis=0, weights=brightness[ys, xs])
+        np.testing.assert_allclose(center, point, atol=1.5)
+
+
+def test_padding_offset_maps_back_to_raw_frame_corner():
+    points = np.array([[0.0, 40.0]])
+    camera_model = load_camera_models(1)[0]
+    undistorted = CameraModel(camera_model.intrinsic_matrix, np.zeros(5), 0)
+
+    np.testing.assert_allclose(FramePreprocessor(undistorted).to_input_coordinates(points, INPUT_SHAPE), [[0, 0]], atol=1e-9)
+
+
+def test_padding_is_black_and_out_buffer_is_used():
+    frame_preprocessor = rotated_preprocessor(0)
+    frame = np.full(INPUT_SHAPE, 255, dtype=np.uint8)
+    out = np.empty((320, 320, 3), dtype=np.uint8)
+
+    result = frame_preprocessor.process(frame, out=out)
+
+    assert result is out
+    assert np.all(out[:20] == 0) and np.all(out[-20:] == 0)
@@ -0,0 +1,82 @@
+import os
+import numpy as np
+import pytest
+from FrameRecorder import FrameRecorder, FrameRecording, HEADER_SIZE
+from CameraBackend import ReplayCameraBackend
+
+FRAME_SHAPE = (24, 32, 3)
+
+
+def make_frames(i, num_cameras=2):
+    return [np.full(FRAME_SHAPE, (i * num_cameras + j) % 256, dtype=np.uint8) for j in range(0, num_cameras)]
+
+
+def record(path, num_frames, **options):
+    recorder = FrameRecorder(str(path), 2, FRAME_SHAPE, metadata={"num_objects": 1}, **options)
+    for i in range(0, num_frames):
+        recorder.append(make_frames(i), [i / 90, i / 90 + 0.001])
+    return recorder
+
+
+def test_round_trip(tmp_path):
+    path = tmp_path / "capture.mocap"
+    record(path, 10).close()
+
+    recording = FrameRecording(str(path))
+    assert len(recording) == 10
+    assert recording.metadata == {"num_objects": 1}
+    for i in range(0, 10):
+        frames, timestamps = recording[i]
+        assert all(np.array_equal(frame, expected) for frame, expected in zip(frames, make_frames(i)))
+        np.testing.assert_allclose(timestamps, [i / 90, i / 90 + 0.001])
+    with pytest.raises(IndexError):
+        recording[10]
+
+
+def test_file_grows_in_chunks(tmp_path):
+    path = tmp_path / "capture.mocap"
+    recorder = record(path, 5, chunk_frames=4)
+    slot_size = recorder.slot_dtype.itemsize
+
+    assert recorder.capacity == 8
+    assert os.path.getsize(path) == HEADER_SIZE + 8 * slot_size
+
+    recorder.close()
+    assert os.path.getsize(path) == HEADER_SIZE + 5 * slot_size
+
+
+def test_reader_follows_a_recording_in_progress(tmp_path):
+    path = tmp_path / "capture.mocap"
+    recorder = record(path, 3, chunk_frames=2)
+    recording = FrameRecording(str(path))
+    assert len(recording) == 3
+
+    for i in range(3, 7):
+        recorder.append(make_frames(i), [i / 90, i / 90])
+    assert len(recording) == 7
+    assert np.array_equal(recording[6][0][1], make_frames(6)[1])
+    recorder.close()
+
+
+def test_stops_after_max_duration(tmp_path):
+    recorder = record(tmp_path / "capture.mocap", 90, max_duration=0.5)
+    assert recorder.count == 45
+    assert not recorder.append(make_frames(0), [1.0, 1.0])
+    recorder.close()
+
+
+def test_replay_backend(tmp_path):
+    path = tmp_path / "capture.mocap"
+    record(path, 3).close()
+
+    backend = ReplayCameraBackend(str(path), speed=None, loop=False)
+    assert backend.num_cameras == 2
+    timestamps = []
+    for i in range(0, 3):
+        frames, frame_timestamps = backend.read()
+        assert np.array_equal(frames[0], make_frames(i)[0])
+        timestamps.append(frame_timestamps[0])
+    # shifted to the time of replay, keeping the spacing
+    np.testing.assert_allclose(np.diff(timestamps), 1 / 90, atol=1e-6)
+    with pytest.raises(EOFError):
+        backend.read()
@@ -0,0 +1,59 @@
+import threading
+import numpy as np
+from FrameRingBuffer import FrameRingBuffer
+
+
+def test_nothing_published():
+    assert FrameRingBuffer().latest() == (-1, None)
+
+
+def test_latest_is_a_copy_of_the_newest_frame():
+    ring_buffer = FrameRingBuffer(num_slots=2)
+    for value in range(0, 3):
+        sequence = ring_buffer.publish(np.full((4, 6), value, dtype=np.uint8), metadata={"value": value})
+
+    latest_sequence, frame = ring_buffer.latest()
+    ring_buffer.publish(np.full((4, 6), 9, dtype=np.uint8))
+
+    assert latest_sequence == sequence == 2
+    np.testing.assert_array_equal(frame, 2)
+    assert ring_buffer.metadata(2) == {"value": 2}
+    assert ring_buffer.metadata(1) is None # reused by frame 3
+    assert ring_buffer.metadata(-1) is None
+
+
+def test_frames_are_stacked_side_by_side_into_out():
+    ring_buffer = FrameRingBuffer()
+    out = np.empty((2, 5, 3), dtype=np.uint8)
+
+    ring_buffer.publish([np.zeros((2, 2, 3), dtype=np.uint8), np.ones((2, 3, 3), dtype=np.uint8)])
+    _, frame = ring_buffer.latest(out)
+
+    assert frame is out
+    np.testing.assert_array_equal(frame[:, :2], 0)
+    np.testing.assert_array_equal(frame[:, 2:], 1)
+
+    ring_buffer.publish(np.ones((3, 3), dtype=np.float32))
+    sequence, frame = ring_buffer.latest(out)
+    assert sequence == 1 and frame.shape == (3, 3) and frame.dtype == np.float32
+
+
+def test_concurrent_reader_never_sees_a_torn_frame():
+    ring_buffer = FrameRingBuffer(num_slots=2)
+    done = threading.Event()
+    torn = []
+
+    def read_loop():
+        while not done.is_set():
+            sequence, frame = ring_buffer.latest()
+            if frame is not None and not np.all(frame == sequence % 256):
+                torn.append(sequence)
+
+    reader = threading.Thread(target=read_loop)
+    reader.start()
+    for value in range(0, 2000):
+        ring_buffer.publish(np.full((120, 160), value % 256, dtype=np.uint8))
+    done.set()
+    reader.join()
+
+    assert torn == []
@@ -0,0 +1,122 @@
+import numpy as np
+import pytest
+from KalmanFilter import KalmanFilter
+
+
+def test_batched_update_matches_tracks_filtered_alone():
+    rng = np.random.default_rng(0)
+    dts = np.array([0.01, 0.02, 0.005])
+    measurements = rng.normal(size=(20, 3, 6))
+
+    batched = KalmanFilter(3)
+    for drone_index in range(0, 3):
+        batched.add_track(drone_index, timestamp=0)
+    for measurement in measurements:
+        batched.predict(np.arange(3), dts)
+        batched.correct(np.arange(3), measurement)
+
+    for i in range(0, 3):
+        alone = KalmanFilter(1)
+        alone.add_track(0, timestamp=0)
+        for measurement in measurements:
+            alone.predict(np.array([0]), dts[[i]])
+            alone.correct(np.array([0]), measurement[[i]])
+        np.testing.assert_allclose(batched.states[i], alone.states[0], atol=1e-12)
+        np.testing.assert_allclose(batched.covariances[i], alone.covariances[0], atol=1e-12)
+
+
+def test_predict_is_constant_acceleration():
+    kalman_filter = KalmanFilter(1)
+    kalman_filter.add_track(0, position=[1, 2, 3], timestamp=0)
+    kalman_filter.states[0, 3:9] = [1, 0, -1, 0, 2, 0]
+
+    state = kalman_filter.predict(np.array([0]), np.array([0.5]))[0]
+
+    np.testing.assert_allclose(state, [1.5, 2.25, 2.5, 1, 1, -1, 0, 2, 0])
+    np.testing.assert_allclose(kalman_filter.covariances[0], kalman_filter.covariances[0].T)
+    assert np.all(np.linalg.eigvalsh(kalman_filter.covariances[0]) > 0)
+
+
+def test_remove_track_keeps_the_others():
+    kalman_filter = KalmanFilter(3)
+    for drone_index in range(0, 3):
+        kalman_filter.add_track(drone_index, position=[drone_index, 0, 0], timestamp=0)
+
+    kalman_filter.remove_track(1)
+
+    np.testing.assert_array_equal(kalman_filter.drone_indices, [0, 2])
+    np.testing.assert_array_equal(kalman_filter.states[:, 0], [0, 2])
+    assert kalman_filter.low_pass_filter_xy.count == 2
+    kalman_filter.reset()
+    assert len(kalman_filter.states) == 0 and kalman_filter.heading_low_pass_filter.count == 0
+
+
+def located(drone_index, position, heading=0.0):
+    return {"pos": np.array(position, dtype=np.float64), "heading": heading, "droneIndex": drone_index}
+
+
+def track_positions(tracks):
+    return {track["droneIndex"]: track["pos"] for track in tracks}
+
+
+def test_track_reported_after_min_hits_then_coasts_and_retires():
+    kalman_filter = KalmanFilter(2, min_hits=3, max_coast_time=0.25)
+    dt = 1/60
+
+    assert kalman_filter.predict_location([located(0, [0, 0, 1])], 0*dt) == []
+    assert kalman_filter.predict_location([located(0, [0.01, 0, 1])], 1*dt) == []
+    tracks = kalman_filter.predict_location([located(0, [0.02, 0, 1])], 2*dt)
+    assert [track["droneIndex"] for track in tracks] == [0]
+    assert not tracks[0]["coasting"]
+
+    tracks = kalman_filter.predict_location([], 3*dt)
+    assert tracks[0]["coasting"]
+    assert tracks[0]["pos"][0] > 0.02
+
+    assert kalman_filter.predict_location([], 2*dt + 0.2)[0]["coasting"]
+    assert kalman_filter.predict_location([], 2*dt + 0.3) == []
+    assert len(kalman_filter.drone_indices) == 0
+
+    kalman_filter.predict_location([located(0, [1, 1, 1])], 1.0)
+    assert kalman_filter.hits.tolist() == [1]
+    assert kalman_filter.predict_location([located(2, [0, 0, 1])], 1.0 + dt) == []
+    np.testing.assert_array_equal(kalman_filter.drone_indices, [0])
+
+
+def test_far_object_is_gated_out():
+    kalman_filter = KalmanFilter(1, min_hits=1)
+    dt = 1/60
+    for k in range(0, 10):
+        kalman_filter.predict_location([located(0, [0.01*k, 0, 1])], k*dt)
+
+    tracks = kalman_filter.predict_location([located(0, [0.6, 0, 1])], 10*dt)
+    assert tracks[0]["coasting"]
+    assert tracks[0]["pos"][0] == pytest.approx(0.1, abs=0.01)
+
+    tracks = kalman_filter.predict_location([located(0, [0.115, 0, 1])], 11*dt)
+    assert not tracks[0]["coasting"]
+
+
+def test_identity_kept_when_layout_is_misread():
+    kalman_filter = KalmanFilter(2, min_hits=1)
+    dt = 1/60
+    for k in range(0, 30):
+        t = k*dt
+        first, second = [0.5*t, 0, 1], [0.5*t, 0.2, 1]
+        # every third frame the marker layouts are mistaken for each other
+        labels = (1, 0) if k % 3 == 2 else (0, 1)
+        tracks = track_positions(kalman_filter.predict_location([located(labels[0], first), located(labels[1], second)], t))
+
+    assert tracks[0][1] == pytest.approx(0, abs=0.01)
+    assert tracks[1][1] == pytest.approx(0.2, abs=0.01)
+
+
+def test_repeated_timestamps_stay_finite():
+    kalman_filter = KalmanFilter(1, min_hits=1)
+    for k, t in enumerate([0.0, 0.01, 0.01, 0.02, 0.015, 0.03]):
+        tracks = kalman_filter.predict_location([located(0, [0.01*k, 0, 1])], t)
+        assert np.all(np.isfinite(tracks[0]["pos"])) and np.all(np.isfinite(tracks[0]["vel"]))
+        assert not tracks[0]["coasting"]
+
+    assert np.all(np.isfinite(kalman_filter.covariances))
+    assert np.abs(kalman_filter.states[0, 3]) < 5
@@ -0,0 +1,49 @@
+import numpy as np
+from scipy.signal import sosfilt
+from LowPassFilter import LowPassFilter
+
+
+def signal(num_samples, dims, seed=0):
+    return np.random.default_rng(seed).normal(size=(num_samples, dims)).cumsum(axis=0)
+
+
+def test_streaming_matches_batch_filter():
+    low_pass_filter = LowPassFilter(5, 100, dims=3)
+    data = signal(200, 3)
+
+    filtered = np.array([low_pass_filter.filter(sample) for sample in data])
+
+    np.testing.assert_allclose(filtered, sosfilt(low_pass_filter.sos, data, axis=0), atol=1e-9)
+
+
+def test_banks_are_independent_and_advanced_by_index():
+    low_pass_filter = LowPassFilter(5, 100, dims=2, count=3)
+    data = [signal(50, 2, seed) for seed in range(0, 3)]
+
+    filtered = np.empty((3, 50, 2))
+    for k in range(0, 50):
+        filtered[[0, 2], k] = low_pass_filter.filter([data[0][k], data[2][k]], index=[0, 2])
+    for k in range(0, 50):
+        filtered[1, k] = low_pass_filter.filter(data[1][k], index=[1])[0]
+
+    for i in range(0, 3):
+        np.testing.assert_allclose(filtered[i], sosfilt(low_pass_filter.sos, data[i], axis=0), atol=1e-9)
+
+
+def test_reset_add_and_remove_banks():
+    low_pass_filter = LowPassFilter(5, 100, dims=2, count=2)
+    for sample in signal(20, 2):
+        low_pass_filter.filter([sample, -sample])
+
+    low_pass_filter.add()
+    assert low_pass_filter.count == 3
+    np.testing.assert_array_equal(low_pass_filter.zi[:, :, 2], 0)
+
+    kept = low_pass_filter.zi[:, :, 1].copy()
+    low_pass_filter.remove(0)
+    assert low_pass_filter.count == 2
+    np.testing.assert_array_equal(low_pass_filter.zi[:, :, 0], kept)
+
+    low_pass_filter.reset(0)
+    np.testing.assert_array_equal(low_pass_filter.zi[:, :, 0], 0)
+    assert low_pass_filter.filter([[1.0, 1.0], [0.0, 0.0]]).shape == (2, 2)
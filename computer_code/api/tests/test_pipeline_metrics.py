@@ -0,0 +1,44 @@
+import numpy as np
+import pytest
+from PipelineMetrics import PipelineMetrics
+
+
+def test_summary_in_milliseconds():
+    metrics = PipelineMetrics()
+    for duration in np.arange(1, 101) * 1e-3:
+        metrics.record("stage", duration)
+
+    summary = metrics.summary()["stage"]
+    assert summary["count"] == 100
+    assert summary["mean"] == pytest.approx(50.5)
+    assert summary["p50"] == pytest.approx(50.5)
+    assert summary["max"] == pytest.approx(100)
+
+
+def test_window_keeps_the_newest_samples_in_order():
+    metrics = PipelineMetrics(window=4)
+    for i in range(0, 10):
+        metrics.record("stage", i)
+
+    np.testing.assert_array_equal(metrics.get_samples("stage"), [6, 7, 8, 9])
+    assert metrics.summary()["stage"]["count"] == 10
+    assert metrics.summary()["stage"]["max"] == pytest.approx(9e3)
+
+
+def test_stage_timer_times_consecutive_stages():
+    metrics = PipelineMetrics()
+    timer = metrics.timer()
+    timer("first")
+    timer("second")
+
+    assert list(metrics.summary()) == ["first", "second"]
+    assert all(len(metrics.get_samples(name)) == 1 for name in ("first", "second"))
+
+
+def test_reset():
+    metrics = PipelineMetrics()
+    metrics.record("stage", 1)
+    metrics.reset()
+
+    assert metrics.summary() == {}
+    assert len(metrics.get_samples("stage")) == 0
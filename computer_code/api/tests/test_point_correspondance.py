@@ -0,0 +1,82 @@
+import numpy as np
+import pytest
+from PipelineMetrics import PipelineMetrics
+from helpers import find_point_correspondance_and_object_points
+
+
+DRONES = {"num_drones": 3, "radius": 0.6}
+
+
+def distances_to_truth(scene, object_points, t):
+    truth = scene.world_to_rig(scene.marker_points(t))
+    return np.linalg.norm(object_points[:, np.newaxis] - truth[np.newaxis], axis=2)
+
+
+@pytest.mark.parametrize("seed", [0, 1, 2])
+def test_recovers_every_marker_without_ghosts(make_scene, seed):
+    scene = make_scene(**DRONES, noise=0.3, seed=seed)
+    for t in np.linspace(0, 2, 5):
+        errors, object_points, _ = find_point_correspondance_and_object_points(scene.image_points(t), scene.camera_rig)
+
+        distances = distances_to_truth(scene, object_points, t)
+        assert len(object_points) == distances.shape[1]
+        assert np.all(distances.min(axis=0) < 0.01)
+        assert len(set(np.argmin(distances, axis=1))) == len(object_points)
+        assert np.all(errors < 1)
+
+
+def test_marker_missed_by_first_camera_is_still_found(make_scene):
+    scene = make_scene(**DRONES)
+    image_points = scene.image_points(0.5)
+    image_points[0] = image_points[0][1:]
+
+    errors, object_points, _ = find_point_correspondance_and_object_points(image_points, scene.camera_rig)
+
+    distances = distances_to_truth(scene, object_points, 0.5)
+    assert np.all(distances.min(axis=0) < 1e-3)
+    assert len(object_points) == distances.shape[1]
+
+
+def test_point_seen_by_one_camera_is_not_triangulated(make_scene):
+    scene = make_scene(**DRONES)
+    image_points = scene.image_points(0.0)
+    image_points[2] = np.concatenate((image_points[2], [[5.0, 5.0], [np.nan, np.nan]]))
+
+    _, object_points, _ = find_point_correspondance_and_object_points(image_points, scene.camera_rig)
+
+    assert np.all(distances_to_truth(scene, object_points, 0.0).min(axis=1) < 1e-3)
+
+
+def test_no_points(scene):
+    errors, object_points, _ = find_point_correspondance_and_object_points([np.empty((0, 2))]*4, scene.camera_rig)
+
+    assert len(errors) == 0
+    assert object_points.shape == (0, 3)
+
+
+def test_collects_epipolar_lines(make_scene):
+    scene = make_scene(**DRONES)
+    image_points = scene.image_points(0.0)
+    epipolar_lines = [[] for _ in range(0, 4)]
+
+    find_point_correspondance_and_object_points(image_points, scene.camera_rig, epipolar_lines=epipolar_lines)
+
+    assert epipolar_lines[0] == []
+    lines = epipolar_lines[1][0]
+    assert lines.shape == (len(image_points[0]), 3)
+    points_h = np.c_[image_points[1], np.ones(len(image_points[1]))]
+    distances = np.abs(lines @ points_h.T) / np.linalg.norm(lines[:, :2], axis=1)[:, np.newaxis]
+    assert np.all(distances.min(axis=1) < 1e-6)
+
+
+def test_stages_are_timed_back_to_back(make_scene):
+    scene = make_scene(**DRONES)
+    metrics = PipelineMetrics()
+    timer = metrics.timer()
+    start = timer.start
+
+    find_point_correspondance_and_object_points(scene.image_points(0.0), scene.camera_rig, timer=timer)
+
+    assert list(metrics.summary()) == ["correspondence", "triangulation"]
+    total = metrics.get_samples("correspondence")[0] + metrics.get_samples("triangulation")[0]
+    assert total == pytest.approx(timer.start - start)
@@ -0,0 +1,66 @@
+import numpy as np
+import pytest
+from FrameRingBuffer import FrameRingBuffer
+from PreviewEncoder import PreviewEncoder, PreviewOptions
+
+
+def make_encoder(num_cameras=2):
+    frame_buffer = FrameRingBuffer()
+    frames = [np.full((24, 32, 3), 50 * i, dtype=np.uint8) for i in range(0, num_cameras)]
+    frame_buffer.publish(frames, {"num_cameras": num_cameras, "image_points": [np.array([[10, 10]], dtype=np.float32)] * num_cameras})
+    return PreviewEncoder(frame_buffer)
+
+
+def test_options_from_query():
+    options = PreviewOptions.from_query({"scale": "0.5", "quality": "60", "cameras": "0,2", "annotations": "off"})
+
+    assert (options.scale, options.quality, options.cameras, options.annotations) == (0.5, 60, (0, 2), False)
+    with pytest.raises(ValueError):
+        PreviewOptions.from_query({"scale": "2"})
+    with pytest.raises(ValueError):
+        PreviewOptions.from_query({"quality": "0"})
+
+
+def test_viewers_with_the_same_options_share_an_encode():
+    encoder = make_encoder()
+    options = PreviewOptions(scale=0.5)
+    encoder.add_viewer(options)
+    encoder.add_viewer(PreviewOptions(scale=0.5, fps=5))
+
+    first = encoder.encode(options)
+    second = encoder.encode(PreviewOptions(scale=0.5, fps=5))
+
+    assert first == second and first[1].startswith(b"\xff\xd8")
+    assert encoder.stats()["encodes"] == 1 and encoder.stats()["shared"] == 1
+
+
+def test_selected_cameras_at_scale():
+    import cv2 as cv
+    encoder = make_encoder(num_cameras=3)
+    _, jpeg = encoder.encode(PreviewOptions(scale=0.5, cameras=[1, 2], annotations=False))
+
+    image = cv.imdecode(np.frombuffer(jpeg, np.uint8), cv.IMREAD_COLOR)
+    assert image.shape == (12, 32, 3)
+
+
+def test_removing_the_last_viewer_of_options_drops_their_state():
+    encoder = make_encoder()
+    viewer_ids = [encoder.add_viewer(PreviewOptions(quality=quality)) for quality in range(1, 11)]
+    for quality in range(1, 11):
+        encoder.encode(PreviewOptions(quality=quality))
+    shared = encoder.add_viewer(PreviewOptions(quality=1))
+
+    for viewer_id in viewer_ids:
+        encoder.remove_viewer(viewer_id)
+
+    assert list(encoder.encoded) == list(encoder.encode_locks) == [PreviewOptions(quality=1).key]
+    encoder.remove_viewer(shared)
+    assert encoder.encoded == {} and encoder.encode_locks == {}
+    assert encoder.num_viewers == 0
+
+
+def test_encoding_without_a_viewer_keeps_nothing():
+    encoder = make_encoder()
+    encoder.encode(PreviewOptions())
+
+    assert encoder.encoded == {} and encoder.encode_locks == {}
@@ -0,0 +1,55 @@
+import numpy as np
+import cv2 as cv
+import pytest
+from helpers import calculate_reprojection_error, calculate_reprojection_errors, calculate_reprojection_errors_batch
+
+
+pytestmark = pytest.mark.parametrize("scene", [{"num_cameras": 3}], indirect=True)
+
+
+def observations(scene, num_points=30, seed=0):
+    rng = np.random.default_rng(seed)
+    object_points = scene.world_to_rig(rng.uniform([-1, -1, 0.1], [1, 1, 1.2], (num_points, 3)))
+    image_points = np.empty((num_points, 3, 2))
+    for i, camera_model in enumerate(scene.camera_rig.camera_models):
+        projected, _ = cv.projectPoints(object_points, cv.Rodrigues(camera_model.R)[0], camera_model.t, camera_model.intrinsic_matrix, np.array([]))
+        image_points[:, i] = projected[:, 0]
+
+    return object_points, image_points + rng.normal(0, 1, image_points.shape)
+
+
+def test_matches_opencv_projection(scene):
+    object_points, image_points = observations(scene)
+
+    errors, mask = calculate_reprojection_errors_batch(image_points, None, object_points, scene.camera_rig.Ps)
+
+    assert np.all(mask)
+    for i, camera_model in enumerate(scene.camera_rig.camera_models):
+        projected, _ = cv.projectPoints(object_points, cv.Rodrigues(camera_model.R)[0], camera_model.t, camera_model.intrinsic_matrix, np.array([]))
+        np.testing.assert_allclose(errors[:, i], np.mean((image_points[:, i] - projected[:, 0])**2, axis=1), rtol=1e-6)
+
+
+def test_unobserved_and_missing_points_are_nan(scene):
+    object_points, image_points = observations(scene, num_points=3)
+    image_points[0, 1] = np.nan
+    object_points[2] = np.nan
+    mask = np.ones((3, 3), dtype=bool)
+    mask[1, 2] = False
+
+    errors, applied_mask = calculate_reprojection_errors_batch(image_points, mask, object_points, scene.camera_rig.Ps)
+
+    expected_mask = np.array([[True, False, True], [True, True, False], [False, False, False]])
+    np.testing.assert_array_equal(applied_mask, expected_mask)
+    np.testing.assert_array_equal(np.isnan(errors), ~expected_mask)
+
+
+def test_per_point_errors_skip_points_seen_once(scene):
+    object_points, image_points = observations(scene, num_points=4)
+    image_points[1, 1:] = np.nan
+
+    errors = calculate_reprojection_errors(image_points, object_points, scene.camera_poses)
+    batch_errors, _ = calculate_reprojection_errors_batch(image_points, None, object_points, scene.camera_rig.Ps)
+
+    np.testing.assert_allclose(errors, np.nanmean(batch_errors[[0, 2, 3]], axis=1))
+    assert calculate_reprojection_error(image_points[1], object_points[1], scene.camera_poses) is None
+    assert calculate_reprojection_error(image_points[0], object_points[0], scene.camera_poses) == pytest.approx(errors[0])
@@ -0,0 +1,73 @@
+import numpy as np
+import pytest
+from scipy.spatial.transform import Rotation
+from SyntheticScene import synthetic_rigid_bodies
+from RigidBodyRegistry import RigidBody, RigidBodyRegistry, kabsch
+from helpers import locate_objects
+
+
+def place(rigid_body, position, yaw, tilt=0.0):
+    R = Rotation.from_euler("zx", [yaw, tilt]).as_matrix()
+    return rigid_body.marker_points @ R.T + position
+
+
+def test_kabsch_recovers_pose():
+    rng = np.random.default_rng(0)
+    body_points = rng.normal(size=(5, 3))
+    R = Rotation.from_rotvec([0.3, -0.2, 1.1]).as_matrix()
+    t = np.array([1.0, -2.0, 0.5])
+
+    fitted_R, fitted_t, rms = kabsch(body_points, body_points @ R.T + t)
+
+    np.testing.assert_allclose(fitted_R, R, atol=1e-9)
+    np.testing.assert_allclose(fitted_t, t, atol=1e-9)
+    assert rms < 1e-9
+
+
+def test_locates_drones_from_shuffled_noisy_points():
+    rng = np.random.default_rng(1)
+    rigid_bodies = synthetic_rigid_bodies(3)
+    poses = [(np.array([0.5, 0.0, 1.0]), 0.4), (np.array([-0.5, 0.3, 1.2]), -1.0), (np.array([0.0, -0.6, 0.8]), 2.5)]
+    object_points = np.concatenate([place(rigid_body, *pose) for rigid_body, pose in zip(rigid_bodies, poses)])
+    object_points = np.concatenate((object_points + rng.normal(0, 0.002, object_points.shape), [[2.0, 2.0, 2.0]]))
+    order = rng.permutation(len(object_points))
+    errors = np.arange(len(object_points), dtype=np.float64)[order]
+
+    objects = RigidBodyRegistry(rigid_bodies).locate(object_points[order], errors)
+
+    assert sorted(o["droneIndex"] for o in objects) == [0, 1, 2]
+    for o in objects:
+        position, yaw = poses[o["droneIndex"]]
+        np.testing.assert_allclose(o["pos"], position, atol=0.005)
+        assert o["heading"] == pytest.approx(-yaw, abs=0.05)
+        assert o["fit_error"] < 0.005
+        assert o["error"] == pytest.approx(np.mean(3*o["droneIndex"] + np.arange(3)))
+
+
+def test_mirrored_default_layouts_are_told_apart_by_yaw():
+    registry = RigidBodyRegistry.default()
+
+    for yaw in (-1.2, 0.0, 1.2):
+        objects = registry.locate(place(registry.rigid_bodies[1], [0, 0, 1], yaw), np.zeros(3))
+        assert [o["droneIndex"] for o in objects] == [1]
+
+
+def test_rejects_tilted_fits_and_too_few_points():
+    rigid_body = synthetic_rigid_bodies(3)[2]
+    registry = RigidBodyRegistry([rigid_body])
+
+    assert registry.locate(place(rigid_body, [0, 0, 1], 0.0, tilt=1.2), np.zeros(3)) == []
+    assert len(registry.locate(place(rigid_body, [0, 0, 1], 0.0, tilt=0.5), np.zeros(3))) == 1
+    assert registry.locate(place(rigid_body, [0, 0, 1], 0.0)[:2], np.zeros(2)) == []
+    assert registry.locate(np.empty((0, 3)), np.empty(0)) == []
+
+
+def test_add_replaces_layout_and_locate_objects_uses_registry():
+    registry = RigidBodyRegistry.default()
+    layout = RigidBody(1, [[0.1, 0, 0], [-0.1, 0, 0], [0, 0.2, 0], [0, -0.05, 0]])
+    registry.add(layout)
+
+    assert [rigid_body.drone_index for rigid_body in registry.rigid_bodies] == [0, 1]
+    objects = locate_objects(place(layout, [0, 0, 1], 0.3), np.zeros(4), registry)
+    assert [o["droneIndex"] for o in objects] == [1]
+    assert locate_objects(place(registry.rigid_bodies[0], [0, 0, 1], 0.3), np.zeros(3))[0]["droneIndex"] == 0
@@ -0,0 +1,70 @@
+import numpy as np
+import pytest
+from RoiTracker import RoiTracker
+
+IMAGE_SHAPE = (320, 320, 3)
+
+
+pytestmark = pytest.mark.parametrize("scene", [{"num_cameras": 3}], indirect=True)
+
+
+def contains(windows, point):
+    x, y = point
+    return np.any((windows[:, 0] <= x) & (x < windows[:, 2]) & (windows[:, 1] <= y) & (y < windows[:, 3]))
+
+
+def test_windows_follow_constant_velocity_prediction(scene, project):
+    roi_tracker = RoiTracker()
+    start = scene.world_to_rig(np.array([[0.0, 0.0, 0.5]]))[0]
+    velocity = np.array([0.9, 0.0, 0.0])
+
+    assert roi_tracker.get_windows(scene.camera_rig, IMAGE_SHAPE, 0.0) is None
+    roi_tracker.update([start], 0.0)
+    roi_tracker.get_windows(scene.camera_rig, IMAGE_SHAPE, 0.01)
+    roi_tracker.update([start + velocity*0.01], 0.01)
+    np.testing.assert_allclose(roi_tracker.velocities, [velocity])
+
+    windows = roi_tracker.get_windows(scene.camera_rig, IMAGE_SHAPE, 0.02)
+
+    assert len(windows) == 3
+    for camera_windows, image_point in zip(windows, project(scene.camera_rig.Ps, start + velocity*0.02)[0]):
+        assert camera_windows.dtype == np.int64 and len(camera_windows) == 1
+        assert contains(camera_windows, image_point)
+        x0, y0, x1, y1 = camera_windows[0]
+        assert 2*8 <= x1 - x0 <= 2*64 + 1
+
+
+def test_lost_marker_forces_full_scan(scene):
+    roi_tracker = RoiTracker()
+    object_points = scene.world_to_rig(np.array([[0.0, 0.0, 0.5], [0.3, 0.0, 0.5]]))
+    roi_tracker.update(object_points, 0.0)
+    assert roi_tracker.get_windows(scene.camera_rig, IMAGE_SHAPE, 0.01) is not None
+
+    roi_tracker.update([object_points[0], [np.nan]*3], 0.01)
+
+    assert roi_tracker.get_windows(scene.camera_rig, IMAGE_SHAPE, 0.02) is None
+
+
+def test_periodic_full_scan(scene):
+    roi_tracker = RoiTracker(full_scan_interval=3)
+    object_points = scene.world_to_rig(np.array([[0.0, 0.0, 0.5]]))
+    roi_tracker.update(object_points, 0.0)
+
+    full_scans = []
+    for frame in range(1, 9):
+        full_scans.append(roi_tracker.get_windows(scene.camera_rig, IMAGE_SHAPE, frame*0.01) is None)
+        roi_tracker.update(object_points, frame*0.01)
+
+    assert full_scans == [False, False, False, True, False, False, False, True]
+
+
+def test_points_behind_or_off_camera_get_no_window(scene):
+    roi_tracker = RoiTracker()
+    camera_model = scene.camera_rig.camera_models[0]
+    camera_center = -camera_model.R.T @ camera_model.t
+    behind = camera_center - camera_model.R[2]
+    roi_tracker.update([behind], 0.0)
+
+    windows = roi_tracker.get_windows(scene.camera_rig, IMAGE_SHAPE, 0.01)
+
+    assert windows[0].shape == (0, 4)
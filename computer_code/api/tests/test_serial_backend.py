@@ -0,0 +1,43 @@
+import os
+import pytest
+from SerialBackend import LazySerial, PtySerial, create_serial_backend
+from SerialProtocol import SerialEncoder, SerialDecoder, MSG_ARM
+
+
+def test_lazy_serial_does_not_open_until_written():
+    ser = create_serial_backend("serial", "/dev/does-not-exist")
+
+    assert isinstance(ser, LazySerial)
+    assert ser.ser is None
+    ser.close()
+
+
+def test_null_serial_counts_bytes():
+    ser = create_serial_backend("null")
+
+    assert ser.write(b"abc") == 3
+    assert ser.bytes_written == 3
+
+
+def test_pty_serial_delivers_frames_and_drops_when_full():
+    ser = PtySerial()
+    assert ser.master is None
+    frame = SerialEncoder().arm(1, True)
+
+    ser.write(frame)
+    assert SerialDecoder().feed(os.read(ser.slave, 4096)) == [(MSG_ARM, 1, 0, (1,))]
+
+    # nobody is reading, so the writes start dropping instead of blocking
+    for _ in range(0, 100000):
+        ser.write(frame)
+        if ser.bytes_dropped:
+            break
+    assert ser.bytes_dropped > 0
+
+    ser.close()
+    assert ser.master is None
+
+
+def test_unknown_backend_is_rejected():
+    with pytest.raises(ValueError):
+        create_serial_backend("usb")
@@ -0,0 +1,95 @@
+import struct
+import numpy as np
+import pytest
+from SerialProtocol import (SerialEncoder, SerialDecoder, encode, crc16, SYNC, MAX_FRAME_SIZE,
+                            MSG_POSE, MSG_ARM, MSG_SETPOINT, MSG_PID, MSG_TRIM)
+
+
+def sample_frames():
+    encoder = SerialEncoder()
+    frames = [
+        encoder.pose(0, [1.5, -0.25, 0.75], 0.5, [0.1, 0.2, -0.3]),
+        encoder.arm(1, True),
+        encoder.setpoint(2, [0.5, -0.5, 1.0]),
+        encoder.pid(0, np.arange(17)),
+        encoder.trim(3, [-10, 20, 0, 5.0]),
+        encoder.arm(0, False),
+    ]
+    expected = [
+        (MSG_POSE, 0, 0, tuple(np.float32([1.5, -0.25, 0.75, 0.5, 0.1, 0.2, -0.3]))),
+        (MSG_ARM, 1, 0, (1,)),
+        (MSG_SETPOINT, 2, 0, (0.5, -0.5, 1.0)),
+        (MSG_PID, 0, 1, tuple(np.float32(np.arange(17)))),
+        (MSG_TRIM, 3, 0, (-10, 20, 0, 5)),
+        (MSG_ARM, 0, 2, (0,)),
+    ]
+    return frames, expected
+
+
+def test_crc_is_ccitt_false():
+    assert crc16(b"123456789") == 0x29b1
+
+
+def test_round_trip():
+    frames, expected = sample_frames()
+    decoder = SerialDecoder()
+
+    assert decoder.feed(b"".join(frames)) == expected
+    assert decoder.crc_errors == 0
+    assert all(len(frame) <= MAX_FRAME_SIZE for frame in frames)
+
+
+@pytest.mark.parametrize("chunk_size", [1, 3, 7, 64])
+def test_arbitrary_chunking(chunk_size):
+    frames, expected = sample_frames()
+    stream = b"".join(frames)
+    decoder = SerialDecoder()
+
+    messages = []
+    for i in range(0, len(stream), chunk_size):
+        messages += decoder.feed(stream[i:i+chunk_size])
+
+    assert messages == expected
+    assert len(decoder.buffer) < len(SYNC)
+
+
+def test_corrupted_frame_is_dropped_and_stream_resyncs():
+    frames, expected = sample_frames()
+    corrupted = bytearray(frames[2])
+    corrupted[-4] ^= 0x01 # a payload bit
+    decoder = SerialDecoder()
+
+    messages = decoder.feed(frames[0] + frames[1] + bytes(corrupted) + b"\xaa\x00garbage\xaa" + b"".join(frames[3:]))
+
+    assert messages == expected[:2] + expected[3:]
+    assert decoder.crc_errors == 1
+
+
+def test_bad_length_and_unknown_type_are_skipped():
+    frames, expected = sample_frames()
+    unknown_type = SYNC + struct.pack("<BBHB", 99, 0, 0, 0)
+    wrong_length = bytearray(frames[1])
+    wrong_length[6] = 3
+    decoder = SerialDecoder()
+
+    messages = decoder.feed(unknown_type + bytes(wrong_length) + frames[0])
+
+    assert messages == expected[:1]
+    assert decoder.crc_errors == 2
+
+
+def test_sync_bytes_inside_payload():
+    frame = encode(MSG_TRIM, 0, 0x55aa, 0x55aa, 0, 0, 0)
+    assert frame.count(SYNC) > 1
+
+    assert SerialDecoder().feed(frame + frame) == [(MSG_TRIM, 0, 0x55aa, (0x55aa, 0, 0, 0))]*2
+
+
+def test_sequences_are_per_drone_and_wrap():
+    encoder = SerialEncoder()
+    encoder.sequences[0] = 0xffff
+    decoder = SerialDecoder()
+
+    sequences = [message[2] for message in decoder.feed(encoder.arm(0, True) + encoder.arm(0, True) + encoder.arm(1, True))]
+
+    assert sequences == [0xffff, 0, 0]
@@ -0,0 +1,226 @@
+import threading
+import time
+import pytest
+from SerialProtocol import SerialDecoder, MSG_ARM, MSG_POSE, MSG_SETPOINT
+from SerialWriter import SerialWriter
+
+
+class BlockingSerial:
+    """ Holds every write until released, and can be made to fail. """
+
+    def __init__(self):
+        self.release = threading.Event()
+        self.writing = threading.Event()
+        self.fail = False
+        self.written = bytearray()
+
+    def write(self, data):
+        self.writing.set()
+        self.release.wait()
+        if self.fail:
+            raise OSError("device disconnected")
+        self.written += data
+        return len(data)
+
+
+def wait_for(condition, timeout=2):
+    deadline = time.time() + timeout
+    while not condition():
+        assert time.time() < deadline, "timed out"
+        time.sleep(0.001)
+
+
+def received(ser):
+    return SerialDecoder().feed(bytes(ser.written))
+
+
+@pytest.fixture
+def blocked_writer():
+    """ A writer stuck in the write of a pose, so everything posted next queues up. """
+    ser = BlockingSerial()
+    writer = SerialWriter(ser, retry_interval=0.001)
+    writer.pose(0, [0, 0, 0], 0, [0, 0, 0])
+    ser.writing.wait(2)
+    yield writer, ser
+    ser.release.set()
+    ser.fail = False
+    writer.close()
+
+
+def test_disarm_after_arm_leaves_the_drone_disarmed(blocked_writer):
+    writer, ser = blocked_writer
+    writer.arm(0, True)
+    writer.arm(0, False)
+
+    ser.release.set()
+    wait_for(lambda: writer.stats()["queue_depth"] == 0 and writer.stats()["writes"] == 2)
+
+    arms = [values[0] for message_type, drone_index, _, values in received(ser) if message_type == MSG_ARM]
+    assert arms[-1] == 0
+    assert writer.stats()["arms_cancelled"] == 1
+
+
+def test_control_messages_keep_their_order(blocked_writer):
+    writer, ser = blocked_writer
+    writer.arm(0, True)
+    writer.setpoint(0, [1, 2, 3])
+    writer.arm(1, True)
+    writer.setpoint(0, [4, 5, 6])
+
+    ser.release.set()
+    wait_for(lambda: writer.stats()["writes"] == 2)
+
+    messages = [(message_type, drone_index, values) for message_type, drone_index, _, values in received(ser) if message_type != MSG_POSE]
+    assert messages == [
+        (MSG_ARM, 0, (1,)),
+        (MSG_SETPOINT, 0, (1, 2, 3)),
+        (MSG_ARM, 1, (1,)),
+        (MSG_SETPOINT, 0, (4, 5, 6)),
+    ]
+
+
+def test_disarm_goes_ahead_of_queued_messages(blocked_writer):
+    writer, ser = blocked_writer
+    writer.setpoint(0, [1, 2, 3])
+    writer.arm(1, False)
+
+    ser.release.set()
+    wait_for(lambda: writer.stats()["writes"] == 2)
+
+    messages = [(message_type, drone_index) for message_type, drone_index, _, _ in received(ser) if message_type != MSG_POSE]
+    assert messages == [(MSG_ARM, 1), (MSG_SETPOINT, 0)]
+
+
+def test_disarm_is_never_dropped():
+    ser = BlockingSerial()
+    writer = SerialWriter(ser, max_queue_size=2)
+    writer.pose(0, [0, 0, 0], 0, [0, 0, 0])
+    ser.writing.wait(2)
+    for i in range(0, 5):
+        writer.setpoint(0, [i, 0, 0])
+    writer.arm(0, False)
+    assert writer.stats()["dropped"] == 3
+
+    ser.release.set()
+    wait_for(lambda: writer.stats()["queue_depth"] == 0 and writer.stats()["writes"] == 2)
+    writer.close()
+
+    arms = [values for message_type, _, _, values in received(ser) if message_type == MSG_ARM]
+    assert arms == [(0,)]
+
+
+def test_failed_writes_are_retried_in_order(blocked_writer):
+    writer, ser = blocked_writer
+    ser.fail = True
+    writer.arm(0, True)
+    writer.setpoint(0, [1, 2, 3])
+    ser.release.set()
+    wait_for(lambda: writer.stats()["write_errors"] >= 2)
+
+    ser.fail = False
+    wait_for(lambda: writer.stats()["writes"] >= 1 and writer.stats()["queue_depth"] == 0)
+
+    messages = [(message_type, values) for message_type, _, _, values in received(ser) if message_type != MSG_POSE]
+    assert messages == [(MSG_ARM, (1,)), (MSG_SETPOINT, (1, 2, 3))]
+
+
+def test_retry_does_not_rearm_a_disarmed_drone(blocked_writer):
+    writer, ser = blocked_writer
+    ser.fail = True
+    writer.arm(0, True)
+    ser.release.set()
+    wait_for(lambda: writer.stats()["write_errors"] >= 2)
+
+    # hold a retry of the arm, queue a disarm meanwhile and let that retry fail too
+    ser.release.clear()
+    ser.writing.clear()
+    ser.writing.wait(2)
+    writer.arm(0, False)
+    write_errors = writer.stats()["write_errors"]
+    ser.release.set()
+    wait_for(lambda: writer.stats()["write_errors"] > write_errors)
+
+    ser.fail = False
+    wait_for(lambda: writer.stats()["queue_depth"] == 0 and writer.stats()["writes"] >= 1)
+
+    arms = [values[0] for message_type, _, _, values in received(ser) if message_type == MSG_ARM]
+    assert arms == [0]
+
+
+def test_bad_messages_are_rejected_when_posted():
+    ser = BlockingSerial()
+    ser.release.set()
+    writer = SerialWriter(ser)
+
+    with pytest.raises(ValueError):
+        writer.trim(0, [40000, 0, 0, 0])
+    with pytest.raises(ValueError):
+        writer.pid(0, [1.0]*16)
+    writer.arm(0, False)
+
+    wait_for(lambda: writer.stats()["queue_depth"] == 0 and writer.stats()["writes"] == 1)
+    writer.close()
+    assert [(message_type, values) for message_type, _, _, values in received(ser)] == [(MSG_ARM, (0,))]
+
+
+def test_message_that_fails_to_encode_does_not_stop_the_writer(blocked_writer):
+    writer, ser = blocked_writer
+    with writer.condition:
+        writer.control_queue.append((False, writer.encoder.trim, 0, ([40000, 0, 0, 0],), time.time()))
+    writer.arm(0, False)
+
+    ser.release.set()
+    wait_for(lambda: writer.stats()["queue_depth"] == 0 and writer.stats()["writes"] == 2)
+
+    assert writer.thread.is_alive()
+    assert writer.stats()["invalid"] == 1
+    assert [values for message_type, _, _, values in received(ser) if message_type == MSG_ARM] == [(0,)]
+
+
+def test_stale_messages_expire_but_disarms_do_not(capsys):
+    ser = BlockingSerial()
+    ser.fail = True
+    ser.release.set()
+    writer = SerialWriter(ser, retry_interval=0.001, max_retry_age=0.05)
+    writer.arm(0, True)
+    writer.setpoint(0, [1, 2, 3])
+    writer.arm(1, False)
+    wait_for(lambda: writer.stats()["expired"] == 2)
+
+    write_errors = writer.stats()["write_errors"]
+    ser.fail = False
+    wait_for(lambda: writer.stats()["queue_depth"] == 0 and writer.stats()["writes"] == 1)
+    writer.close()
+
+    assert [(message_type, drone_index, values) for message_type, drone_index, _, values in received(ser)] == [(MSG_ARM, 1, (0,))]
+    assert write_errors > 2
+    assert capsys.readouterr().out.count("serial write failed") == 1
+    assert writer.stats()["last_write_error"] is None
+
+
+def test_only_the_newest_pose_is_written(blocked_writer):
+    writer, ser = blocked_writer
+    for i in range(0, 10):
+        writer.pose(0, [i, 0, 0], 0, [0, 0, 0])
+
+    ser.release.set()
+    wait_for(lambda: writer.stats()["pending_poses"] == 0 and writer.stats()["writes"] == 2)
+
+    poses = [values[0] for message_type, _, _, values in received(ser) if message_type == MSG_POSE]
+    assert poses == [0, 9]
+    assert writer.stats()["poses_coalesced"] == 9
+
+
+def test_latency_is_measured_from_capture_to_write(blocked_writer):
+    writer, ser = blocked_writer
+    writer.pose(1, [0, 0, 0], 0, [0, 0, 0], capture_time=time.time() - 0.05)
+
+    ser.release.set()
+    wait_for(lambda: writer.stats()["pending_poses"] == 0 and writer.stats()["writes"] == 2)
+
+    latency = writer.latency_stats()
+    # the fixture's pose has no capture time, so drone 0 is never measured
+    assert list(latency) == ["drone 1"]
+    assert latency["drone 1"]["count"] == 1
+    assert 50 <= latency["drone 1"]["p50"] < 1000
+    assert latency["drone 1"]["jitter"] == 0
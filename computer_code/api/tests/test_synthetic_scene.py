@@ -0,0 +1,42 @@
+import numpy as np
+import pytest
+from BlobDetector import BlobDetector, blobs_to_image_points
+
+
+SCENE = {"num_cameras": 3, "num_drones": 2}
+
+
+def test_same_seed_gives_the_same_observations(make_scene):
+    first, second = make_scene(**SCENE, noise=0.5, dropout=0.2, false_positives=1, seed=3), make_scene(**SCENE, noise=0.5, dropout=0.2, false_positives=1, seed=3)
+
+    for t in (0.0, 0.1, 0.2):
+        for a, b in zip(first.image_points(t), second.image_points(t)):
+            np.testing.assert_array_equal(a, b)
+
+
+def test_rendered_frames_detect_back_to_the_image_points(make_scene):
+    scene = make_scene(**SCENE)
+    blob_detector = BlobDetector(annotate=False)
+
+    for i in range(0, 3):
+        image_points = scene.image_points(0.3)[i]
+        processed = scene.frame_preprocessors[i].process(scene.render(i, 0.3))
+        detected = blobs_to_image_points(blob_detector.detect(processed))
+
+        # markers that are close together in the image merge into one blob
+        separations = np.linalg.norm(image_points[:, np.newaxis] - image_points[np.newaxis], axis=2) + np.diag([np.inf]*len(image_points))
+        isolated = image_points[separations.min(axis=1) > 10]
+        assert len(isolated) >= 2
+        distances = np.linalg.norm(isolated[:, np.newaxis] - detected[np.newaxis], axis=2)
+        assert np.all(distances.min(axis=1) < 0.5)
+
+
+def test_drone_states_follow_the_trajectories(make_scene):
+    scene = make_scene(**SCENE)
+
+    states = scene.drone_states(2.0)
+
+    assert [drone_index for drone_index, _, _ in states] == [0, 1]
+    for _, position, _ in states:
+        assert np.linalg.norm(position[:2]) == pytest.approx(0.5)
+    np.testing.assert_allclose(scene.marker_points(2.0).mean(axis=0)[:2], 0, atol=0.1)
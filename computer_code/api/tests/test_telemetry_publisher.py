@@ -0,0 +1,88 @@
+import json
+import threading
+import time
+import numpy as np
+from PipelineMetrics import PipelineMetrics
+from TelemetryPublisher import TelemetryPublisher, encode_object_points, to_json
+
+
+class RecordingSocketIO:
+    def __init__(self):
+        self.events = []
+        self.release = threading.Event()
+        self.release.set()
+
+    def emit(self, event, data):
+        self.release.wait()
+        self.events.append((event, data))
+
+
+def wait_for(condition, timeout=2):
+    deadline = time.time() + timeout
+    while not condition():
+        assert time.time() < deadline, "timed out"
+        time.sleep(0.001)
+
+
+def test_latest_data_wins():
+    socketio = RecordingSocketIO()
+    socketio.release.clear()
+    telemetry = TelemetryPublisher(socketio, rate=1000)
+    telemetry.publish("fps", {"fps": 0})
+    wait_for(lambda: telemetry.stats()["pending"] == 0)
+
+    # the first is being emitted, these pile up behind it
+    for fps in range(1, 10):
+        telemetry.publish("fps", {"fps": fps})
+    socketio.release.set()
+    wait_for(lambda: telemetry.stats()["sent"] == 2)
+    telemetry.close()
+
+    assert socketio.events == [("fps", {"fps": 0}), ("fps", {"fps": 9})]
+    assert telemetry.stats()["replaced"] == 8
+
+
+def test_callable_data_is_built_on_the_publisher_thread_and_emits_are_timed():
+    socketio = RecordingSocketIO()
+    telemetry = TelemetryPublisher(socketio, rate=1000)
+    metrics = PipelineMetrics()
+    telemetry.set_metrics(metrics)
+
+    threads = []
+    telemetry.publish("metrics", lambda: threads.append(threading.current_thread()) or {"p99": np.float64(1.5)})
+    wait_for(lambda: telemetry.stats()["sent"] == 1)
+    telemetry.close()
+
+    assert threads == [telemetry.thread]
+    assert socketio.events == [("metrics", {"p99": 1.5})]
+    assert len(metrics.get_samples("telemetry emit")) == 1
+
+
+def test_failed_emits_are_counted():
+    class FailingSocketIO:
+        def emit(self, event, data):
+            raise ConnectionError("gone")
+
+    telemetry = TelemetryPublisher(FailingSocketIO(), rate=1000)
+    telemetry.publish("fps", {"fps": 1})
+    wait_for(lambda: telemetry.stats()["errors"] == 1)
+    telemetry.close()
+
+
+def test_to_json_replaces_nan_with_null():
+    value = {"a": np.array([1.0, np.nan], dtype=np.float32), "b": (np.int64(3), [float("nan")])}
+    assert json.dumps(to_json(value)) == '{"a": [1.0, null], "b": [3, [null]]}'
+
+
+def test_object_points_are_float32_rows():
+    encoded = encode_object_points({
+        "object_points": np.array([[1, 2, 3], [4, 5, 6]]),
+        "errors": [0.5, 0.25],
+        "objects": [{"pos": [1, 2, 3], "heading": 0.5, "error": 0.1, "fit_error": 0.2, "droneIndex": 1}],
+        "filtered_objects": []
+    })
+
+    np.testing.assert_array_equal(np.frombuffer(encoded["object_points"], "<f4").reshape((-1, 3)), [[1, 2, 3], [4, 5, 6]])
+    np.testing.assert_array_equal(np.frombuffer(encoded["errors"], "<f4"), [0.5, 0.25])
+    np.testing.assert_allclose(np.frombuffer(encoded["objects"], "<f4"), [1, 2, 3, 0.5, 0.1, 0.2, 1], rtol=1e-6)
+    assert encoded["filtered_objects"] == b""
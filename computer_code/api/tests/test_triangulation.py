@@ -0,0 +1,68 @@
+import numpy as np
+from helpers import triangulate_points, triangulate_points_batch
+
+
+def reference_dlt(Ps, image_points):
+    """ The original one point at a time DLT, over the cameras that saw the point. """
+    A = []
+    for P, image_point in zip(Ps, image_points):
+        A.append(image_point[1]*P[2,:] - P[1,:])
+        A.append(P[0,:] - image_point[0]*P[2,:])
+
+    A = np.array(A).reshape((len(Ps)*2, 4))
+    U, s, Vh = np.linalg.svd(A.T @ A, full_matrices=False)
+
+    return Vh[3,0:3] / Vh[3,3]
+
+
+def random_points(scene, num_points, seed=0):
+    rng = np.random.default_rng(seed)
+    return scene.world_to_rig(rng.uniform([-1, -1, 0.1], [1, 1, 1.2], (num_points, 3)))
+
+
+def test_matches_the_single_point_dlt(scene, project):
+    rng = np.random.default_rng(1)
+    Ps = scene.camera_rig.Ps
+    image_points = project(Ps, random_points(scene, 100)) + rng.normal(0, 0.5, (100, 4, 2))
+    image_points[rng.random((100, 4)) < 0.3] = np.nan
+
+    object_points, valid = triangulate_points_batch(image_points, None, Ps)
+
+    for i in range(0, len(image_points)):
+        seen = ~np.any(np.isnan(image_points[i]), axis=1)
+        assert valid[i] == (np.sum(seen) >= 2)
+        if valid[i]:
+            np.testing.assert_allclose(object_points[i], reference_dlt(Ps[seen], image_points[i, seen]), rtol=1e-6, atol=1e-9)
+        else:
+            assert np.all(np.isnan(object_points[i]))
+
+
+def test_recovers_noise_free_points(scene, project):
+    true_points = random_points(scene, 50)
+    object_points, valid = triangulate_points_batch(project(scene.camera_rig.Ps, true_points), None, scene.camera_rig.Ps)
+
+    assert np.all(valid)
+    np.testing.assert_allclose(object_points, true_points, atol=1e-6)
+
+
+def test_mask_leaves_out_cameras(scene, project):
+    Ps = scene.camera_rig.Ps
+    true_points = random_points(scene, 10)
+    image_points = project(Ps, true_points)
+    image_points[:, 3] += 50 # way off in the last camera
+
+    mask = np.ones((10, 4), dtype=bool)
+    mask[:, 3] = False
+    object_points, _ = triangulate_points_batch(image_points, mask, Ps)
+
+    np.testing.assert_allclose(object_points, true_points, atol=1e-6)
+
+
+def test_triangulate_points_takes_poses(scene, project):
+    true_points = random_points(scene, 5)
+    image_points = project(scene.camera_rig.Ps, true_points)
+
+    # uses the cameras' calibrated models, the same as the scene's first four
+    object_points = triangulate_points(image_points.tolist(), scene.camera_poses)
+
+    np.testing.assert_allclose(object_points, true_points, atol=1e-6)
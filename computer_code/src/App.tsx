@@ -15,6 +15,7 @@ import { matrix, mean, multiply, rotationMatrix } from 'mathjs';
 import Objects from './components/Objects';
 import Chart from './components/chart';
 import TrajectoryPlanningSetpoints from './components/TrajectoryPlanningSetpoints';
+import { decodeObjectPoints } from './shared/styles/scripts/telemetry';
 
 const TRAJECTORY_PLANNING_TIMESTEP = 0.05
 const LAND_Z_HEIGHT = 0.075
@@ -27,7 +28,7 @@ export default function App() {
   const [gain, setGain] = useState(0);
 
   const [capturingPointsForPose, setCapturingPointsForPose] = useState(false);
-  const [capturedPointsForPose, setCapturedPointsForPose] = useState("");
+  const [calibrationCapture, setCalibrationCapture] = useState({ count: 0, coverage: [] as number[] });
 
   const [isTriangulatingPoints, setIsTriangulatingPoints] = useState(false);
   const [isLocatingObjects, setIsLocatingObjects] = useState(false);
@@ -71,20 +72,21 @@ export default function App() {
 
   const capturePointsForPose = async (startOrStop: string) => {
     if (startOrStop === "start") {
-      setCapturedPointsForPose("")
+      setCalibrationCapture({ count: 0, coverage: [] })
     }
     socket.emit("capture-points", { startOrStop })
   }
 
   useEffect(() => {
-    socket.on("image-points", (data) => {
-      setCapturedPointsForPose(`${capturedPointsForPose}${JSON.stringify(data)},`)
+    // the points themselves stay on the server
+    socket.on("calibration-capture", (data) => {
+      setCalibrationCapture(data)
     })
 
     return () => {
-      socket.off("image-points")
+      socket.off("calibration-capture")
     }
-  }, [capturedPointsForPose])
+  }, [])
 
   useEffect(() => {
     let count = 0
@@ -235,7 +237,8 @@ export default function App() {
   }, [objectPointCount])
 
   useEffect(() => {
-    socket.on("object-points", (data) => {
+    socket.on("object-points", (payload) => {
+      const data = decodeObjectPoints(payload)
       objectPoints.current.push(data["object_points"])
       if (data["filtered_objects"].length != 0) {
         filteredObjects.current.push(data["filtered_objects"])
@@ -323,18 +326,8 @@ export default function App() {
     }
   }
 
-  const calculateCameraPose = async (cameraPoints: Array<Array<Array<number>>>) => {
-    socket.emit("calculate-camera-pose", { cameraPoints })
-  }
-
-  const isValidJson = (str: string) => {
-    try {
-      const o = JSON.parse(str);
-      if (o && typeof o === "object") {
-        return true;
-      }
-    } catch (e) { }
-    return false;
+  const calculateCameraPose = async () => {
+    socket.emit("calculate-camera-pose", {})
   }
 
   const startLiveMocap = (startOrStop: string) => {
@@ -523,11 +516,12 @@ export default function App() {
                   size='sm'
                   className='float-end'
                   variant="outline-primary"
-                  disabled={!(isValidJson(`[${capturedPointsForPose.slice(0, -1)}]`) && JSON.parse(`[${capturedPointsForPose.slice(0, -1)}]`).length !== 0)}
+                  disabled={calibrationCapture.count === 0}
                   onClick={() => {
-                    calculateCameraPose(JSON.parse(`[${capturedPointsForPose.slice(0, -1)}]`))
+                    calculateCameraPose()
                   }}>
-                  Calculate Camera Pose with {isValidJson(`[${capturedPointsForPose.slice(0, -1)}]`) ? JSON.parse(`[${capturedPointsForPose.slice(0, -1)}]`).length : 0} points
+                  Calculate Camera Pose with {calibrationCapture.count} points
+                  {calibrationCapture.coverage.length !== 0 && ` (coverage ${calibrationCapture.coverage.map(x => `${Math.round(x * 100)}%`).join(", ")})`}
                 </Button>
               </Col>
             </Row>
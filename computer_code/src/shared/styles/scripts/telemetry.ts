@@ -0,0 +1,31 @@
+// Point clouds arrive as float32 typed arrays, see api/TelemetryPublisher.py for the layouts
+
+const toRows = (buffer: ArrayBuffer, width: number): number[][] => {
+  const values = new Float32Array(buffer)
+  const rows = []
+  for (let i = 0; i < values.length; i += width) {
+    rows.push(Array.from(values.subarray(i, i + width)))
+  }
+  return rows
+}
+
+export const decodeObjectPoints = (data: { [key: string]: ArrayBuffer }) => {
+  return {
+    object_points: toRows(data["object_points"], 3),
+    errors: Array.from(new Float32Array(data["errors"])),
+    objects: toRows(data["objects"], 7).map(([x, y, z, heading, error, fit_error, droneIndex]) => ({
+      pos: [x, y, z],
+      heading,
+      error,
+      fit_error,
+      droneIndex
+    })),
+    filtered_objects: toRows(data["filtered_objects"], 9).map(([x, y, z, vx, vy, vz, heading, droneIndex, coasting]) => ({
+      pos: [x, y, z],
+      vel: [vx, vy, vz],
+      heading,
+      droneIndex,
+      coasting: coasting !== 0
+    }))
+  }
+}
@@ -1,7 +1,6 @@
 #include <esp_now.h>
 #include <esp_wifi.h>
 #include <WiFi.h>
-#include <ArduinoJson.h>
 #include <PID_v1.h>
 #include <stdint.h>
 #include <EEPROM.h>
@@ -24,8 +23,6 @@ bfs::SbusData data;
 bool armed = false;
 unsigned long timeArmed = 0;
 
-StaticJsonDocument<1024> json;
-
 int xTrim = 0, yTrim = 0, zTrim = 0, yawTrim = 0;
 
 double groundEffectCoef = 28, groundEffectOffset = -0.035;
@@ -71,51 +68,110 @@ float sbusFrequency = 50.0;
   uint8_t newMACAddress[] = { 0xC0, 0x4E, 0x30, 0x4B, 0x80, 0x3B };
 #endif
 
+// Frames from the computer, relayed by the sender (see computer_code/api/SerialProtocol.py):
+//   sync (0xAA 0x55) | type | drone index | sequence (2) | payload length | payload | crc (2)
+#define HEADER_SIZE 7
+#define CRC_SIZE 2
+
+#define MSG_POSE 1
+#define MSG_ARM 2
+#define MSG_SETPOINT 3
+#define MSG_PID 4
+#define MSG_TRIM 5
+
+struct __attribute__((packed)) PoseMessage { float pos[4]; float vel[3]; };
+struct __attribute__((packed)) ArmMessage { uint8_t armed; };
+struct __attribute__((packed)) SetpointMessage { float setpoint[3]; };
+struct __attribute__((packed)) PidMessage { float pid[17]; };
+struct __attribute__((packed)) TrimMessage { int16_t trim[4]; };
+
+uint16_t lastSequence = 0;
+
+// CRC-16/CCITT-FALSE over the frame, excluding the sync bytes
+uint16_t crc16(const uint8_t *data, int length) {
+  uint16_t crc = 0xFFFF;
+  for (int i = 0; i < length; i++) {
+    crc ^= (uint16_t)data[i] << 8;
+    for (int j = 0; j < 8; j++) {
+      crc = crc & 0x8000 ? (crc << 1) ^ 0x1021 : crc << 1;
+    }
+  }
+  return crc;
+}
+
 // callback function that will be executed when data is received
 void OnDataRecv(const uint8_t *mac, const uint8_t *incomingData, int len) {
-  // Serial.println((char*)incomingData);
-  DeserializationError err = deserializeJson(json, (char *)incomingData);
-
-  if (err) {
-    Serial.print("failed to parse json");
+  if (len < HEADER_SIZE + CRC_SIZE || incomingData[0] != 0xAA || incomingData[1] != 0x55) {
+    Serial.print("bad frame");
     return;
   }
 
-  if (json.containsKey("pos") && json.containsKey("vel")) {
-    xPos = json["pos"][0];
-    yPos = json["pos"][1];
-    zPos = json["pos"][2];
-    yawPos = json["pos"][3];
-
-    xVel = json["vel"][0];
-    yVel = json["vel"][1];
-    zVel = json["vel"][2];
-  } else if (json.containsKey("armed")) {
-    if (json["armed"] != armed && json["armed"]) {
+  uint8_t type = incomingData[2];
+  uint8_t droneIndex = incomingData[3];
+  uint16_t sequence = incomingData[4] | (incomingData[5] << 8);
+  int payloadLength = incomingData[6];
+  int crcIndex = HEADER_SIZE + payloadLength;
+  if (len != crcIndex + CRC_SIZE || droneIndex != DRONE_INDEX) {
+    Serial.print("bad frame");
+    return;
+  }
+  uint16_t crc = incomingData[crcIndex] | (incomingData[crcIndex + 1] << 8);
+  if (crc != crc16(&incomingData[2], crcIndex - 2)) {
+    Serial.print("bad crc");
+    return;
+  }
+  lastSequence = sequence;
+
+  const uint8_t *payload = &incomingData[HEADER_SIZE];
+
+  if (type == MSG_POSE && payloadLength == sizeof(PoseMessage)) {
+    PoseMessage message;
+    memcpy(&message, payload, sizeof(message));
+    xPos = message.pos[0];
+    yPos = message.pos[1];
+    zPos = message.pos[2];
+    yawPos = message.pos[3];
+
+    xVel = message.vel[0];
+    yVel = message.vel[1];
+    zVel = message.vel[2];
+  } else if (type == MSG_ARM && payloadLength == sizeof(ArmMessage)) {
+    ArmMessage message;
+    memcpy(&message, payload, sizeof(message));
+    if (message.armed != armed && message.armed) {
       timeArmed = millis();
     }
-    armed = json["armed"];
-  } else if (json.containsKey("setpoint")) {
-    xPosSetpoint = json["setpoint"][0];
-    yPosSetpoint = json["setpoint"][1];
-    zPosSetpoint = json["setpoint"][2];
-  } else if (json.containsKey("pid")) {
-    xPosPID.SetTunings(json["pid"][0], json["pid"][1], json["pid"][2]);
-    yPosPID.SetTunings(json["pid"][0], json["pid"][1], json["pid"][2]);
-    zPosPID.SetTunings(json["pid"][3], json["pid"][4], json["pid"][5]);
-    yawPosPID.SetTunings(json["pid"][6], json["pid"][7], json["pid"][8]);
-
-    xVelPID.SetTunings(json["pid"][9], json["pid"][10], json["pid"][11]);
-    yVelPID.SetTunings(json["pid"][9], json["pid"][10], json["pid"][11]);
-    zVelPID.SetTunings(json["pid"][12], json["pid"][13], json["pid"][14]);
-
-    groundEffectCoef = json["pid"][15];
-    groundEffectOffset = json["pid"][16];
-  } else if (json.containsKey("trim")) {
-    xTrim = json["trim"][0];
-    yTrim = json["trim"][1];
-    zTrim = json["trim"][2];
-    yawTrim = json["trim"][3];
+    armed = message.armed;
+  } else if (type == MSG_SETPOINT && payloadLength == sizeof(SetpointMessage)) {
+    SetpointMessage message;
+    memcpy(&message, payload, sizeof(message));
+    xPosSetpoint = message.setpoint[0];
+    yPosSetpoint = message.setpoint[1];
+    zPosSetpoint = message.setpoint[2];
+  } else if (type == MSG_PID && payloadLength == sizeof(PidMessage)) {
+    PidMessage message;
+    memcpy(&message, payload, sizeof(message));
+    xPosPID.SetTunings(message.pid[0], message.pid[1], message.pid[2]);
+    yPosPID.SetTunings(message.pid[0], message.pid[1], message.pid[2]);
+    zPosPID.SetTunings(message.pid[3], message.pid[4], message.pid[5]);
+    yawPosPID.SetTunings(message.pid[6], message.pid[7], message.pid[8]);
+
+    xVelPID.SetTunings(message.pid[9], message.pid[10], message.pid[11]);
+    yVelPID.SetTunings(message.pid[9], message.pid[10], message.pid[11]);
+    zVelPID.SetTunings(message.pid[12], message.pid[13], message.pid[14]);
+
+    groundEffectCoef = message.pid[15];
+    groundEffectOffset = message.pid[16];
+  } else if (type == MSG_TRIM && payloadLength == sizeof(TrimMessage)) {
+    TrimMessage message;
+    memcpy(&message, payload, sizeof(message));
+    xTrim = message.trim[0];
+    yTrim = message.trim[1];
+    zTrim = message.trim[2];
+    yawTrim = message.trim[3];
+  } else {
+    Serial.print("unknown message");
+    return;
   }
 
   lastPing = micros();
@@ -67,22 +67,74 @@ void setup() {
   }
 }
 
-char buffer[1024];
-void loop() {
-  int availableBytes = Serial.available();
-  if (availableBytes) {
-    int droneIndex = Serial.read() - '0';
-    Serial.readBytes(buffer, availableBytes-1);
-    buffer[availableBytes-1] = '\0';
-    Serial.printf("\n drone index %d: ", droneIndex);
-    Serial.print(buffer);
-
-    esp_err_t result = esp_now_send(broadcastAddresses[droneIndex], (uint8_t *)&buffer, strlen(buffer) + 1);
-    if (result) {
-      Serial.println(esp_err_to_name(result));
+// Frames from the computer (see computer_code/api/SerialProtocol.py):
+//   sync (0xAA 0x55) | type | drone index | sequence (2) | payload length | payload | crc (2)
+// Each complete frame with a valid crc is forwarded as is to its drone.
+#define SYNC_0 0xAA
+#define SYNC_1 0x55
+#define HEADER_SIZE 7
+#define CRC_SIZE 2
+#define MAX_PAYLOAD_SIZE 68
+#define NUM_DRONES (sizeof(broadcastAddresses) / sizeof(broadcastAddresses[0]))
+
+uint8_t frame[HEADER_SIZE + MAX_PAYLOAD_SIZE + CRC_SIZE];
+int frameLength = 0;
+
+// CRC-16/CCITT-FALSE over the frame, excluding the sync bytes
+uint16_t crc16(const uint8_t *data, int length) {
+  uint16_t crc = 0xFFFF;
+  for (int i = 0; i < length; i++) {
+    crc ^= (uint16_t)data[i] << 8;
+    for (int j = 0; j < 8; j++) {
+      crc = crc & 0x8000 ? (crc << 1) ^ 0x1021 : crc << 1;
     }
   }
-  else {
+  return crc;
+}
+
+void onFrame() {
+  int payloadLength = frame[6];
+  int crcIndex = HEADER_SIZE + payloadLength;
+  uint16_t crc = frame[crcIndex] | (frame[crcIndex + 1] << 8);
+  if (crc != crc16(&frame[2], crcIndex - 2)) {
+    Serial.println("bad crc");
+    return;
+  }
+
+  int droneIndex = frame[3];
+  if (droneIndex >= NUM_DRONES) {
+    return;
+  }
+
+  esp_err_t result = esp_now_send(broadcastAddresses[droneIndex], frame, crcIndex + CRC_SIZE);
+  if (result) {
+    Serial.println(esp_err_to_name(result));
+  }
+}
+
+void loop() {
+  if (!Serial.available()) {
     yield();
+    return;
+  }
+
+  while (Serial.available()) {
+    uint8_t c = Serial.read();
+
+    // wait for the sync bytes, then collect the header and the rest of the frame
+    if ((frameLength == 0 && c != SYNC_0) || (frameLength == 1 && c != SYNC_1)) {
+      frameLength = c == SYNC_0 ? 1 : 0;
+      continue;
+    }
+    frame[frameLength++] = c;
+
+    if (frameLength == HEADER_SIZE && frame[6] > MAX_PAYLOAD_SIZE) {
+      frameLength = 0;
+      continue;
+    }
+    if (frameLength >= HEADER_SIZE && frameLength == HEADER_SIZE + frame[6] + CRC_SIZE) {
+      onFrame();
+      frameLength = 0;
+    }
   }
 }